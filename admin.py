@@ -1,47 +1,29 @@
+import json
 from functools import wraps
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file, abort
 from flask_login import login_required, current_user
 from datetime import datetime
-from models import db, User, Racer, Race, RaceResult, Location, Championship, Album, MediaItem
-import boto3
-import os
-import uuid
-from werkzeug.utils import secure_filename
+from sqlalchemy.orm import aliased
+from models import db, User, Racer, Race, RaceResult, Location, Championship, Album, MediaItem, MediaBlob
+from passwords import hash_stats, PasswordHashBusy
+from database import pool_stats
+from instrumentation import list_profiles, profile_path
+from grids import grid_response, options_response, contains
+from laps import parse_laps
+from stats import recalculate_stats, get_weather_condition
+import export
+import importer
+import live
+import records
+from auth import invalidate_user
+from media import StreamingUpload, UploadRejected, store_upload, public_url, canonical_url, storage_key_from_url, dedup_stats, format_bytes
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
-def get_r2_client():
-    """Get configured R2 client"""
-    return boto3.client(
-        's3',
-        endpoint_url=os.environ.get('R2_ENDPOINT_URL'),
-        aws_access_key_id=os.environ.get('R2_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY'),
-        region_name='auto'
-    )
-
 def upload_to_r2(file, folder='media'):
-    """Upload file to R2 and return public URL"""
+    """Upload file to R2 and return the MediaBlob holding its content"""
     try:
-        filename = secure_filename(file.filename)
-        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-        unique_filename = f"{folder}/{uuid.uuid4().hex}.{ext}"
-
-        r2_client = get_r2_client()
-        bucket_name = os.environ.get('R2_BUCKET_NAME')
-
-        r2_client.upload_fileobj(
-            file,
-            bucket_name,
-            unique_filename,
-            ExtraArgs={
-                'ContentType': file.content_type,
-                'CacheControl': 'public, max-age=31536000'
-            }
-        )
-
-        public_url = os.environ.get('R2_PUBLIC_URL')
-        return f"{public_url}/{unique_filename}"
+        return store_upload(file, folder)
     except Exception as e:
         print(f"Error uploading to R2: {e}")
         raise
@@ -73,7 +55,12 @@ def dashboard():
         'albums': Album.query.count(),
         'users': User.query.count()
     }
-    return render_template('admin/dashboard.html', stats=stats)
+    password_stats = hash_stats()
+    media_stats = dedup_stats()
+    media_stats['storage_saved'] = format_bytes(media_stats['storage_saved_bytes'])
+    media_stats['egress_saved'] = format_bytes(media_stats['egress_saved_bytes'])
+    return render_template('admin/dashboard.html', stats=stats, media_stats=media_stats,
+                           password_stats=password_stats)
 
 
 # ============== RACERS ==============
@@ -82,8 +69,7 @@ def dashboard():
 @login_required
 @admin_required
 def racers():
-    racers_list = Racer.query.order_by(Racer.name).all()
-    return render_template('admin/racers.html', racers=racers_list)
+    return render_template('admin/racers.html')
 
 
 @admin.route('/racers', methods=['POST'])
@@ -158,134 +144,7 @@ def delete_racer(id):
 @admin_required
 def recalculate_racer_stats():
     """Recalculate wins, podiums, total races, best laps, and location fastest laps"""
-    from models import RacerBestLap, LocationFastestLap
-
-    def parse_lap_time(lap_time_str):
-        try:
-            if ':' in lap_time_str:
-                parts = lap_time_str.split(':')
-                minutes = int(parts[0])
-                seconds = float(parts[1])
-                return minutes * 60 + seconds
-            else:
-                return float(lap_time_str)
-        except (ValueError, TypeError, IndexError):
-            return None
-
-    def get_weather_condition(weather):
-        weather = (weather or '').lower()
-        wet_conditions = ['chuvoso', 'molhado', 'wet', 'rain', 'chuva']
-        indoor_conditions = ['indoor', 'coberto', 'fechado']
-
-        if any(cond in weather for cond in indoor_conditions):
-            return 'indoor'
-        elif any(cond in weather for cond in wet_conditions):
-            return 'wet'
-        else:
-            return 'dry'
-
-    racers = Racer.query.all()
-    locations = Location.query.all()
-    updated_count = 0
-    best_laps_count = 0
-    location_fastest_count = 0
-
-    RacerBestLap.query.delete()
-    LocationFastestLap.query.delete()
-
-    for racer in racers:
-        results = RaceResult.query.filter_by(racer_id=racer.id).all()
-
-        total_races = len(results)
-        wins = sum(1 for r in results if r.position == 1)
-        podiums = sum(1 for r in results if r.position is not None and r.position <= 3)
-
-        racer.total_races = total_races
-        racer.wins = wins
-        racer.podium_finishes = podiums
-        updated_count += 1
-
-        for location in locations:
-            location_results = db.session.query(RaceResult, Race).join(
-                Race, RaceResult.race_id == Race.id
-            ).filter(
-                RaceResult.racer_id == racer.id,
-                Race.location_id == location.id,
-                RaceResult.lap_time_best.isnot(None),
-                RaceResult.lap_time_best != '',
-                RaceResult.lap_time_best != '-'
-            ).all()
-
-            if location_results:
-                condition_bests = {'dry': (None, None), 'wet': (None, None), 'indoor': (None, None)}
-
-                for result, race in location_results:
-                    condition = get_weather_condition(race.weather)
-                    time_seconds = parse_lap_time(result.lap_time_best)
-
-                    if time_seconds is not None:
-                        current_best_time, current_best_lap = condition_bests[condition]
-                        if current_best_time is None or time_seconds < current_best_time:
-                            condition_bests[condition] = (time_seconds, result.lap_time_best)
-
-                for condition, (best_time, best_lap_str) in condition_bests.items():
-                    if best_lap_str:
-                        best_lap = RacerBestLap(
-                            racer_id=racer.id,
-                            location_id=location.id,
-                            condition=condition,
-                            best_lap=best_lap_str,
-                            best_lap_seconds=best_time
-                        )
-                        db.session.add(best_lap)
-                        best_laps_count += 1
-
-    # Calculate fastest lap per location per condition (dry/wet/indoor)
-    for location in locations:
-        races = Race.query.filter_by(location_id=location.id).all()
-
-        # Group races by condition
-        condition_races = {'dry': [], 'wet': [], 'indoor': []}
-        for race in races:
-            condition = get_weather_condition(race.weather)
-            condition_races[condition].append(race.id)
-
-        # Find fastest for each condition
-        for condition, race_ids in condition_races.items():
-            if not race_ids:
-                continue
-
-            results = db.session.query(RaceResult, Racer).join(
-                Racer, RaceResult.racer_id == Racer.id
-            ).filter(
-                RaceResult.race_id.in_(race_ids),
-                RaceResult.lap_time_best.isnot(None),
-                RaceResult.lap_time_best != '',
-                RaceResult.lap_time_best != '-'
-            ).all()
-
-            best_time = None
-            best_lap_str = None
-            best_racer_id = None
-
-            for result, racer in results:
-                time_seconds = parse_lap_time(result.lap_time_best)
-                if time_seconds is not None and (best_time is None or time_seconds < best_time):
-                    best_time = time_seconds
-                    best_lap_str = result.lap_time_best
-                    best_racer_id = racer.id
-
-            if best_lap_str and best_racer_id:
-                fastest = LocationFastestLap(
-                    location_id=location.id,
-                    condition=condition,
-                    racer_id=best_racer_id,
-                    best_lap=best_lap_str,
-                    best_lap_seconds=best_time
-                )
-                db.session.add(fastest)
-                location_fastest_count += 1
-
+    updated_count, best_laps_count, location_fastest_count = recalculate_stats()
     db.session.commit()
 
     return jsonify({
@@ -349,12 +208,7 @@ def bulk_delete_racers():
 @login_required
 @admin_required
 def races():
-    races_list = Race.query.order_by(Race.date.desc()).all()
-    locations = Location.query.order_by(Location.name).all()
-    championships = Championship.query.order_by(Championship.name).all()
-    racers = Racer.query.order_by(Racer.name).all()
-    return render_template('admin/races.html', races=races_list, locations=locations,
-                         championships=championships, racers=racers)
+    return render_template('admin/races.html')
 
 
 @admin.route('/races', methods=['POST'])
@@ -381,6 +235,7 @@ def create_race():
         championship_id=int(data.get('championship_id')) if data.get('championship_id') else None,
         track_name=data.get('track_name'),
         weather=data.get('weather'),
+        condition=get_weather_condition(data.get('weather')),
         total_laps=int(data.get('total_laps')) if data.get('total_laps') else None,
         winner_id=int(data.get('winner_id')) if data.get('winner_id') else None
     )
@@ -397,6 +252,7 @@ def create_race():
 def update_race(id):
     race = Race.query.get_or_404(id)
     data = request.get_json() if request.is_json else request.form
+    previous = (race.location_id, race.condition, race.date)
 
     if data.get('race_name'):
         race.race_name = data.get('race_name')
@@ -413,11 +269,13 @@ def update_race(id):
         race.track_name = data.get('track_name')
     if 'weather' in data:
         race.weather = data.get('weather')
+        race.condition = get_weather_condition(race.weather)
     if 'total_laps' in data:
         race.total_laps = int(data.get('total_laps')) if data.get('total_laps') else None
     if 'winner_id' in data:
         race.winner_id = int(data.get('winner_id')) if data.get('winner_id') else None
 
+    records.race_moved(race, *previous)
     db.session.commit()
 
     return jsonify({'success': True, 'message': 'Corrida atualizada com sucesso', 'race': race.to_dict()})
@@ -446,23 +304,7 @@ def delete_race(id):
 @login_required
 @admin_required
 def results():
-    race_id = request.args.get('race_id', type=int)
-
-    query = db.session.query(RaceResult, Racer.name, Race.race_name).join(
-        Racer, RaceResult.racer_id == Racer.id
-    ).join(
-        Race, RaceResult.race_id == Race.id
-    )
-
-    if race_id:
-        query = query.filter(RaceResult.race_id == race_id)
-
-    results_list = query.order_by(Race.date.desc(), RaceResult.position).all()
-    races = Race.query.order_by(Race.date.desc()).all()
-    racers = Racer.query.order_by(Racer.name).all()
-
-    return render_template('admin/results.html', results=results_list, races=races,
-                         racers=racers, selected_race_id=race_id)
+    return render_template('admin/results.html')
 
 
 @admin.route('/results', methods=['POST'])
@@ -493,9 +335,16 @@ def create_result():
         dnf=data.get('dnf') == 'true' or data.get('dnf') == True,
         laps=int(data.get('laps')) if data.get('laps') else None
     )
+    if data.get('lap_chart'):
+        try:
+            result.set_laps(parse_laps(data.get('lap_chart')))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Voltas invalidas: {e}'}), 400
 
     db.session.add(result)
+    records.check_races([result.race_id])
     db.session.commit()
+    live.publish(result.race_id)
 
     return jsonify({'success': True, 'message': 'Resultado criado com sucesso', 'result': result.to_dict()})
 
@@ -521,20 +370,50 @@ def update_result(id):
         result.dnf = data.get('dnf') == 'true' or data.get('dnf') == True
     if 'laps' in data:
         result.laps = int(data.get('laps')) if data.get('laps') else None
+    if 'lap_chart' in data:
+        try:
+            result.set_laps(parse_laps(data.get('lap_chart') or []))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Voltas invalidas: {e}'}), 400
 
+    records.check_races([result.race_id])
     db.session.commit()
+    live.publish(result.race_id)
 
     return jsonify({'success': True, 'message': 'Resultado atualizado com sucesso', 'result': result.to_dict()})
 
 
+@admin.route('/results/<int:id>/laps', methods=['PUT'])
+@login_required
+@admin_required
+def update_result_laps(id):
+    """Replace a result's lap chart: {"laps": ["1:02.345", {"time": "1:01.9", "sectors": [...]}, ...]}"""
+    result = RaceResult.query.get_or_404(id)
+    data = request.get_json(silent=True) or {}
+    try:
+        result.set_laps(parse_laps(data.get('laps')))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Voltas invalidas: {e}'}), 400
+
+    records.check_races([result.race_id])
+    db.session.commit()
+    live.publish(result.race_id)
+
+    return jsonify({'success': True, 'message': 'Voltas salvas com sucesso', 'result': result.to_dict(),
+                    'lap_chart': result.lap_chart()})
+
+
 @admin.route('/results/<int:id>', methods=['DELETE'])
 @login_required
 @admin_required
 def delete_result(id):
     result = RaceResult.query.get_or_404(id)
+    race_id = result.race_id
 
     db.session.delete(result)
+    records.check_races([race_id])
     db.session.commit()
+    live.publish(race_id)
 
     return jsonify({'success': True, 'message': 'Resultado excluido com sucesso'})
 
@@ -579,11 +458,19 @@ def bulk_create_results():
             dnf=result_data.get('dnf') == True or result_data.get('dnf') == 'true',
             laps=int(result_data.get('laps')) if result_data.get('laps') else None
         )
+        if result_data.get('lap_chart'):
+            try:
+                result.set_laps(parse_laps(result_data.get('lap_chart')))
+            except ValueError as e:
+                db.session.rollback()
+                return jsonify({'success': False, 'message': f'Voltas invalidas (piloto {racer_id}): {e}'}), 400
 
         db.session.add(result)
         created_count += 1
 
+    records.check_races([int(race_id)])
     db.session.commit()
+    live.publish(race_id)
 
     message = f'{created_count} resultado(s) criado(s) com sucesso'
     if skipped:
@@ -613,10 +500,13 @@ def bulk_delete_results():
         return jsonify({'success': False, 'message': 'Nenhum resultado encontrado'}), 404
 
     count = len(results)
+    race_ids = [result.race_id for result in results]
     for result in results:
         db.session.delete(result)
 
+    records.check_races(race_ids)
     db.session.commit()
+    live.publish(*race_ids)
 
     return jsonify({
         'success': True,
@@ -625,6 +515,95 @@ def bulk_delete_results():
     })
 
 
+# ============== RESULT IMPORT ==============
+# Venue timing exports: upload for a preview, then commit the reviewed rows
+
+@admin.route('/results/import/preview', methods=['POST'])
+@login_required
+@admin_required
+def import_results_preview():
+    race = db.session.get(Race, request.form.get('race_id', type=int) or 0)
+    if race is None:
+        return jsonify({'success': False, 'message': 'Corrida e obrigatoria'}), 400
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
+
+    try:
+        if request.form.get('mapping'):
+            try:
+                mapping = json.loads(request.form['mapping'])
+            except ValueError:
+                raise importer.ImportRejected('Mapeamento invalido: JSON mal formado')
+        else:
+            mapping = race.location.import_mapping if race.location else None
+        mapping = importer.validate_mapping(mapping)
+        sheet = importer.read_export(upload.stream, upload.filename, mapping)
+    except importer.ImportRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    result = importer.preview(race.id, sheet['rows'])
+    return jsonify({
+        'success': True,
+        'race': {'id': race.id, 'race_name': race.race_name, 'location_id': race.location_id},
+        'mapping': mapping,
+        'columns': sheet['columns'],
+        'lap_columns': sheet['lap_columns'],
+        **result
+    })
+
+
+@admin.route('/results/import/commit', methods=['POST'])
+@login_required
+@admin_required
+def import_results_commit():
+    data = request.get_json(silent=True) or {}
+    race = db.session.get(Race, data.get('race_id') or 0) if isinstance(data.get('race_id'), int) else None
+    rows = data.get('rows')
+    if race is None:
+        return jsonify({'success': False, 'message': 'Corrida e obrigatoria'}), 400
+    if not rows or not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return jsonify({'success': False, 'message': 'Nenhum resultado fornecido'}), 400
+
+    try:
+        counts = importer.commit(race.id, rows, create_missing=data.get('create_missing', True))
+    except importer.ImportRejected as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    recalculate_stats()
+    records.check_races([race.id])
+    db.session.commit()
+    live.publish(race.id)
+
+    message = f'{counts["created"]} resultado(s) criado(s), {counts["updated"]} atualizado(s)'
+    if counts['racers_created']:
+        message += f', {counts["racers_created"]} piloto(s) novo(s)'
+    if counts['skipped']:
+        message += f'. Ignorados: {", ".join(counts["skipped"])}'
+    return jsonify({'success': True, 'message': message, **counts})
+
+
+@admin.route('/locations/<int:id>/import-mapping', methods=['GET'])
+@login_required
+@admin_required
+def get_import_mapping(id):
+    location = Location.query.get_or_404(id)
+    return jsonify({'location_id': location.id, 'mapping': location.import_mapping or {}})
+
+
+@admin.route('/locations/<int:id>/import-mapping', methods=['PUT'])
+@login_required
+@admin_required
+def update_import_mapping(id):
+    location = Location.query.get_or_404(id)
+    try:
+        location.import_mapping = importer.validate_mapping((request.get_json(silent=True) or {}).get('mapping')) or None
+    except importer.ImportRejected as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Mapeamento salvo com sucesso', 'mapping': location.import_mapping or {}})
+
+
 # ============== LOCATIONS ==============
 
 @admin.route('/locations')
@@ -662,7 +641,7 @@ def create_location():
         instagram=data.get('instagram'),
         website=data.get('website'),
         description=data.get('description'),
-        thumbnail_url=data.get('thumbnail_url')
+        thumbnail_url=canonical_url(data.get('thumbnail_url'))
     )
 
     db.session.add(location)
@@ -711,7 +690,7 @@ def update_location(id):
     if 'description' in data:
         location.description = data.get('description')
     if 'thumbnail_url' in data:
-        location.thumbnail_url = data.get('thumbnail_url')
+        location.thumbnail_url = canonical_url(data.get('thumbnail_url'))
 
     db.session.commit()
 
@@ -873,7 +852,7 @@ def create_album():
         name=name,
         description=data.get('description'),
         race_id=int(data.get('race_id')) if data.get('race_id') else None,
-        cover_url=data.get('cover_url'),
+        cover_url=canonical_url(data.get('cover_url')),
         google_photos_link=data.get('google_photos_link')
     )
 
@@ -897,7 +876,7 @@ def update_album(id):
     if 'race_id' in data:
         album.race_id = int(data.get('race_id')) if data.get('race_id') else None
     if 'cover_url' in data:
-        album.cover_url = data.get('cover_url')
+        album.cover_url = canonical_url(data.get('cover_url'))
     if 'google_photos_link' in data:
         album.google_photos_link = data.get('google_photos_link')
 
@@ -929,7 +908,7 @@ def set_album_cover(album_id):
     if not cover_url:
         return jsonify({'success': False, 'message': 'URL da capa e obrigatoria'}), 400
 
-    album.cover_url = cover_url
+    album.cover_url = canonical_url(cover_url)
     db.session.commit()
 
     return jsonify({'success': True, 'message': 'Capa do album definida com sucesso'})
@@ -948,12 +927,19 @@ def create_media_item(album_id):
     if not url:
         return jsonify({'success': False, 'message': 'URL e obrigatoria'}), 400
 
+    # Uploaded photos reference the deduplicated blob returned by /upload
+    content_hash = data.get('content_hash')
+    if content_hash and not MediaBlob.query.filter_by(content_hash=content_hash).first():
+        content_hash = None
+
     media_item = MediaItem(
         album_id=album_id,
         media_type=data.get('media_type', 'photo'),
-        url=url,
+        url=canonical_url(url),
         title=data.get('title'),
-        description=data.get('description')
+        description=data.get('description'),
+        content_hash=content_hash,
+        storage_key=storage_key_from_url(url)
     )
 
     db.session.add(media_item)
@@ -982,78 +968,280 @@ def delete_media_item(id):
 def upload_file():
     """Upload file to R2 storage"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
-
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': 'Nenhum arquivo selecionado'}), 400
-
-        # Validate file type - ONLY PHOTOS ALLOWED
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-        ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-
-        if ext not in allowed_extensions:
-            return jsonify({'success': False, 'message': f'Apenas fotos sao permitidas. Use: JPG, PNG, GIF, WebP'}), 400
-
-        # Validate file size (max 10MB for photos)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            return jsonify({'success': False, 'message': 'Arquivo muito grande. Maximo: 10MB'}), 400
+        # The body is streamed: size and content are checked while it is read
+        try:
+            file = StreamingUpload(request).open()
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
 
         # All uploads are photos
         media_type = 'photo'
 
         # Upload to R2
         folder = 'photos'
-        public_url = upload_to_r2(file, folder)
+        try:
+            blob = upload_to_r2(file, folder)
+        except Exception:
+            if file.error:
+                return jsonify({'success': False, 'message': file.error.message}), file.error.status
+            raise
+        file.finish()
+        db.session.commit()
 
         return jsonify({
             'success': True,
             'message': 'Arquivo enviado com sucesso',
-            'url': public_url,
-            'media_type': media_type
+            'url': public_url(blob.storage_key),
+            'media_type': media_type,
+            'content_hash': blob.content_hash,
+            'duplicate': blob.upload_count > 1
         })
 
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao enviar arquivo: {str(e)}'}), 500
 
 
+# ============== GRID DATA ==============
+# Paginated, sortable and filterable rows for the admin tables
+
+def raced_in(filters):
+    """Racer ids with a result in a race matching `filters`"""
+    return db.select(RaceResult.racer_id).join(Race, RaceResult.race_id == Race.id).where(*filters)
+
+
+@admin.route('/api/grid/results')
+@login_required
+@admin_required
+def grid_results():
+    query = db.select(RaceResult, Racer.name, Race.race_name, Race.date).join(
+        Racer, RaceResult.racer_id == Racer.id
+    ).join(
+        Race, RaceResult.race_id == Race.id
+    )
+
+    race_id = request.args.get('race_id', type=int)
+    racer_id = request.args.get('racer_id', type=int)
+    location_id = request.args.get('location_id', type=int)
+    championship_id = request.args.get('championship_id', type=int)
+    q = request.args.get('q', '').strip()
+    if race_id:
+        query = query.where(RaceResult.race_id == race_id)
+    if racer_id:
+        query = query.where(RaceResult.racer_id == racer_id)
+    if location_id:
+        query = query.where(Race.location_id == location_id)
+    if championship_id:
+        query = query.where(Race.championship_id == championship_id)
+    if q:
+        query = query.where(contains((Racer.name, Race.race_name), q))
+
+    def serialize(row):
+        result, racer_name, race_name, race_date = row
+        item = result.to_dict()
+        item.update(id=result.id, racer_name=racer_name, race_name=race_name,
+                    race_date=race_date.isoformat() if race_date else None)
+        return item
+
+    return grid_response(query, {
+        'id': RaceResult.id,
+        'date': Race.date,
+        'race': Race.race_name,
+        'racer': Racer.name,
+        'position': RaceResult.position,
+        'best': RaceResult.lap_time_best,
+        'points': RaceResult.points_earned,
+        'laps': RaceResult.laps,
+    }, ('date', 'desc'), serialize, then=(RaceResult.race_id.desc(), RaceResult.position, RaceResult.id))
+
+
+@admin.route('/api/grid/races')
+@login_required
+@admin_required
+def grid_races():
+    winner = aliased(Racer)
+    query = db.select(Race, Location.name, Championship.name, winner.name).outerjoin(
+        Location, Race.location_id == Location.id
+    ).outerjoin(
+        Championship, Race.championship_id == Championship.id
+    ).outerjoin(
+        winner, Race.winner_id == winner.id
+    )
+
+    racer_id = request.args.get('racer_id', type=int)
+    location_id = request.args.get('location_id', type=int)
+    championship_id = request.args.get('championship_id', type=int)
+    q = request.args.get('q', '').strip()
+    if racer_id:
+        query = query.where(Race.id.in_(db.select(RaceResult.race_id).where(RaceResult.racer_id == racer_id)))
+    if location_id:
+        query = query.where(Race.location_id == location_id)
+    if championship_id:
+        query = query.where(Race.championship_id == championship_id)
+    if q:
+        query = query.where(contains((Race.race_name, Race.track_name), q))
+
+    def serialize(row):
+        race, location_name, championship_name, winner_name = row
+        item = race.to_dict()
+        item.update(id=race.id, location_name=location_name, championship_name=championship_name,
+                    winner_name=winner_name)
+        return item
+
+    return grid_response(query, {
+        'id': Race.id,
+        'name': Race.race_name,
+        'date': Race.date,
+        'location': Location.name,
+        'championship': Championship.name,
+        'weather': Race.weather,
+        'laps': Race.total_laps,
+        'winner': winner.name,
+    }, ('date', 'desc'), serialize, then=(Race.id.desc(),))
+
+
+@admin.route('/api/grid/racers')
+@login_required
+@admin_required
+def grid_racers():
+    query = db.select(Racer)
+
+    race_id = request.args.get('race_id', type=int)
+    location_id = request.args.get('location_id', type=int)
+    championship_id = request.args.get('championship_id', type=int)
+    q = request.args.get('q', '').strip()
+    if race_id:
+        query = query.where(Racer.id.in_(db.select(RaceResult.racer_id).where(RaceResult.race_id == race_id)))
+    if location_id:
+        query = query.where(Racer.id.in_(raced_in([Race.location_id == location_id])))
+    if championship_id:
+        query = query.where(Racer.id.in_(raced_in([Race.championship_id == championship_id])))
+    if q:
+        query = query.where(contains((Racer.name,), q))
+
+    def serialize(row):
+        item = row[0].to_dict()
+        item['id'] = row[0].id
+        return item
+
+    return grid_response(query, {
+        'id': Racer.id,
+        'name': Racer.name,
+        'age': Racer.age,
+        'experience': Racer.experience_years,
+        'races': Racer.total_races,
+        'wins': Racer.wins,
+        'podiums': Racer.podium_finishes,
+    }, ('name', 'asc'), serialize, then=(Racer.id,))
+
+
+@admin.route('/api/grid/users')
+@login_required
+@admin_required
+def grid_users():
+    query = db.select(User)
+
+    racer_id = request.args.get('racer_id', type=int)
+    q = request.args.get('q', '').strip()
+    if racer_id:
+        query = query.where(User.racer_id == racer_id)
+    if q:
+        query = query.where(contains((User.name, User.email), q))
+
+    return grid_response(query, {
+        'id': User.id,
+        'name': User.name,
+        'email': User.email,
+        'admin': User.is_admin,
+        'active': User.is_active,
+        'last_login': User.last_login,
+        'created': User.created_at,
+    }, ('created', 'desc'), lambda row: row[0].to_dict(), then=(User.id.desc(),))
+
+
 # ============== API ENDPOINTS FOR DROPDOWNS ==============
+# All accept ?q= (search), ?limit= and ?id= (a single option)
 
 @admin.route('/api/racers')
 @login_required
 @admin_required
 def api_racers():
-    racers = Racer.query.order_by(Racer.name).all()
-    return jsonify([{'id': r.id, 'name': r.name} for r in racers])
+    return options_response(
+        db.select(Racer.id, Racer.name).order_by(Racer.name), Racer.id, (Racer.name,),
+        lambda r: {'id': r.id, 'name': r.name}
+    )
 
 
 @admin.route('/api/races')
 @login_required
 @admin_required
 def api_races():
-    races = Race.query.order_by(Race.date.desc()).all()
-    return jsonify([{'id': r.id, 'race_name': r.race_name, 'date': r.date.isoformat() if r.date else None} for r in races])
+    return options_response(
+        db.select(Race.id, Race.race_name, Race.date).order_by(Race.date.desc(), Race.id.desc()),
+        Race.id, (Race.race_name, Race.track_name),
+        lambda r: {'id': r.id, 'race_name': r.race_name, 'date': r.date.isoformat() if r.date else None}
+    )
 
 
 @admin.route('/api/locations')
 @login_required
 @admin_required
 def api_locations():
-    locations = Location.query.order_by(Location.name).all()
-    return jsonify([{'id': l.id, 'name': l.name} for l in locations])
+    return options_response(
+        db.select(Location.id, Location.name).order_by(Location.name), Location.id, (Location.name, Location.city),
+        lambda l: {'id': l.id, 'name': l.name}
+    )
 
 
 @admin.route('/api/championships')
 @login_required
 @admin_required
 def api_championships():
-    championships = Championship.query.order_by(Championship.name).all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in championships])
+    return options_response(
+        db.select(Championship.id, Championship.name).order_by(Championship.name), Championship.id,
+        (Championship.name,), lambda c: {'id': c.id, 'name': c.name}
+    )
+
+
+@admin.route('/api/db-pool')
+@login_required
+@admin_required
+def api_db_pool():
+    """Connection pool counters of the worker answering the request"""
+    return jsonify(pool_stats(db))
+
+
+@admin.route('/api/profiles')
+@login_required
+@admin_required
+def api_profiles():
+    """cProfile dumps written by this worker, newest first"""
+    return jsonify(list_profiles())
+
+
+@admin.route('/api/profiles/<name>')
+@login_required
+@admin_required
+def api_profile_download(name):
+    path = profile_path(name)
+    if path is None:
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=name)
+
+
+@admin.route('/export/dataset')
+@login_required
+@admin_required
+def export_dataset():
+    """Zip of Parquet (or ?format=arrow) files, one per table, for offline analysis"""
+    export_format = request.args.get('format', 'parquet')
+    try:
+        archive = export.write_dataset(export_format)
+    except export.ExportUnavailable as e:
+        return jsonify({'success': False, 'message': str(e)}), 501
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return send_file(archive, mimetype='application/zip', as_attachment=True,
+                     download_name=f'nerds-dataset-{datetime.utcnow():%Y%m%d}-{export_format}.zip')
 
 
 @admin.route('/api/albums/<int:album_id>/media')
@@ -1072,8 +1260,7 @@ def api_album_media(album_id):
 @login_required
 @admin_required
 def users():
-    users_list = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users_list)
+    return render_template('admin/users.html')
 
 
 @admin.route('/users', methods=['POST'])
@@ -1100,7 +1287,10 @@ def create_user():
         is_admin=data.get('is_admin') == 'true' or data.get('is_admin') == True or data.get('is_admin') == 'on',
         is_active=data.get('is_active', 'true') == 'true' or data.get('is_active', True) == True or data.get('is_active') == 'on'
     )
-    user.set_password(password)
+    try:
+        user.set_password(password)
+    except PasswordHashBusy:
+        return jsonify({'success': False, 'message': 'Servidor ocupado, tente novamente em alguns segundos'}), 503
 
     db.session.add(user)
     db.session.commit()
@@ -1139,9 +1329,14 @@ def update_user(id):
         if has_permission:
             user.interested_in_13hp = True
     if data.get('password'):
-        user.set_password(data.get('password'))
+        try:
+            user.set_password(data.get('password'))
+        except PasswordHashBusy:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Servidor ocupado, tente novamente em alguns segundos'}), 503
 
     db.session.commit()
+    invalidate_user(id)
 
     return jsonify({'success': True, 'message': 'Usuario atualizado com sucesso', 'user': user.to_dict()})
 
@@ -1158,5 +1353,6 @@ def delete_user(id):
 
     db.session.delete(user)
     db.session.commit()
+    invalidate_user(id)
 
     return jsonify({'success': True, 'message': 'Usuario excluido com sucesso'})
@@ -0,0 +1,293 @@
+import os
+import numpy as np
+from cache import TTLCache, data_version
+from database import primary_for_cache_fill
+from laps import HEADER
+from models import db, Racer, Race, RaceResult, Location, LocationFastestLap
+from stats import parse_lap_time
+
+# Pace and consistency per racer and location, computed over the whole
+# history at once: one query fills column arrays, and every aggregate is a
+# NumPy reduction over them. Rebuilt once per data version, expiring after
+# ANALYTICS_TTL seconds so writes on other workers show up too.
+ANALYTICS_TTL = int(os.environ.get('ANALYTICS_TTL', 300))
+CONDITIONS = ('dry', 'wet', 'indoor')
+# Trend slopes are reported in seconds per 30 days
+TREND_DAYS = 30
+TREND_MIN_RACES = 3
+
+_cache = TTLCache(maxsize=2, ttl=ANALYTICS_TTL)
+
+
+def lap_times(data):
+    """Lap times in seconds of a packed lap chart, read straight from the buffer"""
+    if not data:
+        return None
+    _, count, sectors = HEADER.unpack_from(data)
+    stride = 6 + 4 * sectors
+    if count == 0:
+        return None
+    return np.ndarray(count, dtype='<u4', buffer=data, offset=HEADER.size + 2, strides=(stride,)) / 1000.0
+
+
+def parse_times(values):
+    """Seconds for an array of lap time strings, NaN when missing; each distinct string is parsed once"""
+    unique, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    seconds = np.array([parse_lap_time(value) if value not in ('', '-', 'None') else None for value in unique],
+                       dtype=float)
+    return seconds[inverse]
+
+
+def condition_codes(values):
+    """Index into CONDITIONS of each condition name"""
+    unique, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return np.array([CONDITIONS.index(value) for value in unique], dtype=np.int64)[inverse.reshape(-1)]
+
+
+def group_codes(*keys):
+    """(code per row, unique key rows) for the combination of integer key arrays"""
+    unique, codes = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+    return codes.reshape(-1), unique
+
+
+def grouped_mean_std(codes, count, values):
+    """Per-group count, mean and sample standard deviation of `values`, ignoring NaN"""
+    valid = ~np.isnan(values)
+    n = np.bincount(codes[valid], minlength=count).astype(float)
+    total = np.bincount(codes[valid], weights=values[valid], minlength=count)
+    squares = np.bincount(codes[valid], weights=values[valid] ** 2, minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        variance = (squares - n * mean ** 2) / (n - 1)
+    std = np.where(n > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+    return n, mean, std
+
+
+def grouped_slope(codes, count, x, y):
+    """Per-group least-squares slope of y over x (the degree-1 polyfit), NaN with too few points"""
+    valid = ~np.isnan(y)
+    c, x, y = codes[valid], x[valid], y[valid]
+    n = np.bincount(c, minlength=count).astype(float)
+    sx = np.bincount(c, weights=x, minlength=count)
+    sy = np.bincount(c, weights=y, minlength=count)
+    sxx = np.bincount(c, weights=x * x, minlength=count)
+    sxy = np.bincount(c, weights=x * y, minlength=count)
+    denominator = n * sxx - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sxy - sx * sy) / denominator
+    return np.where((n >= TREND_MIN_RACES) & (denominator > 0), slope, np.nan)
+
+
+def race_percentiles(race_codes, best):
+    """Share (0-100) of the other racers in the same race with a slower best lap; NaN without a time"""
+    result = np.full(len(best), np.nan)
+    rows = np.flatnonzero(~np.isnan(best))
+    if len(rows) == 0:
+        return result
+    rows = rows[np.lexsort((best[rows], race_codes[rows]))]
+    race, time = race_codes[rows], best[rows]
+    index = np.arange(len(rows))
+
+    new_race = np.r_[True, race[1:] != race[:-1]]
+    starts = np.flatnonzero(new_race)
+    sizes = np.diff(np.r_[starts, len(rows)])
+    race_of_row = np.cumsum(new_race) - 1
+
+    # Tied times share a run; everyone after the end of a row's run was slower
+    new_run = new_race | np.r_[True, time[1:] != time[:-1]]
+    run_end = np.r_[new_run[1:], True]
+    run_last = np.minimum.accumulate(np.where(run_end, index, len(rows))[::-1])[::-1]
+
+    size = sizes[race_of_row]
+    slower = starts[race_of_row] + size - 1 - run_last
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[rows] = np.where(size > 1, 100.0 * slower / (size - 1), np.nan)
+    return result
+
+
+def round_or_none(value, digits=3):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def load():
+    """Every result with its race's location, date and condition as column arrays, from one query"""
+    rows = db.session.execute(
+        db.select(RaceResult.racer_id, RaceResult.race_id, Race.race_name, Race.date, Race.condition,
+                  db.func.coalesce(Race.location_id, 0), RaceResult.position, RaceResult.lap_time_best,
+                  RaceResult.lap_data)
+        .join(Race, RaceResult.race_id == Race.id)
+        .order_by(Race.date, RaceResult.race_id)
+    ).all()
+    columns = list(zip(*rows)) if rows else [()] * 9
+    racer_ids, race_ids, race_names, dates, conditions, location_ids, positions, bests, charts = columns
+    return {
+        'racer_id': np.array(racer_ids, dtype=np.int64),
+        'race_id': np.array(race_ids, dtype=np.int64),
+        'race_name': np.array(race_names, dtype=object),
+        'day': np.array(dates, dtype='datetime64[D]').astype(np.int64).astype(float),
+        'condition': condition_codes(conditions),
+        'location_id': np.array(location_ids, dtype=np.int64),
+        'position': np.array([np.nan if p is None else p for p in positions], dtype=float),
+        'best': parse_times(bests) if rows else np.array([], dtype=float),
+        'charts': charts
+    }
+
+
+def records():
+    """Location record in seconds by (location id, condition)"""
+    return {
+        (location_id, condition): seconds
+        for location_id, condition, seconds in db.session.execute(
+            db.select(LocationFastestLap.location_id, LocationFastestLap.condition,
+                      LocationFastestLap.best_lap_seconds)
+        )
+        if seconds is not None
+    }
+
+
+def chart_std(charts):
+    """Standard deviation of each row's lap chart, NaN without two laps: one grouped pass over every lap"""
+    count_rows = len(charts)
+    times = [lap_times(data) for data in charts]
+    counts = np.array([0 if t is None else len(t) for t in times], dtype=np.int64)
+    if not counts.sum():
+        return np.full(count_rows, np.nan)
+    laps = np.concatenate([t for t in times if t is not None])
+    _, _, std = grouped_mean_std(np.repeat(np.arange(count_rows), counts), count_rows, laps)
+    return std
+
+
+def compute():
+    columns = load()
+    best = columns['best']
+    count_rows = len(best)
+
+    # Within-race consistency: standard deviation of the lap chart, when stored
+    lap_std = chart_std(columns['charts'])
+
+    race_codes, _ = group_codes(columns['race_id']) if count_rows else (np.array([], dtype=np.int64), None)
+    percentile = race_percentiles(race_codes, best)
+
+    # Dry, wet and indoor laps are not comparable, so each condition is its own group
+    if count_rows:
+        codes, keys = group_codes(columns['racer_id'], columns['location_id'], columns['condition'])
+    else:
+        codes, keys = np.array([], dtype=np.int64), np.empty((0, 3), dtype=np.int64)
+    groups = len(keys)
+    races = np.bincount(codes, minlength=groups)
+    timed, mean_best, best_std = grouped_mean_std(codes, groups, best)
+    _, mean_lap_std, _ = grouped_mean_std(codes, groups, lap_std)
+    _, mean_percentile, _ = grouped_mean_std(codes, groups, percentile)
+    days = columns['day'] - (columns['day'].min() if count_rows else 0)
+    slope = grouped_slope(codes, groups, days, best) * TREND_DAYS
+
+    # Fastest row of each group: first after sorting by (group, time)
+    group_best = np.full(groups, np.nan)
+    timed_rows = np.flatnonzero(~np.isnan(best))
+    if len(timed_rows):
+        ordered = timed_rows[np.lexsort((best[timed_rows], codes[timed_rows]))]
+        first = ordered[np.r_[True, codes[ordered][1:] != codes[ordered][:-1]]]
+        group_best[codes[first]] = best[first]
+
+    location_records = records()
+    record = np.array([location_records.get((int(location_id), CONDITIONS[condition]), np.nan)
+                       for _, location_id, condition in keys], dtype=float)
+
+    return {
+        'rows': {**columns, 'lap_std': lap_std, 'percentile': percentile, 'group': codes},
+        'groups': {
+            'racer_id': keys[:, 0],
+            'location_id': keys[:, 1],
+            'races': races,
+            'timed': timed,
+            'condition': keys[:, 2],
+            'best': group_best,
+            'mean_best': mean_best,
+            'best_std': best_std,
+            'lap_std': mean_lap_std,
+            'record': record,
+            'gap': group_best - record,
+            'trend': slope,
+            'percentile': mean_percentile
+        },
+        'records': location_records,
+        'racers': dict(db.session.execute(db.select(Racer.id, Racer.name)).all()),
+        'locations': dict(db.session.execute(db.select(Location.id, Location.name)).all())
+    }
+
+
+def current():
+    version = data_version()
+    data = _cache.get(version)
+    if data is None:
+        with primary_for_cache_fill():
+            data = compute()
+        _cache.set(version, data)
+    return data
+
+
+def group_dict(data, index):
+    groups = data['groups']
+    location_id = int(groups['location_id'][index])
+    gap = groups['gap'][index]
+    return {
+        'racer_id': int(groups['racer_id'][index]),
+        'racer_name': data['racers'].get(int(groups['racer_id'][index])),
+        'location_id': location_id or None,
+        'location_name': data['locations'].get(location_id),
+        'races': int(groups['races'][index]),
+        'timed_races': int(groups['timed'][index]),
+        'best_lap_seconds': round_or_none(groups['best'][index]),
+        'condition': CONDITIONS[groups['condition'][index]],
+        'average_best_lap_seconds': round_or_none(groups['mean_best'][index]),
+        'best_lap_std_dev': round_or_none(groups['best_std'][index]),
+        'lap_std_dev': round_or_none(groups['lap_std'][index]),
+        'record_seconds': round_or_none(groups['record'][index]),
+        'gap_to_record': round_or_none(gap),
+        'gap_to_record_percent': round_or_none(100 * gap / groups['record'][index], 2),
+        'trend_per_month': round_or_none(groups['trend'][index]),
+        'average_percentile': round_or_none(groups['percentile'][index], 1)
+    }
+
+
+def racer_analytics(racer_id):
+    """Pace of a racer per location and condition, and their percentile in each race"""
+    data = current()
+    rows = data['rows']
+    locations = [group_dict(data, index) for index in np.flatnonzero(data['groups']['racer_id'] == racer_id)]
+    races = [
+        {
+            'race_id': int(rows['race_id'][row]),
+            'race_name': rows['race_name'][row],
+            'date': str(np.datetime64(int(rows['day'][row]), 'D')),
+            'location_id': int(rows['location_id'][row]) or None,
+            'condition': CONDITIONS[rows['condition'][row]],
+            'position': None if np.isnan(rows['position'][row]) else int(rows['position'][row]),
+            'best_lap_seconds': round_or_none(rows['best'][row]),
+            'lap_std_dev': round_or_none(rows['lap_std'][row]),
+            'percentile': round_or_none(rows['percentile'][row], 1)
+        }
+        for row in np.flatnonzero(rows['racer_id'] == racer_id)
+    ]
+    return {'racer_id': racer_id, 'locations': locations, 'races': races}
+
+
+def location_analytics(location_id):
+    """Pace of every racer at a location per condition, fastest first, next to that condition's record"""
+    data = current()
+    groups = data['groups']
+    conditions = {}
+    for code, condition in enumerate(CONDITIONS):
+        indexes = np.flatnonzero((groups['location_id'] == location_id) & (groups['condition'] == code))
+        if not len(indexes):
+            continue
+        indexes = indexes[np.argsort(groups['best'][indexes], kind='stable')]
+        conditions[condition] = {
+            'record_seconds': round_or_none(data['records'].get((location_id, condition))),
+            'racers': [group_dict(data, index) for index in indexes]
+        }
+    return {
+        'location_id': location_id,
+        'location_name': data['locations'].get(location_id),
+        'conditions': conditions
+    }
@@ -1,15 +1,26 @@
 from flask import Flask, jsonify, render_template, send_file, request, flash, redirect, url_for
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_talisman import Talisman
 from flask_login import LoginManager, current_user, login_required
 from flask_bcrypt import Bcrypt
 from sqlalchemy import func, case
-from werkzeug.utils import secure_filename
 import os
-import uuid
-import boto3
 from models import db, User, Racer, Location, Race, RaceResult, Championship, Album, MediaItem, RacerBestLap, LocationFastestLap
+from passwords import BCRYPT_LOG_ROUNDS
+import database
+import instrumentation
+import serializers
+import assets
+import laps
+import live
+import analytics
+import records
+import snapshot
+from database import engine_options, pool_stats, primary_for_cache_fill, use_read_replica
+from cache import TTLCache, data_version, bump_data_version
+from media import store_upload, public_url, canonical_url, media_url, media_cli, StreamingUpload, UploadRejected, MAX_UPLOAD_SIZE, MAX_FORM_OVERHEAD
 
 # Try to load .env file if it exists
 try:
@@ -19,9 +30,14 @@ except ImportError:
     pass  # dotenv not installed, use system environment variables
 
 app = Flask(__name__)
+serializers.init_app(app)
 
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Reject oversized bodies from Content-Length before reading them
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + MAX_FORM_OVERHEAD
+
+app.config['BCRYPT_LOG_ROUNDS'] = BCRYPT_LOG_ROUNDS
 bcrypt = Bcrypt(app)
 
 login_manager = LoginManager()
@@ -33,7 +49,8 @@ login_manager.login_message_category = 'error'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    from auth import load_cached_user
+    return load_cached_user(int(user_id))
 
 
 if os.environ.get('ENVIRONMENT') == 'production':
@@ -52,9 +69,28 @@ if not database_url:
 else:
     print("Using PostgreSQL database")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Optional read replica for the public read-only API
+database_read_url = os.environ.get('DATABASE_READ_URL')
+if database_read_url and database_read_url.startswith('postgres://'):
+    database_read_url = database_read_url.replace('postgres://', 'postgresql://', 1)
+if database_read_url:
+    app.config['SQLALCHEMY_BINDS'] = {
+        'read': {'url': database_read_url, **engine_options(database_read_url)}
+    }
+    print("Routing read-only API requests to DATABASE_READ_URL")
 
 db.init_app(app)
+database.init_app(app, db)
+instrumentation.init_app(app, db)
+assets.init_app(app)
+live.init_app(app, db)
 migrate = Migrate(app, db)
+app.cli.add_command(media_cli)
+app.cli.add_command(records.records_cli)
+app.cli.add_command(snapshot.snapshot_cli)
+app.add_template_filter(media_url)
 
 from auth import auth as auth_blueprint
 app.register_blueprint(auth_blueprint)
@@ -63,34 +99,90 @@ from admin import admin as admin_blueprint
 app.register_blueprint(admin_blueprint)
 
 
+# Public pages embed the responses of the API calls they make on load, so the
+# first paint needs no extra round-trips. Serialized once per data version
+PAGE_DATA_TTL = int(os.environ.get('PAGE_DATA_TTL', 30))
+page_data_cache = TTLCache(maxsize=64, ttl=PAGE_DATA_TTL)
+
+
+def initial_data(*endpoints):
+    """JSON object of API path -> response body for the given API views.
+
+    An endpoint may carry a query string ('get_racers?include=best_laps'),
+    the view then runs with those arguments.
+    """
+    key = (endpoints, data_version())
+    text = page_data_cache.get(key)
+    if text is None:
+        parts = []
+        with primary_for_cache_fill():
+            for spec in endpoints:
+                endpoint, _, query = spec.partition('?')
+                path = url_for(endpoint) + ('?' + query if query else '')
+                if query:
+                    with app.test_request_context(path):
+                        response = app.make_response(app.view_functions[endpoint]())
+                else:
+                    response = app.make_response(app.view_functions[endpoint]())
+                if response.status_code == 200:
+                    path = path[len('/api'):]
+                    parts.append(f'"{path}":{response.get_data(as_text=True)}')
+        # Inside <script>, "<" is escaped so no string can close the element
+        text = ('{' + ','.join(parts) + '}').replace('<', '\\u003c')
+        page_data_cache.set(key, text)
+    return Markup(text)
+
+
+@app.after_request
+def bump_data_version_after_write(response):
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400 \
+            and request.blueprint != 'auth':
+        bump_data_version()
+    return response
+
+
 @app.route('/')
 @app.route('/dashboard')
+@assets.public_page
 def dashboard():
-    return render_template('pages/dashboard.html', current_user=current_user)
+    return render_template('pages/dashboard.html', current_user=current_user,
+                           initial_data=initial_data('get_dashboard'))
 
 @app.route('/racers')
+@assets.public_page
 def racers():
-    return render_template('pages/racers.html', current_user=current_user)
+    return render_template('pages/racers.html', current_user=current_user,
+                           initial_data=initial_data('get_racers?include=best_laps'))
 
 @app.route('/races')
+@assets.public_page
 def races():
-    return render_template('pages/races.html', current_user=current_user)
+    return render_template('pages/races.html', current_user=current_user,
+                           initial_data=initial_data('get_races'))
 
 @app.route('/leaderboard')
+@assets.public_page
 def leaderboard():
-    return render_template('pages/leaderboard.html', current_user=current_user)
+    return render_template('pages/leaderboard.html', current_user=current_user,
+                           initial_data=initial_data('get_leaderboard'))
 
 @app.route('/standings')
+@assets.public_page
 def standings():
-    return render_template('pages/standings.html', current_user=current_user)
+    return render_template('pages/standings.html', current_user=current_user,
+                           initial_data=initial_data('get_championship_standings'))
 
 @app.route('/media')
+@assets.public_page
 def media():
-    return render_template('pages/media.html', current_user=current_user)
+    return render_template('pages/media.html', current_user=current_user,
+                           initial_data=initial_data('get_albums', 'get_videos', 'get_photos_by_race'))
 
 @app.route('/locations')
+@assets.public_page
 def locations():
-    return render_template('pages/locations.html', current_user=current_user)
+    return render_template('pages/locations.html', current_user=current_user,
+                           initial_data=initial_data('get_locations'))
 
 @app.route('/13hp')
 @login_required
@@ -103,6 +195,7 @@ def thirteenhp():
 
 @app.route('/api/13hp/stats', methods=['GET'])
 @login_required
+@use_read_replica
 def get_13hp_stats():
     """Get race stats for users interested in 13hp"""
     if not current_user.interested_in_13hp:
@@ -173,40 +266,31 @@ def logo():
 def velopark_cover():
     return send_file('c821b246-b93b-400f-a948-dfc6286d3df5.jpeg')
 
+# Racers change only on writes; one entry per data version and ?include
+racers_cache = TTLCache(maxsize=8, ttl=PAGE_DATA_TTL)
+
 @app.route('/api/racers', methods=['GET'])
+@use_read_replica
 def get_racers():
-    from sqlalchemy.orm import joinedload
-
-    racers = Racer.query.options(
-        joinedload(Racer.best_laps).joinedload(RacerBestLap.location)
-    ).all()
-
-    racers_data = []
-    for racer in racers:
-        racer_dict = racer.to_dict()
-
-        locations_data = {}
-        for lap in racer.best_laps:
-            loc_id = lap.location_id
-            if loc_id not in locations_data:
-                locations_data[loc_id] = {
-                    'location_name': lap.location.name if lap.location else None,
-                    'dry': None,
-                    'wet': None,
-                    'indoor': None
-                }
-            locations_data[loc_id][lap.condition] = lap.best_lap
-
-        racer_dict['best_laps_by_location'] = list(locations_data.values())
-        racers_data.append(racer_dict)
-
-    return jsonify({
+    """Every racer; ?include=best_laps adds their best laps per location and condition"""
+    include_best_laps = 'best_laps' in request.args.get('include', '').split(',')
+    key = (include_best_laps, data_version())
+    racers_data = racers_cache.get(key)
+    if racers_data is None:
+        with primary_for_cache_fill():
+            racers_data = serializers.racer_rows(include_best_laps)
+        racers_cache.set(key, racers_data)
+
+    response = jsonify({
         'status': 'success',
         'count': len(racers_data),
         'data': racers_data
     })
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/api/racers/<int:racer_id>', methods=['GET'])
+@use_read_replica
 def get_racer(racer_id):
     racer = Racer.query.get(racer_id)
     if not racer:
@@ -222,6 +306,7 @@ def get_racer(racer_id):
     })
 
 @app.route('/api/races', methods=['GET'])
+@use_read_replica
 def get_races():
     races = Race.query.order_by(Race.date.desc()).all()
     races_data = [race.to_dict() for race in races]
@@ -232,6 +317,7 @@ def get_races():
     })
 
 @app.route('/api/races/<int:race_id>', methods=['GET'])
+@use_read_replica
 def get_race(race_id):
     race = Race.query.get(race_id)
     if not race:
@@ -253,23 +339,99 @@ def get_race(race_id):
         'data': race_data
     })
 
+@app.route('/api/races/<int:race_id>/laps', methods=['GET'])
+@use_read_replica
+def get_race_laps(race_id):
+    """Lap charts of every result in a race, one row per result"""
+    rows = db.session.execute(
+        db.select(RaceResult.id, RaceResult.racer_id, Racer.name, RaceResult.position, RaceResult.lap_data)
+        .join(Racer, RaceResult.racer_id == Racer.id)
+        .where(RaceResult.race_id == race_id)
+        .order_by(RaceResult.position.nulls_last(), RaceResult.id)
+    ).all()
+    if not rows and db.session.get(Race, race_id) is None:
+        return jsonify({'status': 'error', 'message': 'Race not found'}), 404
+
+    data = []
+    for result_id, racer_id, racer_name, position, lap_data in rows:
+        chart = laps.lap_chart(result_id, lap_data)
+        chart.update(racer_id=racer_id, name=racer_name, position=position)
+        data.append(chart)
+    return jsonify({
+        'status': 'success',
+        'race_id': race_id,
+        'data': data
+    })
+
+# Timing systems post laps with `Authorization: Bearer <LIVE_FEED_TOKEN>`;
+# logged-in admins may post without it
+LIVE_FEED_TOKEN = os.environ.get('LIVE_FEED_TOKEN')
+
+
+@app.route('/api/races/<int:race_id>/live', methods=['GET'])
+def race_live(race_id):
+    """Server-Sent Events: a snapshot of the race's standings, then only what changes"""
+    if db.session.get(Race, race_id) is None:
+        return jsonify({'status': 'error', 'message': 'Race not found'}), 404
+    subscribed = live.broker.subscribe(race_id)
+    if subscribed is None:
+        return jsonify({'status': 'error', 'message': 'Too many live connections'}), 503
+
+    subscription, snapshot = subscribed
+    response = app.response_class(live.broker.events(subscription, snapshot), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/races/<int:race_id>/live/laps', methods=['POST'])
+def post_live_laps(race_id):
+    """Timing feed: {"laps": [{"racer_id": 1, "time": "1:02.345", "position": 2}, ...]}"""
+    if not (LIVE_FEED_TOKEN and request.headers.get('Authorization') == f'Bearer {LIVE_FEED_TOKEN}') \
+            and not (current_user.is_authenticated and current_user.is_admin):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    if db.session.get(Race, race_id) is None:
+        return jsonify({'status': 'error', 'message': 'Race not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    try:
+        updated = live.record_laps(db, race_id, data.get('laps'))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    records.check_races([race_id])
+    db.session.commit()
+    live.publish(race_id)
+
+    return jsonify({
+        'status': 'success',
+        'race_id': race_id,
+        'updated': updated
+    })
+
+@app.route('/api/results/<int:result_id>/laps', methods=['GET'])
+@use_read_replica
+def get_result_laps(result_id):
+    row = db.session.execute(
+        db.select(RaceResult.race_id, RaceResult.racer_id, Racer.name, RaceResult.lap_data)
+        .join(Racer, RaceResult.racer_id == Racer.id)
+        .where(RaceResult.id == result_id)
+    ).first()
+    if row is None:
+        return jsonify({'status': 'error', 'message': 'Result not found'}), 404
+
+    chart = laps.lap_chart(result_id, row.lap_data)
+    chart.update(race_id=row.race_id, racer_id=row.racer_id, name=row.name)
+    return jsonify({
+        'status': 'success',
+        'data': chart
+    })
+
 @app.route('/api/values', methods=['GET'])
 @app.route('/api/results', methods=['GET'])
+@use_read_replica
 def get_race_results():
-    results = db.session.query(RaceResult, Racer.name, Race.race_name, Race.date).join(
-        Racer, RaceResult.racer_id == Racer.id
-    ).join(
-        Race, RaceResult.race_id == Race.id
-    ).all()
-    
-    results_list = []
-    for result, racer_name, race_name, race_date in results:
-        result_dict = result.to_dict()
-        result_dict['name'] = racer_name
-        result_dict['race_name'] = race_name
-        result_dict['date'] = race_date.isoformat() if race_date else None
-        results_list.append(result_dict)
-    
+    results_list = serializers.result_rows()
+
     return jsonify({
         'status': 'success',
         'count': len(results_list),
@@ -277,6 +439,7 @@ def get_race_results():
     })
 
 @app.route('/api/leaderboard', methods=['GET'])
+@use_read_replica
 def get_leaderboard():
     racers = Racer.query.order_by(
         Racer.wins.desc(),
@@ -288,9 +451,9 @@ def get_leaderboard():
         'data': [racer.to_dict() for racer in racers]
     })
 
-@app.route('/api/standings', methods=['GET'])
-def get_championship_standings():
-    standings = db.session.query(
+def standings_data(limit=None):
+    """Racers ranked by total championship points"""
+    query = db.session.query(
         Racer.id.label('racer_id'),
         Racer.name,
         func.sum(RaceResult.points_earned).label('total_points'),
@@ -298,10 +461,12 @@ def get_championship_standings():
         func.count(RaceResult.id).label('races_participated')
     ).join(
         RaceResult, Racer.id == RaceResult.racer_id
-    ).group_by(Racer.id, Racer.name).order_by(func.sum(RaceResult.points_earned).desc()).all()
-    
+    ).group_by(Racer.id, Racer.name).order_by(func.sum(RaceResult.points_earned).desc())
+    if limit:
+        query = query.limit(limit)
+
     standings_list = []
-    for standing in standings:
+    for standing in query.all():
         standings_list.append({
             'racer_id': standing.racer_id,
             'name': standing.name,
@@ -309,13 +474,18 @@ def get_championship_standings():
             'wins': int(standing.wins or 0),
             'races_participated': int(standing.races_participated or 0)
         })
-    
+    return standings_list
+
+@app.route('/api/standings', methods=['GET'])
+@use_read_replica
+def get_championship_standings():
     return jsonify({
         'status': 'success',
-        'data': standings_list
+        'data': standings_data()
     })
 
 @app.route('/api/stats', methods=['GET'])
+@use_read_replica
 def get_stats():
     total_racers = Racer.query.count()
     total_races = Race.query.count()
@@ -366,23 +536,27 @@ def get_stats():
         'data': stats
     })
 
+def recent_races_data():
+    recent_races = Race.query.order_by(Race.date.desc()).limit(8).all()
+    return [race.to_dict() for race in recent_races]
+
 @app.route('/api/recent-races', methods=['GET'])
+@use_read_replica
 def get_recent_races():
-    recent_races = Race.query.order_by(Race.date.desc()).limit(8).all()
     return jsonify({
         'status': 'success',
-        'data': [race.to_dict() for race in recent_races]
+        'data': recent_races_data()
     })
 
-@app.route('/api/fastest-by-location', methods=['GET'])
-def get_fastest_by_location():
+def fastest_lap_records():
     from sqlalchemy.orm import joinedload
 
-    fastest_records = LocationFastestLap.query.options(
+    return LocationFastestLap.query.options(
         joinedload(LocationFastestLap.location),
         joinedload(LocationFastestLap.racer)
     ).all()
 
+def fastest_by_location_data(fastest_records):
     location_data = {}
     for record in fastest_records:
         loc_id = record.location_id
@@ -400,20 +574,125 @@ def get_fastest_by_location():
             'fastest_racer': record.racer.name if record.racer else None
         }
 
-    fastest_laps = [data for data in location_data.values() if data['dry'] or data['wet'] or data['indoor']]
+    return [data for data in location_data.values() if data['dry'] or data['wet'] or data['indoor']]
+
+@app.route('/api/fastest-by-location', methods=['GET'])
+@use_read_replica
+def get_fastest_by_location():
+    return jsonify({
+        'status': 'success',
+        'data': fastest_by_location_data(fastest_lap_records())
+    })
+
+# The dashboard payload changes only on writes; one entry per data version,
+# expiring so writes on other workers show up within PAGE_DATA_TTL
+dashboard_cache = TTLCache(maxsize=4, ttl=PAGE_DATA_TTL)
+
+def dashboard_data():
+    """Everything the dashboard shows, from four queries"""
+    counts = db.session.execute(db.select(
+        db.select(func.count(Racer.id)).scalar_subquery(),
+        db.select(func.count(Race.id)).scalar_subquery(),
+        db.select(func.count(RaceResult.id)).scalar_subquery()
+    )).one()
+
+    # Location records are maintained by recalculate-stats, so the overall
+    # fastest lap is the fastest of them instead of a scan of every result
+    fastest_records = fastest_lap_records()
+    timed = [record for record in fastest_records if record.best_lap_seconds is not None]
+    fastest = min(timed, key=lambda record: record.best_lap_seconds) if timed else None
+
+    return {
+        'stats': {
+            'total_racers': counts[0],
+            'total_races': counts[1],
+            'total_results': counts[2],
+            'fastest_lap_time': fastest.best_lap_seconds if fastest else None,
+            'fastest_lap_racer': fastest.racer.name if fastest and fastest.racer else None
+        },
+        'recent_races': recent_races_data(),
+        'fastest_by_location': fastest_by_location_data(fastest_records),
+        'top_standings': standings_data(limit=5)
+    }
+
+@app.route('/api/dashboard', methods=['GET'])
+@use_read_replica
+def get_dashboard():
+    """Stats, recent races, location records and top standings in one response"""
+    version = data_version()
+    data = dashboard_cache.get(version)
+    if data is None:
+        with primary_for_cache_fill():
+            data = dashboard_data()
+        dashboard_cache.set(version, data)
+
+    response = jsonify({
+        'status': 'success',
+        'data': data
+    })
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/analytics/racers/<int:racer_id>', methods=['GET'])
+@use_read_replica
+def get_racer_analytics(racer_id):
+    """Pace, consistency, gap to the location records and trend of a racer per location"""
+    if db.session.get(Racer, racer_id) is None:
+        return jsonify({'status': 'error', 'message': 'Racer not found'}), 404
+    return jsonify({
+        'status': 'success',
+        'data': analytics.racer_analytics(racer_id)
+    })
+
+@app.route('/api/analytics/locations/<int:location_id>', methods=['GET'])
+@use_read_replica
+def get_location_analytics(location_id):
+    """The same figures for every racer at a location, fastest first"""
+    if db.session.get(Location, location_id) is None:
+        return jsonify({'status': 'error', 'message': 'Location not found'}), 404
+    return jsonify({
+        'status': 'success',
+        'data': analytics.location_analytics(location_id)
+    })
+
+@app.route('/api/search', methods=['GET'])
+@use_read_replica
+def search_all():
+    """Typeahead search across racers, races, locations and albums"""
+    from search import search
+
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 10, type=int)
+    if len(query) < 2:
+        return jsonify({'status': 'success', 'data': []})
 
     return jsonify({
         'status': 'success',
-        'data': fastest_laps
+        'data': search(query, limit)
     })
 
 @app.route('/api/locations', methods=['GET'])
+@use_read_replica
 def get_locations():
     locations = Location.query.all()
     locations_data = [location.to_dict() for location in locations]
     return jsonify(locations_data)
 
+@app.route('/api/locations/<int:location_id>/records', methods=['GET'])
+@use_read_replica
+def get_location_records(location_id):
+    """Current record and record progression per condition at a location"""
+    board = records.record_board(location_id)
+    if not board and db.session.get(Location, location_id) is None:
+        return jsonify({'status': 'error', 'message': 'Location not found'}), 404
+    return jsonify({
+        'status': 'success',
+        'location_id': location_id,
+        'data': board
+    })
+
 @app.route('/api/locations/<int:location_id>', methods=['GET'])
+@use_read_replica
 def get_location(location_id):
     location = Location.query.get(location_id)
     if not location:
@@ -421,6 +700,7 @@ def get_location(location_id):
     return jsonify(location.to_dict())
 
 @app.route('/api/albums', methods=['GET'])
+@use_read_replica
 def get_albums():
     albums = Album.query.outerjoin(Race).order_by(
         Race.date.desc().nullslast(),
@@ -439,7 +719,7 @@ def get_albums():
         if not album_dict.get('cover_url'):
             first_photo = MediaItem.query.filter_by(album_id=album.id, media_type='photo').first()
             if first_photo:
-                album_dict['cover_url'] = first_photo.url
+                album_dict['cover_url'] = first_photo.public_url
 
         if album.race:
             album_dict['race_name'] = album.race.race_name
@@ -452,6 +732,7 @@ def get_albums():
     })
 
 @app.route('/api/albums/<int:album_id>', methods=['GET'])
+@use_read_replica
 def get_album(album_id):
     album = Album.query.get(album_id)
     if not album:
@@ -471,6 +752,7 @@ def get_album(album_id):
     })
 
 @app.route('/api/photos/by-race', methods=['GET'])
+@use_read_replica
 def get_photos_by_race():
     """Get all photos grouped by race, sorted by race date (most recent first)"""
     albums = Album.query.outerjoin(Race).order_by(
@@ -503,6 +785,7 @@ def get_photos_by_race():
     })
 
 @app.route('/api/videos', methods=['GET'])
+@use_read_replica
 def get_videos():
     """Get all videos grouped by album"""
     albums = Album.query.outerjoin(Race).order_by(
@@ -530,12 +813,14 @@ def get_videos():
 
 @app.route('/api/reload', methods=['POST'])
 def reload_data():
-    """Manual endpoint to refresh database connection"""
+    """Verify the database connection (stale connections are already
+    replaced by pool pre-ping, see database.engine_options)"""
     try:
         db.session.execute(db.text('SELECT 1'))
         return jsonify({
             'status': 'success',
-            'message': 'Database connection verified'
+            'message': 'Database connection verified',
+            'pool': pool_stats(db)
         })
     except Exception as e:
         return jsonify({
@@ -543,35 +828,18 @@ def reload_data():
             'message': f'Database error: {str(e)}'
         }), 500
 
-def get_r2_client():
-    """Get Cloudflare R2 client"""
-    return boto3.client(
-        's3',
-        endpoint_url=os.environ.get('R2_ENDPOINT_URL'),
-        aws_access_key_id=os.environ.get('R2_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY'),
-        region_name='auto'
-    )
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({
+        'status': 'error',
+        'success': False,
+        'message': f'Arquivo muito grande. Maximo: {MAX_UPLOAD_SIZE // (1024 * 1024)}MB'
+    }), 413
 
 def upload_to_r2(file, folder='media'):
-    """Upload file to Cloudflare R2"""
+    """Upload file to Cloudflare R2, reusing the stored copy of identical content"""
     try:
-        filename = secure_filename(file.filename)
-        ext = filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{folder}/{uuid.uuid4().hex}.{ext}"
-
-        r2_client = get_r2_client()
-        bucket_name = os.environ.get('R2_BUCKET_NAME')
-
-        r2_client.upload_fileobj(
-            file,
-            bucket_name,
-            unique_filename,
-            ExtraArgs={'ContentType': file.content_type}
-        )
-
-        public_url = os.environ.get('R2_PUBLIC_URL')
-        return f"{public_url}/{unique_filename}"
+        return store_upload(file, folder)
     except Exception as e:
         print(f"R2 Upload Error: {e}")
         return None
@@ -584,41 +852,30 @@ def user_upload_photo(album_id):
     if not album:
         return jsonify({'status': 'error', 'message': 'Album not found'}), 404
 
-    if 'file' not in request.files:
-        return jsonify({'status': 'error', 'message': 'No file provided'}), 400
-
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'status': 'error', 'message': 'No file selected'}), 400
-
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-    if not '.' in file.filename:
-        return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
-
-    ext = file.filename.rsplit('.', 1)[1].lower()
-    if ext not in allowed_extensions:
-        return jsonify({'status': 'error', 'message': 'Only images are allowed'}), 400
-
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-
-    if file_size > 10 * 1024 * 1024:
-        return jsonify({'status': 'error', 'message': 'File too large (max 10MB)'}), 400
-
-    url = upload_to_r2(file, folder=f'albums/{album_id}')
-    if not url:
+    # The body is streamed: size and content are checked while it is read
+    try:
+        file = StreamingUpload(request).open()
+    except UploadRejected as e:
+        return jsonify({'status': 'error', 'message': e.message}), e.status
+
+    blob = upload_to_r2(file, folder=f'albums/{album_id}')
+    if file.error:
+        return jsonify({'status': 'error', 'message': file.error.message}), file.error.status
+    if not blob:
         return jsonify({'status': 'error', 'message': 'Upload failed'}), 500
 
-    title = request.form.get('title', '')
-    description = request.form.get('description', '')
+    form = file.finish()
+    title = form.get('title', '')
+    description = form.get('description', '')
 
     media_item = MediaItem(
         album_id=album_id,
         media_type='photo',
-        url=url,
+        url=canonical_url(public_url(blob.storage_key)),
         title=title,
-        description=description
+        description=description,
+        content_hash=blob.content_hash,
+        storage_key=blob.storage_key
     )
 
     db.session.add(media_item)
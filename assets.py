@@ -0,0 +1,248 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import click
+from functools import wraps
+from flask import current_app, g, request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+# JSON responses at least this large are compressed when the client accepts it.
+# HTML only is when its view is a @public_page: compressing a page that holds a
+# CSRF token or other per-user secret next to reflected input can leak it (BREACH)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_MIMETYPES = {'application/json'}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Static files: build output goes to static/dist, named after a hash of the
+# content, and is cached forever; source files are revalidated after STATIC_MAX_AGE.
+# CSS is minified; JavaScript (full of template literals, which the pure Python
+# minifiers mangle) is only fingerprinted and precompressed
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+IMMUTABLE_MAX_AGE = 31536000
+PRECOMPRESS_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.txt', '.html'}
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def accepted_encodings():
+    """Encodings the client accepts that we can produce, best first"""
+    accepted = []
+    for encoding, extension in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if request.accept_encodings[encoding]:
+            accepted.append((encoding, extension))
+    return accepted
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def public_page(view):
+    """Let the HTML of a page with no CSRF token or per-user secret be compressed"""
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        g.compress_html = True
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def compressible(response):
+    if response.mimetype in COMPRESS_MIMETYPES:
+        return True
+    return response.mimetype == 'text/html' and g.get('compress_html', False)
+
+
+def compress_response(response):
+    """Compress large dynamic JSON responses, and public pages, for clients that accept it"""
+    if (not compressible(response) or response.is_streamed
+            or response.direct_passthrough or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = accepted_encodings()
+    if not accepted:
+        return response
+
+    encoding = accepted[0][0]
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    # An ETag added by the view describes the uncompressed body; weak, it
+    # holds for every encoding and If-None-Match still matches it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ============== STATIC FILES ==============
+
+_manifest = {'mtime': None, 'files': {}}
+
+
+def load_manifest():
+    """Source path -> fingerprinted path under static/, reloaded when rebuilt"""
+    path = os.path.join(current_app.static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    if mtime != _manifest['mtime']:
+        with open(path) as f:
+            _manifest['files'] = json.load(f)
+        _manifest['mtime'] = mtime
+    return _manifest['files']
+
+
+def built_file(filename):
+    """Fingerprinted path of a static file, if its build is current"""
+    built = load_manifest().get(filename)
+    if not built:
+        return None
+    static_folder = current_app.static_folder
+    try:
+        if os.path.getmtime(os.path.join(static_folder, filename)) > os.path.getmtime(os.path.join(static_folder, built)):
+            return None
+    except OSError:
+        return None
+    return built
+
+
+def static_url_defaults(endpoint, values):
+    """Make url_for('static', filename=...) point at the fingerprinted file"""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = built_file(values['filename']) or values['filename']
+
+
+def send_static_file(filename):
+    """Static view serving precompressed siblings and fingerprinted files.
+
+    /static/dist/... URLs never change content, so they are cached for a year.
+    Other URLs are served from their built copy when it is current.
+    """
+    static_folder = current_app.static_folder
+    immutable = filename.startswith(DIST_DIR + '/')
+    path = filename if immutable else (built_file(filename) or filename)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, extension in accepted_encodings():
+        if os.path.isfile(os.path.join(static_folder, path + extension)):
+            encoding, path = candidate, path + extension
+            break
+
+    max_age = IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE
+    response = send_from_directory(static_folder, path, mimetype=mimetype, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+def fingerprint(relative_path, data):
+    base, extension = os.path.splitext(relative_path)
+    return f'{DIST_DIR}/{base}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+
+
+def write_compressed(path, data):
+    """Write .gz/.br siblings, returns their sizes"""
+    sizes = {}
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    with open(path + '.gz', 'wb') as f:
+        f.write(compressed)
+    sizes['gzip'] = len(compressed)
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        with open(path + '.br', 'wb') as f:
+            f.write(compressed)
+        sizes['br'] = len(compressed)
+    return sizes
+
+
+def minify(name, data):
+    """Minified CSS and the tool used, or the content unchanged and why not"""
+    if os.path.splitext(name)[1] != '.css':
+        return data, None
+    if rcssmin is None:
+        return data, 'rcssmin not installed'
+    return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8'), 'rcssmin'
+
+
+assets_cli = AppGroup('assets', help='Static asset build')
+
+
+@assets_cli.command('build')
+@click.option('--minify/--no-minify', 'minify_assets', default=True, help='Minify CSS')
+def build(minify_assets):
+    """Write fingerprinted and precompressed copies of static files (CSS minified) to static/dist"""
+    static_folder = current_app.static_folder
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    manifest = {}
+    report = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                original = f.read()
+
+            data, note = minify(name, original) if minify_assets else (original, None)
+            target = fingerprint(relative, data)
+            target_path = os.path.join(static_folder, target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as f:
+                f.write(data)
+            manifest[relative] = target
+
+            if os.path.splitext(name)[1] in PRECOMPRESS_EXTENSIONS:
+                sizes = write_compressed(target_path, data)
+                report.append((relative, len(original), len(data), sizes.get('gzip'), sizes.get('br'), note))
+
+    with open(os.path.join(dist, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    click.echo(f'{"file":20} {"source":>9} {"minified":>9} {"gzip":>9} {"brotli":>9}')
+    for relative, original, minified, gzip_size, br_size, note in report:
+        click.echo(f'{relative:20} {original:9} {minified:9} {gzip_size:9} {br_size or "-":>9}'
+                   + (f'  ({note})' if note else ''))
+    total = sum(row[1] for row in report)
+    smallest = sum(row[4] or row[3] for row in report)
+    click.echo(f'Built {len(manifest)} static files; text assets {total} -> {smallest} bytes on the wire '
+               f'({total - smallest} saved)' + ('' if brotli else ', gzip only: brotli is not installed'))
+
+
+def init_app(app):
+    app.view_functions['static'] = send_static_file
+    app.url_defaults(static_url_defaults)
+    app.after_request(compress_response)
+    app.cli.add_command(assets_cli)
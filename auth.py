@@ -1,10 +1,37 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
+import os
 from models import db, User
+from cache import TTLCache, detached_copy
+from passwords import check_password, needs_rehash, login_allowed, PasswordHashBusy
 
 auth = Blueprint('auth', __name__)
 
+# Flask-Login loads the user on every authenticated request (including each
+# SPA API call). Keep a short-lived per-process copy of the row instead of
+# querying it each time; writes to a user call invalidate_user()
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('USER_CACHE_TTL', 60))
+)
+
+
+def load_cached_user(user_id):
+    """Return the user bound to the current session, from cache when possible"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return db.session.merge(snapshot, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.set(user_id, detached_copy(user))
+    return user
+
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
+
 
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
@@ -19,13 +46,29 @@ def login():
             flash('Por favor, preencha todos os campos.', 'error')
             return render_template('auth/login.html')
 
+        if not login_allowed(email):
+            flash('Muitas tentativas de login. Aguarde um minuto e tente novamente.', 'error')
+            return render_template('auth/login.html'), 429
+
         user = User.query.filter_by(email=email).first()
 
         if user and user.is_active:
-            from app import bcrypt
-            if bcrypt.check_password_hash(user.password_hash, password):
+            try:
+                password_ok = check_password(user.password_hash, password)
+            except PasswordHashBusy:
+                flash('Servidor ocupado. Tente novamente em alguns segundos.', 'error')
+                return render_template('auth/login.html'), 503
+            if password_ok:
+                # Transparently upgrade hashes made with an older policy; with the
+                # pool busy the upgrade waits for a later login
+                if needs_rehash(user.password_hash):
+                    try:
+                        user.set_password(password)
+                    except PasswordHashBusy:
+                        pass
                 user.last_login = datetime.utcnow()
                 db.session.commit()
+                invalidate_user(user.id)
                 login_user(user)
                 next_page = request.args.get('next')
                 return redirect(next_page if next_page else url_for('dashboard'))
@@ -58,19 +101,24 @@ def register():
             flash('A senha deve ter pelo menos 6 caracteres.', 'error')
             return render_template('auth/register.html')
 
+        if not login_allowed():
+            flash('Muitas tentativas. Aguarde um minuto e tente novamente.', 'error')
+            return render_template('auth/register.html'), 429
+
         existing_user = User.query.filter_by(email=email).first()
         if existing_user:
             flash('Este email já está cadastrado.', 'error')
             return render_template('auth/register.html')
 
-        from app import bcrypt
-        password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
-
         new_user = User(
             email=email,
-            name=name,
-            password_hash=password_hash
+            name=name
         )
+        try:
+            new_user.set_password(password)
+        except PasswordHashBusy:
+            flash('Servidor ocupado. Tente novamente em alguns segundos.', 'error')
+            return render_template('auth/register.html'), 503
 
         db.session.add(new_user)
         db.session.commit()
@@ -84,6 +132,7 @@ def register():
 @auth.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('Você saiu da sua conta.', 'success')
     return redirect(url_for('dashboard'))
@@ -138,6 +187,7 @@ def profile():
                 racer.experience_years = int(experience_years) if experience_years else 0
 
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Perfil atualizado com sucesso!', 'success')
         return redirect(url_for('auth.profile'))
 
@@ -0,0 +1,170 @@
+"""Randomized check of the incremental location record history.
+
+    python benchmarks/check_records.py [--steps 300] [--seed 1]
+
+Seeds a small SQLite database where races often share a location, condition
+and date, then drives the admin routes that maintain the history: results
+created, edited and deleted (one by one and in bulk), and races moved to
+another date, location or weather. After every step the stored history must
+equal a replay from scratch (records.rebuild_history); the first mismatch is
+printed and the script exits 1.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import BENCH_ADMIN_EMAIL, BENCH_ADMIN_PASSWORD, WEATHER, lap_time, load_app, seed  # noqa: E402
+
+# Few locations and dates, so most writes land on a timeline's record date
+VOLUMES = {'locations': 2, 'racers': 12, 'races': 0, 'results_per_race': 0, 'albums': 0, 'media_per_album': 0}
+DATES = [date(2026, 1, 1) + timedelta(days=7 * i) for i in range(6)]
+
+
+def history(db):
+    from models import LocationRecord
+    return db.session.execute(
+        db.select(LocationRecord.location_id, LocationRecord.condition, LocationRecord.set_on,
+                  LocationRecord.race_id, LocationRecord.racer_id, LocationRecord.best_lap_seconds,
+                  LocationRecord.previous_seconds, LocationRecord.improvement_seconds)
+        .order_by(LocationRecord.location_id, LocationRecord.condition, LocationRecord.set_on, LocationRecord.id)
+    ).all()
+
+
+def replayed(db):
+    """The history a replay from scratch gives, without keeping it"""
+    import records
+    records.rebuild_history()
+    db.session.flush()
+    rows = history(db)
+    db.session.rollback()
+    return rows
+
+
+class Steps:
+    def __init__(self, app, db, rng):
+        self.app = app
+        self.db = db
+        self.rng = rng
+        self.client = app.test_client()
+        response = self.client.post('/login', data={'email': BENCH_ADMIN_EMAIL, 'password': BENCH_ADMIN_PASSWORD})
+        if response.status_code != 302:
+            sys.exit('Could not log in as the benchmark admin')
+
+    def ids(self, model, *filters):
+        with self.app.app_context():
+            return self.db.session.scalars(self.db.select(model.id).where(*filters).order_by(model.id)).all()
+
+    def call(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        if response.status_code >= 400:
+            sys.exit(f'{method} {path} answered {response.status_code}: {response.get_data(as_text=True)}')
+        return response.get_json()
+
+    def lap(self):
+        return lap_time(self.rng.uniform(55, 60))
+
+    def race_fields(self):
+        from models import Location
+        return {
+            'date': self.rng.choice(DATES).isoformat(),
+            'location_id': self.rng.choice(self.ids(Location)),
+            'weather': self.rng.choice(WEATHER)
+        }
+
+    def create_race(self):
+        """A race (often on an existing record's date) with a few timed results"""
+        from models import Racer
+        race = self.call('POST', '/admin/races', {'race_name': 'Check', **self.race_fields()})['race']
+        racers = self.rng.sample(self.ids(Racer), self.rng.randint(1, 4))
+        self.call('POST', '/admin/results/bulk-create', {'race_id': race['race_id'], 'results': [
+            {'racer_id': racer_id, 'position': position, 'lap_time_best': self.lap()}
+            for position, racer_id in enumerate(racers, start=1)
+        ]})
+        return f'create race {race["race_id"]} on {race["date"]}'
+
+    def add_result(self):
+        from models import Race, Racer, RaceResult
+        race_id = self.rng.choice(self.ids(Race))
+        taken = set(self.ids(Racer, Racer.id.in_(
+            self.db.select(RaceResult.racer_id).where(RaceResult.race_id == race_id).scalar_subquery()
+        )))
+        free = [racer_id for racer_id in self.ids(Racer) if racer_id not in taken]
+        if not free:
+            return None
+        self.call('POST', '/admin/results', {'race_id': race_id, 'racer_id': self.rng.choice(free),
+                                             'lap_time_best': self.lap()})
+        return f'add a result to race {race_id}'
+
+    def edit_result(self):
+        from models import RaceResult
+        result_id = self.rng.choice(self.ids(RaceResult))
+        self.call('PUT', f'/admin/results/{result_id}', {'lap_time_best': self.lap()})
+        return f'edit the lap of result {result_id}'
+
+    def delete_result(self):
+        from models import RaceResult
+        result_id = self.rng.choice(self.ids(RaceResult))
+        self.call('DELETE', f'/admin/results/{result_id}')
+        return f'delete result {result_id}'
+
+    def bulk_delete(self):
+        from models import RaceResult
+        result_ids = self.rng.sample(self.ids(RaceResult), 2)
+        self.call('POST', '/admin/results/bulk-delete', {'result_ids': result_ids})
+        return f'delete results {result_ids}'
+
+    def move_race(self):
+        from models import Race
+        race_id = self.rng.choice(self.ids(Race))
+        fields = self.race_fields()
+        changed = dict(self.rng.sample(sorted(fields.items()), self.rng.randint(1, 3)))
+        self.call('PUT', f'/admin/races/{race_id}', changed)
+        return f'move race {race_id}: {changed}'
+
+    def random(self):
+        from models import Race, RaceResult
+        actions = [self.create_race]
+        if self.ids(Race):
+            actions.append(self.move_race)
+        if len(self.ids(RaceResult)) > 10:
+            actions += [self.add_result, self.edit_result, self.delete_result, self.bulk_delete]
+        return self.rng.choice(actions)()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', default='sqlite:////tmp/nerds-check-records.db')
+    args = parser.parse_args()
+    if not args.database_url.startswith('sqlite'):
+        sys.exit('The check drops every table, point it at a SQLite file')
+
+    app, db = load_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, seed=args.seed, **VOLUMES)
+
+    steps = Steps(app, db, random.Random(args.seed))
+    for step in range(1, args.steps + 1):
+        action = steps.random()
+        if action is None:
+            continue
+        with app.app_context():
+            stored, expected = history(db), replayed(db)
+        if stored != expected:
+            print(f'Step {step}, {action}: the history differs from a replay')
+            for label, rows, other in (('stored  ', stored, expected), ('replayed', expected, stored)):
+                for row in rows:
+                    if row not in other:
+                        print(f'  {label} {tuple(row)}')
+            sys.exit(1)
+    print(f'{args.steps} steps, the history always matched a replay')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Benchmark every /api/* endpoint and the heavy admin routes.
+
+    python benchmarks/run.py --reset                  # fresh SQLite, small scale
+    python benchmarks/run.py --scale medium --compare # fail on regressions
+    python benchmarks/run.py --save-baseline          # record benchmarks/baseline.json
+    python benchmarks/run.py --http http://localhost:5003 --concurrency 8
+
+In-process runs use the Flask test client and report latency percentiles,
+SQL statements per request and peak Python memory (tracemalloc) for each
+route. --http drives an already running server (e.g. gunicorn) with
+concurrent requests instead; it reports latency and throughput only.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import BENCH_ADMIN_EMAIL, BENCH_ADMIN_PASSWORD, add_arguments, check_reset, load_app, prepare  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(timings):
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+    }
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+# Server-Sent Event streams stay open until the client leaves
+STREAMING_ENDPOINTS = {'race_live'}
+# Query strings for routes that answer nothing useful without one
+QUERY_STRINGS = {'/api/search': 'q=Piloto+1'}
+# Routes served from caches keyed on the data version, also timed after every write
+# (on SQLite /api/search answers from an in-memory index rebuilt the same way)
+VERSION_CACHED = ('/api/dashboard', '/api/racers', '/api/racers?include=best_laps', '/api/search',
+                  '/api/analytics/racers/<int:racer_id>', '/api/analytics/locations/<int:location_id>')
+
+
+def cold():
+    """Run before a request: invalidate the data version caches, as a write does"""
+    from cache import bump_data_version
+    bump_data_version()
+
+
+def api_targets(app, db):
+    """One GET per /api/* rule, path parameters filled with seeded ids, and cold cache variants.
+
+    A target is (name, method, path, before): `before` is None or a callable
+    run untimed ahead of each request, returning its JSON body.
+    """
+    from models import Racer, Race, Location, Album
+
+    sample_ids = {}
+    with app.app_context():
+        for name, model in (('racer_id', Racer), ('race_id', Race), ('location_id', Location), ('album_id', Album)):
+            sample_ids[name] = db.session.scalars(db.select(model.id).order_by(model.id)).first()
+
+    targets = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if not rule.rule.startswith('/api/') or 'GET' not in rule.methods or rule.endpoint in STREAMING_ENDPOINTS:
+            continue
+        path = rule.rule
+        for arg in rule.arguments:
+            path = path.replace(f'<int:{arg}>', str(sample_ids.get(arg, 1))).replace(f'<{arg}>', str(sample_ids.get(arg, 1)))
+        if rule.rule in QUERY_STRINGS:
+            path += '?' + QUERY_STRINGS[rule.rule]
+        targets.append((f'GET {rule.rule}', 'GET', path, None))
+    targets.append(('GET /api/racers?include=best_laps', 'GET', '/api/racers?include=best_laps', None))
+    targets += [(f'{name} (cold)', method, path, cold) for name, method, path, _ in list(targets)
+                if name[len('GET '):] in VERSION_CACHED]
+    targets.append(('POST /api/reload', 'POST', '/api/reload', None))
+    return targets
+
+
+def admin_targets(app, db):
+    """Admin grids and heavy admin writes; each bulk create gets a fresh race so nothing is skipped"""
+    from models import Race, Racer
+
+    with app.app_context():
+        racer_ids = db.session.scalars(db.select(Racer.id).order_by(Racer.id).limit(15)).all()
+        location_id = db.session.scalars(db.select(Race.location_id)).first()
+
+    def bulk_payload():
+        from datetime import date
+        with app.app_context():
+            race = Race(race_name='Benchmark', date=date(2026, 1, 1), location_id=location_id, weather='Seco')
+            db.session.add(race)
+            db.session.commit()
+            race_id = race.id
+        return {'race_id': race_id, 'results': [
+            {'racer_id': racer_id, 'position': position, 'lap_time_best': f'1:0{position % 10}.123', 'laps': 20}
+            for position, racer_id in enumerate(racer_ids, start=1)
+        ]}
+
+    grids = [
+        (f'GET /admin/api/grid/{name}', 'GET', f'/admin/api/grid/{name}', None)
+        for name in ('results', 'races', 'racers', 'users')
+    ]
+    return grids + [
+        ('GET /admin/results', 'GET', '/admin/results', None),
+        ('POST /admin/racers/recalculate-stats', 'POST', '/admin/racers/recalculate-stats', None),
+        ('POST /admin/results/bulk-create', 'POST', '/admin/results/bulk-create', bulk_payload),
+    ]
+
+
+def run_in_process(app, db, targets, iterations, warmup):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    client = app.test_client()
+    response = client.post('/login', data={'email': BENCH_ADMIN_EMAIL, 'password': BENCH_ADMIN_PASSWORD})
+    if response.status_code != 302:
+        sys.exit('Could not log in as the benchmark admin, reseed with --reset')
+
+    counter = QueryCounter()
+    event.listen(Engine, 'before_cursor_execute', counter)
+
+    def call(method, path, before):
+        json_body = before() if before else None
+        counter.count = 0
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=json_body)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            print(f'  {method} {path} answered {response.status_code}')
+        return elapsed, counter.count
+
+    results = {}
+    for name, method, path, before in targets:
+        iters = max(1, iterations // 10) if method == 'POST' and path.startswith('/admin') else iterations
+        for _ in range(warmup):
+            call(method, path, before)
+
+        timings = []
+        queries = 0
+        for _ in range(iters):
+            elapsed, queries = call(method, path, before)
+            timings.append(elapsed)
+
+        tracemalloc.start()
+        call(method, path, before)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {**summarize(timings), 'queries': queries, 'peak_kb': round(peak / 1024), 'requests': iters}
+        print(f'{name:45} p50 {results[name]["p50_ms"]:8.2f} ms  p95 {results[name]["p95_ms"]:8.2f} ms  '
+              f'p99 {results[name]["p99_ms"]:8.2f} ms  {queries:5} queries  {results[name]["peak_kb"]:7} KB')
+
+    event.remove(Engine, 'before_cursor_execute', counter)
+    return results
+
+
+def run_http(base_url, targets, iterations, concurrency):
+    """Concurrent GETs against a running server; admin routes need a session and
+    cold cache variants need the server's process, so both are skipped"""
+    def fetch(url):
+        started = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, method, path, before in targets:
+            if method != 'GET' or before is not None:
+                continue
+            url = base_url.rstrip('/') + path
+            started = time.perf_counter()
+            try:
+                timings = list(pool.map(fetch, [url] * iterations))
+            except Exception as e:
+                print(f'  {name}: {e}')
+                continue
+            elapsed = time.perf_counter() - started
+            results[name] = {**summarize(timings), 'rps': round(len(timings) / elapsed, 1)}
+            print(f'{name:45} p50 {results[name]["p50_ms"]:8.2f} ms  p95 {results[name]["p95_ms"]:8.2f} ms  '
+                  f'p99 {results[name]["p99_ms"]:8.2f} ms  {results[name]["rps"]:8.1f} req/s')
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Routes slower than baseline p95 * threshold, or issuing more queries"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * threshold and current['p95_ms'] - previous['p95_ms'] > 1:
+            regressions.append(f'{name}: p95 {previous["p95_ms"]} ms -> {current["p95_ms"]} ms')
+        if 'queries' in current and current['queries'] > previous.get('queries', current['queries']):
+            regressions.append(f'{name}: {previous["queries"]} -> {current["queries"]} queries')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API')
+    add_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--http', metavar='BASE_URL', help='load test a running server instead')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--compare', action='store_true', help='exit 1 when a route regressed against the baseline')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed p95 slowdown factor')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+    check_reset(args)
+
+    app, db = load_app(args.database_url)
+    counts = prepare(app, db, args)
+    if counts:
+        print('Seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+
+    targets = api_targets(app, db)
+    if args.http:
+        results = run_http(args.http, targets, args.iterations, args.concurrency)
+    else:
+        results = run_in_process(app, db, targets + admin_targets(app, db), args.iterations, args.warmup)
+
+    if args.save_baseline:
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        with open(args.baseline, 'w') as f:
+            json.dump({'scale': args.scale, 'database': dialect, 'iterations': args.iterations,
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline written to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f'Baseline was recorded at scale {baseline.get("scale")}, not comparing')
+            return
+        regressions = compare(results, baseline['results'], args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions and args.compare:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
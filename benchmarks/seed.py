@@ -0,0 +1,269 @@
+"""Synthetic data for benchmarks.
+
+    python benchmarks/seed.py --scale medium --reset
+
+Data is deterministic for a given --seed, so runs against the same scale are
+comparable. The database is a SQLite file in /tmp unless --database-url says
+otherwise ($DATABASE_URL is deliberately ignored). Never point --reset at a
+database you care about: resetting anything but SQLite also needs
+--confirm-reset.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+SCALES = {
+    'small': {'locations': 8, 'racers': 50, 'races': 200, 'results_per_race': 10, 'albums': 40, 'media_per_album': 25},
+    'medium': {'locations': 15, 'racers': 200, 'races': 1000, 'results_per_race': 12, 'albums': 200, 'media_per_album': 40},
+    'large': {'locations': 30, 'racers': 1000, 'races': 5000, 'results_per_race': 15, 'albums': 1000, 'media_per_album': 50},
+}
+
+BENCH_ADMIN_EMAIL = 'bench@example.com'
+BENCH_ADMIN_PASSWORD = 'bench-password'
+
+WEATHER = ['Ensolarado', 'Nublado', 'Chuvoso', 'Indoor', 'Seco']
+CITIES = ['Sao Paulo', 'Campinas', 'Santos', 'Sorocaba']
+BATCH_SIZE = 5000
+BENCH_DATABASE_URL = 'sqlite:////tmp/nerds-bench.db'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The migrations start from a database that already had these tables, so they
+# are created first, without the columns and indexes later migrations add
+BASE_TABLES = {
+    'locations': {'import_mapping'},
+    'racers': set(),
+    'races': {'championship_id', 'condition'},
+    'race_results': {'excluded', 'lap_data'},
+}
+
+
+def lap_time(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f'{int(minutes)}:{seconds:06.3f}'
+
+
+def _insert(db, model, rows):
+    from sqlalchemy import insert
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def _ids(db, model):
+    return db.session.scalars(db.select(model.id).order_by(model.id)).all()
+
+
+def seed(db, locations, racers, races, results_per_race, albums, media_per_album, seed=42):
+    """Insert synthetic rows into an empty database, returns the row counts"""
+    from models import User, Racer, Location, Race, RaceResult, Album, MediaItem
+    from passwords import hash_password
+    from stats import get_weather_condition
+
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)
+
+    _insert(db, Location, [{
+        'name': f'Kartodromo {i} VP{rng.choice([1000, 1500])}',
+        'rental_duration': '30 min',
+        'price_per_person': rng.randint(80, 250),
+        'min_participants': 6,
+        'max_participants': 20,
+        'city': rng.choice(CITIES),
+        'address': f'Rua {i}, {rng.randint(1, 999)}',
+        'description': 'Pista de kart ' * 10,
+        'created_at': now,
+        'updated_at': now
+    } for i in range(locations)])
+    location_ids = _ids(db, Location)
+    # Each track has its own pace
+    track_pace = {location_id: rng.uniform(40, 75) for location_id in location_ids}
+
+    _insert(db, Racer, [{
+        'name': f'Piloto {i}',
+        'age': rng.randint(18, 60),
+        'experience_years': rng.randint(0, 15),
+        'created_at': now,
+        'updated_at': now
+    } for i in range(racers)])
+    racer_ids = _ids(db, Racer)
+    skill = {racer_id: rng.uniform(0.97, 1.08) for racer_id in racer_ids}
+
+    _insert(db, User, [{
+        'email': BENCH_ADMIN_EMAIL,
+        'password_hash': hash_password(BENCH_ADMIN_PASSWORD),
+        'name': 'Benchmark',
+        'is_active': True,
+        'is_admin': True,
+        'racer_id': racer_ids[0],
+        'interested_in_13hp': True,
+        'created_at': now,
+        'updated_at': now
+    }] + [{
+        'email': f'piloto{i}@example.com',
+        'password_hash': '!',
+        'name': f'Piloto {i}',
+        'is_active': True,
+        'is_admin': False,
+        'racer_id': racer_id,
+        'interested_in_13hp': i % 3 == 0,
+        'created_at': now,
+        'updated_at': now
+    } for i, racer_id in enumerate(racer_ids[1:], start=1)])
+
+    start_date = date(2020, 1, 1)
+    race_rows = []
+    for i in range(races):
+        weather = rng.choice(WEATHER)
+        race_rows.append({
+            'race_name': f'Corrida {i}',
+            'date': start_date + timedelta(days=i * 2000 // max(races, 1)),
+            'location_id': rng.choice(location_ids),
+            'weather': weather,
+            'condition': get_weather_condition(weather),
+            'total_laps': rng.randint(15, 30),
+            'created_at': now,
+            'updated_at': now
+        })
+    _insert(db, Race, race_rows)
+    race_ids = _ids(db, Race)
+
+    result_rows = []
+    for race_id, race in zip(race_ids, race_rows):
+        pace = track_pace[race['location_id']]
+        entrants = rng.sample(racer_ids, min(results_per_race, len(racer_ids)))
+        laps = sorted(((pace * skill[r] * rng.uniform(0.99, 1.03), r) for r in entrants))
+        for position, (best, racer_id) in enumerate(laps, start=1):
+            average = best * rng.uniform(1.01, 1.05)
+            result_rows.append({
+                'race_id': race_id,
+                'racer_id': racer_id,
+                'position': position,
+                'lap_time_best': lap_time(best),
+                'lap_time_average': lap_time(average),
+                'total_time': lap_time(average * race['total_laps']),
+                'points_earned': max(0, 25 - (position - 1) * 3),
+                'dnf': False,
+                'laps': race['total_laps'],
+                'excluded': False,
+                'created_at': now,
+                'updated_at': now
+            })
+    _insert(db, RaceResult, result_rows)
+
+    _insert(db, Album, [{
+        'name': f'Album {i}',
+        'description': 'Fotos da corrida',
+        'race_id': race_ids[i % len(race_ids)] if race_ids else None,
+        'cover_url': f'https://media.example/albums/cover-{i}.jpg',
+        'created_at': now,
+        'updated_at': now
+    } for i in range(albums)])
+    album_ids = _ids(db, Album)
+
+    _insert(db, MediaItem, [{
+        'album_id': album_id,
+        'media_type': 'video' if n % 10 == 0 else 'photo',
+        'url': f'https://media.example/media/{album_id}-{n}.jpg',
+        'storage_key': f'media/{album_id}-{n}.jpg',
+        'title': f'Foto {n}',
+        'created_at': now + timedelta(minutes=n)
+    } for album_id in album_ids for n in range(media_per_album)])
+
+    return {
+        'locations': len(location_ids),
+        'racers': len(racer_ids),
+        'races': len(race_ids),
+        'results': len(result_rows),
+        'albums': len(album_ids),
+        'media_items': len(album_ids) * media_per_album
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--database-url', default=BENCH_DATABASE_URL)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    parser.add_argument('--confirm-reset', action='store_true',
+                        help='allow --reset on a database that is not SQLite')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    for key in SCALES['small']:
+        parser.add_argument(f'--{key.replace("_", "-")}', type=int, help=f'override the scale\'s {key}')
+
+
+def volumes(args):
+    values = dict(SCALES[args.scale])
+    for key in values:
+        if getattr(args, key) is not None:
+            values[key] = getattr(args, key)
+    return values
+
+
+def load_app(database_url):
+    """Import the app against the benchmark database"""
+    os.environ['DATABASE_URL'] = database_url
+    # Hashing cost is not what is being measured
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    sys.path.insert(0, ROOT)
+    from app import app
+    from models import db
+    return app, db
+
+
+def check_reset(args):
+    """Exit unless resetting args.database_url was asked for explicitly enough"""
+    if args.reset and not args.database_url.startswith('sqlite') and not args.confirm_reset:
+        sys.exit(f'Refusing to reset {args.database_url}: it is not SQLite, pass --confirm-reset if you mean it')
+
+
+def create_schema(db):
+    """Build the schema the way production got it: the pre-migration tables, then `flask db upgrade`"""
+    from flask_migrate import upgrade
+    from sqlalchemy import MetaData, Table, inspect
+
+    inspector = inspect(db.engine)
+    if not inspector.has_table('alembic_version'):
+        if inspector.has_table('racers'):
+            sys.exit('Database was not built from the migrations, pass --reset to rebuild it')
+        base = MetaData()
+        for name, added in BASE_TABLES.items():
+            columns = []
+            for column in db.metadata.tables[name].columns:
+                if column.name not in added:
+                    column = column._copy()
+                    column.index = None
+                    columns.append(column)
+            Table(name, base, *columns)
+        base.create_all(db.engine)
+    upgrade(directory=os.path.join(ROOT, 'migrations'))
+
+
+def prepare(app, db, args):
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            with db.engine.begin() as connection:
+                connection.execute(db.text('DROP TABLE IF EXISTS alembic_version'))
+        create_schema(db)
+        from models import Racer
+        if db.session.query(Racer.id).first() is not None:
+            print('Database already has data, pass --reset to reseed it')
+            return None
+        return seed(db, seed=args.seed, **volumes(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database with synthetic data')
+    add_arguments(parser)
+    args = parser.parse_args()
+    check_reset(args)
+
+    app, db = load_app(args.database_url)
+    counts = prepare(app, db, args)
+    if counts:
+        print(', '.join(f'{count} {name}' for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Serialization cost of /api/results and /api/racers at 50k rows.
+
+    python benchmarks/serialization.py [--rows 50000] [--repeat 5]
+
+Compares ORM objects + to_dict() against the column serializers, each turned
+into a response (as jsonify does) by Flask's default JSON provider and by
+orjson when it is installed.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import load_app, seed  # noqa: E402
+
+
+def orm_results(db):
+    from models import Racer, Race, RaceResult
+    rows = db.session.query(RaceResult, Racer.name, Race.race_name, Race.date).join(
+        Racer, RaceResult.racer_id == Racer.id
+    ).join(
+        Race, RaceResult.race_id == Race.id
+    ).all()
+    data = []
+    for result, racer_name, race_name, race_date in rows:
+        item = result.to_dict()
+        item['name'] = racer_name
+        item['race_name'] = race_name
+        item['date'] = race_date.isoformat() if race_date else None
+        data.append(item)
+    return data
+
+
+def orm_racers(db):
+    from sqlalchemy.orm import joinedload
+    from models import Racer, RacerBestLap
+    data = []
+    for racer in Racer.query.options(joinedload(Racer.best_laps).joinedload(RacerBestLap.location)).all():
+        item = racer.to_dict()
+        locations = {}
+        for lap in racer.best_laps:
+            if lap.location_id not in locations:
+                locations[lap.location_id] = {'location_name': lap.location.name if lap.location else None,
+                                              'dry': None, 'wet': None, 'indoor': None}
+            locations[lap.location_id][lap.condition] = lap.best_lap
+        item['best_laps_by_location'] = list(locations.values())
+        data.append(item)
+    return data
+
+
+def seed_best_laps(db):
+    from sqlalchemy import insert
+    from models import Racer, Location, RacerBestLap
+    rng = random.Random(1)
+    location_ids = db.session.scalars(db.select(Location.id)).all()
+    rows = [{
+        'racer_id': racer_id,
+        'location_id': location_id,
+        'condition': rng.choice(['dry', 'wet', 'indoor']),
+        'best_lap': f'1:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}'
+    } for racer_id in db.session.scalars(db.select(Racer.id)).all()
+        for location_id in rng.sample(location_ids, 2)]
+    db.session.execute(insert(RacerBestLap), rows)
+    db.session.commit()
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url', default='sqlite:////tmp/nerds-bench-serialization.db')
+    args = parser.parse_args()
+
+    app, db = load_app(args.database_url)
+    from flask.json.provider import DefaultJSONProvider
+    import serializers
+
+    providers = {'default': DefaultJSONProvider(app)}
+    if serializers.orjson is not None:
+        providers['orjson'] = serializers.OrjsonProvider(app)
+    else:
+        print('orjson is not installed, only timing the default provider')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, locations=10, racers=args.rows, races=args.rows // 10, results_per_race=10,
+             albums=0, media_per_album=0)
+        seed_best_laps(db)
+
+        cases = (
+            ('/api/results', 'orm + to_dict', lambda: orm_results(db)),
+            ('/api/results', 'columns', serializers.result_rows),
+            ('/api/racers', 'orm + to_dict', lambda: orm_racers(db)),
+            ('/api/racers', 'columns', serializers.racer_rows),
+        )
+        print(f'{"endpoint":14} {"rows":22} {"build ms":>10} ' + ' '.join(f'{name + " ms":>12}' for name in providers))
+        for endpoint, name, build in cases:
+            build_ms, data = measure(build, args.repeat)
+            db.session.expunge_all()
+            dump_ms = [measure(lambda: provider.response(status='success', count=len(data), data=data),
+                               args.repeat)[0] for provider in providers.values()]
+            print(f'{endpoint:14} {name:22} {build_ms:10.1f} ' + ' '.join(f'{ms:12.1f}' for ms in dump_ms))
+
+
+if __name__ == '__main__':
+    main()
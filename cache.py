@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    Caches are per process: with several gunicorn workers each one holds its
+    own copy, so entries may be up to `ttl` seconds stale on other workers.
+    """
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_data_version_lock = threading.Lock()
+_data_version = {'value': 0, 'bumped_at': float('-inf')}
+
+
+def data_version():
+    """Counter bumped by every write request handled by this process.
+
+    Caches of derived data key their entries on it. Other workers only see
+    a write when their entries expire, so those caches also need a TTL.
+    """
+    return _data_version['value']
+
+
+def bump_data_version():
+    with _data_version_lock:
+        _data_version['value'] += 1
+        _data_version['bumped_at'] = time.monotonic()
+
+
+def seconds_since_write():
+    """Time since this process last bumped the data version"""
+    return time.monotonic() - _data_version['bumped_at']
+
+
+def detached_copy(instance):
+    """Copy the column values of an ORM instance into a new detached instance.
+
+    The copy can be attached to any later session with
+    session.merge(copy, load=False), which costs no query.
+    """
+    mapper = inspect(instance).mapper
+    copy = mapper.class_()
+    for attr in mapper.column_attrs:
+        setattr(copy, attr.key, getattr(instance, attr.key))
+    make_transient_to_detached(copy)
+    return copy
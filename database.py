@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+# After a write, the same browser reads from the primary for this many seconds
+# so it sees its own changes despite replication lag. A dedicated cookie marks
+# it: reading the Flask session would add Vary: Cookie to every public response
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+PRIMARY_COOKIE = 'primary_until'
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    'connects': 0,
+    'checkouts': 0,
+    'invalidated': 0,
+    'wait_seconds': 0.0,
+    'max_wait_seconds': 0.0,
+    'timeouts': 0
+}
+
+
+def _record(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            if key == 'max_wait_seconds':
+                _stats[key] = max(_stats[key], value)
+            else:
+                _stats[key] += value
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            _record(timeouts=1)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            _record(wait_seconds=waited, max_wait_seconds=waited)
+
+
+def engine_options(database_url):
+    """SQLAlchemy engine options from the environment.
+
+    PostgreSQL:
+        DB_POOL_SIZE / DB_MAX_OVERFLOW   connections kept / extra under load, per worker
+        DB_POOL_TIMEOUT                  seconds to wait for a free connection
+        DB_POOL_RECYCLE                  seconds before a connection is replaced
+        DB_POOL_PRE_PING                 test connections on checkout (default on)
+        DB_STATEMENT_TIMEOUT_MS          server-side statement timeout
+        DB_PGBOUNCER                     PgBouncer (transaction pooling) mode: no
+                                         client-side pool, no startup options
+    """
+    options = {'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True)}
+
+    if not database_url or not database_url.startswith('postgresql'):
+        # In-memory SQLite keeps Flask-SQLAlchemy's single shared connection
+        if database_url and ':memory:' not in database_url and database_url != 'sqlite://':
+            options['poolclass'] = TimedQueuePool
+        return options
+
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+    if env_flag('DB_PGBOUNCER'):
+        # PgBouncer pools the server connections and rejects unknown startup
+        # parameters; the statement timeout is set per transaction instead
+        options['poolclass'] = NullPool
+        return options
+
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 2)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    })
+    if statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+class RoutingSession(Session):
+    """Session that sends reads of read-only requests to the 'read' bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('use_read_replica'):
+            replica = self._db.engines.get('read')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _wrote_recently():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) >= time.time()
+    except ValueError:
+        return False
+
+
+def use_read_replica(f):
+    """Serve the view from DATABASE_READ_URL unless the browser wrote recently"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not _wrote_recently() and not g.get('primary_fill'):
+            g.use_read_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@contextmanager
+def primary_for_cache_fill():
+    """Read from the primary while computing data cached under the current data version.
+
+    Shortly after a write the replica may not have it yet, and what is cached
+    now is served to every request (the writer's included) until it expires.
+    """
+    from cache import seconds_since_write
+    recent = has_request_context() and seconds_since_write() < READ_YOUR_WRITES_SECONDS
+    if recent:
+        previous = g.get('use_read_replica'), g.get('primary_fill')
+        g.use_read_replica, g.primary_fill = False, True
+    try:
+        yield
+    finally:
+        if recent:
+            g.use_read_replica, g.primary_fill = previous
+
+
+def init_app(app, db):
+    """Attach pool listeners to every engine of the app"""
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    pgbouncer = env_flag('DB_PGBOUNCER')
+
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    for engine in engines:
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            _record(connects=1)
+
+        if pgbouncer and statement_timeout and engine.dialect.name == 'postgresql':
+            # Transaction pooling hands out a different server connection per
+            # transaction, so the timeout is scoped to each transaction
+            @event.listens_for(engine, 'begin')
+            def on_begin(connection):
+                connection.exec_driver_sql(f'SET LOCAL statement_timeout = {statement_timeout}')
+
+        @event.listens_for(engine, 'checkout')
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            _record(checkouts=1)
+
+        @event.listens_for(engine, 'invalidate')
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            _record(invalidated=1)
+
+    if 'read' in app.config.get('SQLALCHEMY_BINDS', {}):
+        @app.after_request
+        def stick_to_primary_after_write(response):
+            if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+                response.set_cookie(PRIMARY_COOKIE, str(time.time() + READ_YOUR_WRITES_SECONDS),
+                                    max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax',
+                                    secure=app.config.get('SESSION_COOKIE_SECURE', False))
+            return response
+
+
+def pool_stats(db):
+    """Connection pool counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['wait_seconds'] = round(stats['wait_seconds'], 4)
+    stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 4)
+
+    stats['engines'] = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        info = {'pool': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            info.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow()
+            })
+        stats['engines'][key or 'default'] = info
+    return stats
@@ -0,0 +1,186 @@
+import os
+import tempfile
+import zipfile
+from laps import parse_time, unpack_laps
+from models import db, Racer, Race, RaceResult, Location, RacerBestLap, LocationFastestLap, LocationRecord
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Columnar snapshot of the racing data for offline analysis: one Parquet (or
+# Arrow IPC) file per table inside a zip. Each table is read from a
+# server-side cursor EXPORT_BATCH_SIZE rows at a time and written as one
+# record batch, so memory stays flat however large the history grows.
+# Lap times are durations, dates are dates.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+FORMATS = ('parquet', 'arrow')
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def seconds_ms(value):
+    return None if value is None else int(round(value * 1000))
+
+
+def tables():
+    """(file name, query, [(column, arrow type, converter or None)], row expander or None) of every exported table"""
+    duration = pa.duration('ms')
+    return [
+        ('racers', db.select(Racer.id, Racer.name, Racer.age, Racer.experience_years, Racer.total_races,
+                             Racer.wins, Racer.podium_finishes, Racer.created_at).order_by(Racer.id), [
+            ('id', pa.int32(), None),
+            ('name', pa.string(), None),
+            ('age', pa.int32(), None),
+            ('experience_years', pa.int32(), None),
+            ('total_races', pa.int32(), None),
+            ('wins', pa.int32(), None),
+            ('podium_finishes', pa.int32(), None),
+            ('created_at', pa.timestamp('us'), None)
+        ], None),
+        ('locations', db.select(Location.id, Location.name, Location.city, Location.neighborhood,
+                                Location.rental_duration, Location.price_per_person, Location.min_participants,
+                                Location.max_participants).order_by(Location.id), [
+            ('id', pa.int32(), None),
+            ('name', pa.string(), None),
+            ('city', pa.string(), None),
+            ('neighborhood', pa.string(), None),
+            ('rental_duration', pa.string(), None),
+            ('price_per_person', pa.decimal128(10, 2), None),
+            ('min_participants', pa.int32(), None),
+            ('max_participants', pa.int32(), None)
+        ], None),
+        ('races', db.select(Race.id, Race.race_name, Race.date, Race.location_id, Race.championship_id,
+                            Race.track_name, Race.weather, Race.condition, Race.total_laps,
+                            Race.winner_id).order_by(Race.id), [
+            ('id', pa.int32(), None),
+            ('race_name', pa.string(), None),
+            ('date', pa.date32(), None),
+            ('location_id', pa.int32(), None),
+            ('championship_id', pa.int32(), None),
+            ('track_name', pa.string(), None),
+            ('weather', pa.string(), None),
+            ('condition', pa.dictionary(pa.int8(), pa.string()), None),
+            ('total_laps', pa.int32(), None),
+            ('winner_id', pa.int32(), None)
+        ], None),
+        ('results', db.select(RaceResult.id, RaceResult.race_id, RaceResult.racer_id, RaceResult.position,
+                              RaceResult.lap_time_best, RaceResult.lap_time_average, RaceResult.total_time,
+                              RaceResult.laps, RaceResult.points_earned, RaceResult.dnf,
+                              RaceResult.excluded).order_by(RaceResult.id), [
+            ('id', pa.int32(), None),
+            ('race_id', pa.int32(), None),
+            ('racer_id', pa.int32(), None),
+            ('position', pa.int32(), None),
+            ('lap_time_best', duration, parse_time),
+            ('lap_time_average', duration, parse_time),
+            ('total_time', duration, parse_time),
+            ('laps', pa.int32(), None),
+            ('points_earned', pa.int32(), None),
+            ('dnf', pa.bool_(), None),
+            ('excluded', pa.bool_(), None)
+        ], None),
+        ('laps', db.select(RaceResult.id, RaceResult.race_id, RaceResult.racer_id, RaceResult.lap_data)
+            .where(RaceResult.lap_data.isnot(None)).order_by(RaceResult.id), [
+            ('result_id', pa.int32(), None),
+            ('race_id', pa.int32(), None),
+            ('racer_id', pa.int32(), None),
+            ('lap', pa.int32(), None),
+            ('time', duration, None),
+            ('sectors', pa.list_(duration), None)
+        ], lap_rows),
+        ('racer_best_laps', db.select(RacerBestLap.racer_id, RacerBestLap.location_id, RacerBestLap.condition,
+                                      RacerBestLap.best_lap_seconds, RacerBestLap.updated_at)
+            .order_by(RacerBestLap.id), [
+            ('racer_id', pa.int32(), None),
+            ('location_id', pa.int32(), None),
+            ('condition', pa.dictionary(pa.int8(), pa.string()), None),
+            ('best_lap', duration, seconds_ms),
+            ('updated_at', pa.timestamp('us'), None)
+        ], None),
+        ('location_fastest_laps', db.select(LocationFastestLap.location_id, LocationFastestLap.condition,
+                                            LocationFastestLap.racer_id, LocationFastestLap.best_lap_seconds,
+                                            LocationFastestLap.updated_at).order_by(LocationFastestLap.id), [
+            ('location_id', pa.int32(), None),
+            ('condition', pa.dictionary(pa.int8(), pa.string()), None),
+            ('racer_id', pa.int32(), None),
+            ('best_lap', duration, seconds_ms),
+            ('updated_at', pa.timestamp('us'), None)
+        ], None),
+        ('location_records', db.select(LocationRecord.location_id, LocationRecord.condition,
+                                       LocationRecord.racer_id, LocationRecord.race_id, LocationRecord.set_on,
+                                       LocationRecord.best_lap_seconds, LocationRecord.previous_seconds,
+                                       LocationRecord.improvement_seconds)
+            .order_by(LocationRecord.location_id, LocationRecord.condition, LocationRecord.set_on,
+                      LocationRecord.id), [
+            ('location_id', pa.int32(), None),
+            ('condition', pa.dictionary(pa.int8(), pa.string()), None),
+            ('racer_id', pa.int32(), None),
+            ('race_id', pa.int32(), None),
+            ('set_on', pa.date32(), None),
+            ('best_lap', duration, seconds_ms),
+            ('previous_best_lap', duration, seconds_ms),
+            ('improvement', duration, seconds_ms)
+        ], None)
+    ]
+
+
+def lap_rows(rows):
+    """One row per lap of each result's packed lap chart"""
+    for result_id, race_id, racer_id, data in rows:
+        for lap in unpack_laps(data):
+            yield result_id, race_id, racer_id, lap['lap'], lap['time_ms'], lap['sectors_ms']
+
+
+def batches(query, schema, converters, expand=None):
+    """Record batches of a table, one per chunk of the server-side cursor"""
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for rows in result.partitions():
+        if expand is not None:
+            rows = list(expand(rows))
+        columns = [list(column) for column in zip(*rows)] or [[] for _ in schema]
+        for index, convert in enumerate(converters):
+            if convert is not None:
+                columns[index] = [convert(value) for value in columns[index]]
+        yield pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                              schema=schema)
+
+
+def write_table(sink, export_format, schema, record_batches):
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    try:
+        for batch in record_batches:
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+
+
+def write_dataset(export_format='parquet'):
+    """Temporary file holding the zip of every table; the caller closes (and so deletes) it"""
+    if pa is None:
+        raise ExportUnavailable('Exportacao precisa do pacote pyarrow (pip install pyarrow)')
+    if export_format not in FORMATS:
+        raise ValueError(f'formato invalido: use {" ou ".join(FORMATS)}')
+
+    # Parquet pages are already compressed; Arrow IPC files are not
+    compression = zipfile.ZIP_STORED if export_format == 'parquet' else zipfile.ZIP_DEFLATED
+    output = tempfile.TemporaryFile()
+    try:
+        with zipfile.ZipFile(output, 'w', compression=compression) as archive:
+            for name, query, columns, expand in tables():
+                schema = pa.schema([pa.field(column, column_type) for column, column_type, _ in columns])
+                converters = [convert for _, _, convert in columns]
+                with archive.open(f'{name}.{export_format}', 'w') as sink:
+                    write_table(sink, export_format, schema, batches(query, schema, converters, expand))
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
@@ -0,0 +1,62 @@
+import math
+from flask import request, jsonify
+from sqlalchemy import func, or_
+from models import db
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+MAX_OPTIONS = 100
+
+
+def contains(columns, text):
+    """Case-insensitive substring match on any of `columns`"""
+    pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return or_(*(column.ilike(pattern, escape='\\') for column in columns))
+
+
+def grid_response(query, sorts, default_sort, serialize, then=()):
+    """One page of `query` as JSON, for the admin grids.
+
+    ?sort picks a key of `sorts` (unknown keys fall back to `default_sort`,
+    a (key, order) pair), ?order is asc or desc, ?page and ?per_page select
+    the page. `then` are extra ORDER BY columns that keep pages stable.
+    """
+    sort = request.args.get('sort')
+    if sort in sorts:
+        order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    else:
+        sort, order = default_sort
+    column = sorts[sort]
+    ordering = (column.desc() if order == 'desc' else column.asc()).nulls_last()
+
+    per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    total = db.session.execute(db.select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+    pages = max(math.ceil(total / per_page), 1)
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+
+    rows = db.session.execute(
+        query.order_by(ordering, *then).limit(per_page).offset((page - 1) * per_page)
+    )
+    return jsonify({
+        'items': [serialize(row) for row in rows],
+        'total': total,
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'sort': sort,
+        'order': order,
+    })
+
+
+def options_response(query, id_column, columns, serialize):
+    """Dropdown options: ?q searches `columns`, ?limit caps the list, ?id fetches one option"""
+    option_id = request.args.get('id', type=int)
+    if option_id is not None:
+        query = query.where(id_column == option_id)
+    q = request.args.get('q', '').strip()
+    if q:
+        query = query.where(contains(columns, q))
+    limit = request.args.get('limit', type=int)
+    if limit:
+        query = query.limit(min(max(limit, 1), MAX_OPTIONS))
+    return jsonify([serialize(row) for row in db.session.execute(query)])
@@ -0,0 +1,30 @@
+import os
+
+# Live race streams (/api/races/<id>/live) stay open for as long as the page
+# does, so a worker must serve many connections at once. gevent (the default)
+# gives each request a greenlet, up to worker_connections per worker; password
+# hashing still runs on real OS threads (see passwords.py). gthread gives each
+# request one of `threads` threads, and every open stream holds one.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5003')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# Under gthread, leave threads for pages and APIs however many viewers connect
+LIVE_THREAD_HEADROOM = 8
+if worker_class == 'gthread':
+    os.environ.setdefault('LIVE_MAX_SUBSCRIBERS', str(max(threads - LIVE_THREAD_HEADROOM, 1)))
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # Let psycopg2 yield to other greenlets while waiting on PostgreSQL
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen is not installed; database calls will block the gevent worker')
+        else:
+            patch_psycopg()
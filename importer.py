@@ -0,0 +1,456 @@
+import codecs
+import csv
+import datetime
+import difflib
+import itertools
+import os
+import re
+import unicodedata
+from sqlalchemy import insert, update
+from laps import parse_time, format_time, parse_laps, lap_fields
+from models import db, Racer, RaceResult
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+MAX_ROWS = 500
+HEADER_SCAN_ROWS = 20
+MATCH_CUTOFF = 0.6   # candidates listed in the preview
+AUTO_MATCH = 0.85    # best candidate accepted without review
+AUTO_MATCH_MARGIN = 0.05
+
+# Header names recognised for each result field, after normalize(). A location's
+# import_mapping overrides them: {"columns": {"name": "Piloto", ...},
+# "lap_prefix": "Volta", "delimiter": ";", "encoding": "cp1252", "sheet": "Resultado"}
+FIELDS = {
+    'name': ('piloto', 'nome', 'driver', 'name', 'competidor'),
+    'position': ('pos', 'posicao', 'position', 'colocacao', 'p'),
+    'lap_time_best': ('melhor volta', 'best lap', 'melhor', 'best', 'mv'),
+    'lap_time_average': ('volta media', 'media', 'average lap', 'average', 'avg'),
+    'total_time': ('tempo total', 'total time', 'total', 'tempo'),
+    'laps': ('voltas', 'laps', 'no voltas', 'n voltas', 'total voltas'),
+    'points_earned': ('pontos', 'points', 'pts'),
+    'dnf': ('dnf', 'abandono', 'status'),
+}
+TIME_FIELDS = ('lap_time_best', 'lap_time_average', 'total_time')
+INT_FIELDS = ('position', 'laps', 'points_earned')
+RESULT_FIELDS = INT_FIELDS + TIME_FIELDS + ('dnf',)
+LAP_COLUMN = re.compile(r'^(?:volta|lap|v|l) ?(\d+)$')
+DNF_VALUES = {'1', 'x', 'sim', 's', 'yes', 'y', 'true', 'dnf', 'abandono', 'nc', 'dq', 'dsq'}
+MAPPING_KEYS = {'columns', 'lap_prefix', 'delimiter', 'encoding', 'sheet'}
+
+
+class ImportRejected(ValueError):
+    """The export can't be imported; the message is shown to the admin"""
+
+
+def normalize(text):
+    """Lowercase, accents removed, anything but letters and digits collapsed to single spaces"""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def validate_mapping(mapping):
+    """A location's import mapping, checked; raises ImportRejected"""
+    if not mapping:
+        return {}
+    if not isinstance(mapping, dict) or set(mapping) - MAPPING_KEYS:
+        raise ImportRejected(f'Mapeamento invalido: chaves permitidas {", ".join(sorted(MAPPING_KEYS))}')
+    columns = mapping.get('columns') or {}
+    if not isinstance(columns, dict) or set(columns) - set(FIELDS) \
+            or not all(isinstance(name, str) and name.strip() for name in columns.values()):
+        raise ImportRejected(f'Mapeamento invalido: colunas permitidas {", ".join(FIELDS)}')
+    for key in ('lap_prefix', 'delimiter', 'encoding', 'sheet'):
+        if mapping.get(key) is not None and not isinstance(mapping[key], str):
+            raise ImportRejected(f'Mapeamento invalido: {key} deve ser texto')
+    if mapping.get('delimiter') and len(mapping['delimiter']) != 1:
+        raise ImportRejected('Mapeamento invalido: delimiter deve ter um caractere')
+    if mapping.get('encoding'):
+        try:
+            codecs.lookup(mapping['encoding'])
+        except LookupError:
+            raise ImportRejected(f'Mapeamento invalido: encoding {mapping["encoding"]} desconhecido')
+    return mapping
+
+
+# ============== READING ==============
+
+def _decoded_lines(stream, encoding):
+    # Exports come as UTF-8 or Windows-1252; without an encoding each line tries both
+    for number, raw in enumerate(stream):
+        if number == 0:
+            raw = raw.removeprefix(codecs.BOM_UTF8)
+        if encoding:
+            yield raw.decode(encoding, errors='replace')
+            continue
+        try:
+            yield raw.decode('utf-8')
+        except UnicodeDecodeError:
+            yield raw.decode('cp1252', errors='replace')
+
+
+def csv_rows(stream, mapping):
+    lines = _decoded_lines(stream, mapping.get('encoding'))
+    delimiter = mapping.get('delimiter')
+    if not delimiter:
+        head = list(itertools.islice(lines, HEADER_SCAN_ROWS))
+        counts = {d: sum(line.count(d) for line in head) for d in (';', ',', '\t', '|')}
+        delimiter = max(counts, key=counts.get)
+        lines = itertools.chain(head, lines)
+    return csv.reader(lines, delimiter=delimiter)
+
+
+def xlsx_rows(stream, mapping):
+    if openpyxl is None:
+        raise ImportRejected('Arquivos XLSX precisam do pacote openpyxl; exporte a planilha como CSV')
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except Exception:
+        raise ImportRejected('Arquivo XLSX invalido')
+    try:
+        if mapping.get('sheet'):
+            if mapping['sheet'] not in workbook.sheetnames:
+                raise ImportRejected(f'Aba "{mapping["sheet"]}" nao encontrada')
+            sheet = workbook[mapping['sheet']]
+        else:
+            sheet = workbook.worksheets[0]
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return ' '.join(str(value).split())
+
+
+def cell_time(value):
+    """Milliseconds from a text, seconds or spreadsheet time cell"""
+    if isinstance(value, datetime.datetime):
+        value = value.time()
+    if isinstance(value, datetime.time):
+        return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000 + value.microsecond // 1000
+    if isinstance(value, datetime.timedelta):
+        return int(round(value.total_seconds() * 1000))
+    return parse_time(value)
+
+
+def cell_int(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    match = re.search(r'\d+', cell_text(value))
+    return int(match.group()) if match else None
+
+
+def resolve_columns(header, mapping):
+    """Column index of each field found in the header row, and the lap columns in lap order"""
+    configured = {field: normalize(name) for field, name in (mapping.get('columns') or {}).items()}
+    columns = {}
+    for field, aliases in FIELDS.items():
+        for name in ((configured[field],) if field in configured else aliases):
+            index = next((i for i, cell in enumerate(header) if cell == name and i not in columns.values()), None)
+            if index is not None:
+                columns[field] = index
+                break
+        else:
+            if field in configured:
+                raise ImportRejected(f'Coluna "{mapping["columns"][field]}" nao encontrada no arquivo')
+
+    prefix = normalize(mapping.get('lap_prefix'))
+    pattern = re.compile(rf'^{re.escape(prefix)} ?(\d+)$') if prefix else LAP_COLUMN
+    lap_columns = []
+    for index, cell in enumerate(header):
+        match = pattern.match(cell)
+        if match and index not in columns.values():
+            lap_columns.append((int(match.group(1)), index))
+    return columns, [index for _, index in sorted(lap_columns)]
+
+
+def read_export(stream, filename, mapping):
+    """Parse a venue timing export (CSV or XLSX) row by row.
+
+    The header is the first row, among the first HEADER_SCAN_ROWS, that has
+    the driver name column; title rows above it are skipped. Returns the
+    detected columns and up to MAX_ROWS parsed rows.
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        rows = xlsx_rows(stream, mapping)
+    elif extension in ('.csv', '.txt', ''):
+        rows = csv_rows(stream, mapping)
+    else:
+        raise ImportRejected('Formato nao suportado: envie CSV ou XLSX')
+
+    name_headers = {normalize(mapping['columns']['name'])} if mapping.get('columns', {}).get('name') \
+        else set(FIELDS['name'])
+    header = None
+    for number, row in enumerate(rows, start=1):
+        cells = [normalize(cell_text(value)) for value in row]
+        if name_headers & set(cells):
+            header, header_row = cells, number
+            break
+        if number >= HEADER_SCAN_ROWS:
+            break
+    if header is None:
+        raise ImportRejected('Cabecalho nao encontrado: nenhuma coluna de piloto '
+                             f'({", ".join(sorted(name_headers))}) nas primeiras {HEADER_SCAN_ROWS} linhas')
+
+    columns, lap_columns = resolve_columns(header, mapping)
+    parsed = []
+    for number, row in enumerate(rows, start=header_row + 1):
+        row = list(row)
+        value = lambda index: row[index] if index < len(row) else None
+        name = cell_text(value(columns['name']))
+        if not name:
+            continue
+        if len(parsed) >= MAX_ROWS:
+            raise ImportRejected(f'Arquivo com mais de {MAX_ROWS} resultados')
+        parsed.append(parse_row(number, name, columns, lap_columns, value))
+
+    return {
+        'columns': {field: header[index] for field, index in columns.items()},
+        'lap_columns': len(lap_columns),
+        'rows': parsed
+    }
+
+
+def parse_row(number, name, columns, lap_columns, value):
+    fields = {}
+    errors = []
+    for field, index in columns.items():
+        raw = value(index)
+        if field == 'name' or cell_text(raw) == '':
+            continue
+        if field in TIME_FIELDS:
+            ms = cell_time(raw)
+            if ms is None:
+                errors.append(f'{field}: tempo invalido "{cell_text(raw)}"')
+            else:
+                fields[field] = format_time(ms)
+        elif field == 'dnf':
+            fields['dnf'] = normalize(cell_text(raw)) in DNF_VALUES
+        else:
+            number_value = cell_int(raw)
+            if field == 'position' and number_value is None and normalize(cell_text(raw)) in DNF_VALUES:
+                fields['dnf'] = True
+            elif number_value is None:
+                errors.append(f'{field}: numero invalido "{cell_text(raw)}"')
+            else:
+                fields[field] = number_value
+
+    chart = []
+    for index in lap_columns:
+        raw = value(index)
+        if cell_text(raw) == '':
+            continue
+        ms = cell_time(raw)
+        if ms is None:
+            errors.append(f'volta invalida "{cell_text(raw)}"')
+        else:
+            chart.append(format_time(ms))
+    if chart and not errors:
+        fields.update({k: v for k, v in lap_fields(parse_laps(chart)).items() if k != 'lap_data'})
+
+    return {'row': number, 'name': name, 'fields': fields, 'lap_chart': chart, 'errors': errors}
+
+
+# ============== MATCHING ==============
+
+class NameIndex:
+    """Racer names held in memory for exact, word-order and fuzzy lookup"""
+
+    def __init__(self, racers):
+        self.names = {}
+        self.tokens = {}
+        for racer_id, name in racers:
+            key = normalize(name)
+            self.names.setdefault(key, (racer_id, name))
+            self.tokens.setdefault(' '.join(sorted(key.split())), (racer_id, name))
+
+    @classmethod
+    def load(cls):
+        return cls(db.session.execute(db.select(Racer.id, Racer.name).order_by(Racer.id)))
+
+    def match(self, name):
+        """(accepted match or None, best candidates), each {'racer_id', 'name', 'score'}"""
+        key = normalize(name)
+        for table, lookup in ((self.names, key), (self.tokens, ' '.join(sorted(key.split())))):
+            if lookup in table:
+                racer_id, racer_name = table[lookup]
+                found = {'racer_id': racer_id, 'name': racer_name, 'score': 1.0}
+                return found, [found]
+
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(key)
+        scored = []
+        for candidate, (racer_id, racer_name) in self.names.items():
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= MATCH_CUTOFF and matcher.quick_ratio() >= MATCH_CUTOFF:
+                score = matcher.ratio()
+                if score >= MATCH_CUTOFF:
+                    scored.append({'racer_id': racer_id, 'name': racer_name, 'score': round(score, 3)})
+        scored.sort(key=lambda item: -item['score'])
+        candidates = scored[:3]
+
+        accepted = None
+        if candidates and candidates[0]['score'] >= AUTO_MATCH and (
+                len(candidates) == 1 or candidates[0]['score'] - candidates[1]['score'] >= AUTO_MATCH_MARGIN):
+            accepted = candidates[0]
+        return accepted, candidates
+
+
+def same_value(field, current, new):
+    if field in TIME_FIELDS:
+        return parse_time(current) == parse_time(new)
+    return current == new
+
+
+def preview(race_id, rows):
+    """Rows matched to racers and compared with the race's current results.
+
+    Status is 'new', 'update', 'unchanged', 'unmatched' (no racer chosen) or
+    'error' (unparseable values, or a racer appearing twice).
+    """
+    index = NameIndex.load()
+    existing = {
+        row.racer_id: row._asdict()
+        for row in db.session.execute(
+            db.select(RaceResult.racer_id, *(getattr(RaceResult, f) for f in RESULT_FIELDS))
+            .where(RaceResult.race_id == race_id)
+        )
+    }
+
+    items = []
+    seen = {}
+    for row in rows:
+        match, candidates = index.match(row['name'])
+        item = dict(row, match=match, candidates=candidates, changes={})
+        current = existing.get(match['racer_id']) if match else None
+        if row['errors']:
+            item['status'] = 'error'
+        elif match is None:
+            item['status'] = 'unmatched'
+        elif match['racer_id'] in seen:
+            item['status'] = 'error'
+            item['errors'] = [f'piloto repetido (linha {seen[match["racer_id"]]})']
+        elif current is None:
+            item['status'] = 'new'
+        else:
+            item['changes'] = {
+                field: [current[field], value]
+                for field, value in row['fields'].items() if not same_value(field, current[field], value)
+            }
+            item['status'] = 'update' if item['changes'] or row['lap_chart'] else 'unchanged'
+        if match:
+            seen.setdefault(match['racer_id'], row['row'])
+        items.append(item)
+
+    imported = {item['match']['racer_id'] for item in items if item['match']}
+    return {
+        'rows': items,
+        'kept': len(set(existing) - imported),
+        'summary': {status: sum(1 for item in items if item['status'] == status)
+                    for status in ('new', 'update', 'unchanged', 'unmatched', 'error')}
+    }
+
+
+# ============== COMMIT ==============
+
+def result_values(row):
+    """RaceResult columns from a reviewed preview row; raises ImportRejected"""
+    fields = row.get('fields') or {}
+    values = {}
+    for field in RESULT_FIELDS:
+        if field not in fields:
+            continue
+        value = fields[field]
+        if field in INT_FIELDS:
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                raise ImportRejected(f'Linha {row.get("row")}: {field} invalido')
+        elif field == 'dnf':
+            value = bool(value)
+        elif value is not None:
+            ms = parse_time(value)
+            if ms is None:
+                raise ImportRejected(f'Linha {row.get("row")}: {field} invalido')
+            value = format_time(ms)
+        values[field] = value
+
+    if row.get('lap_chart'):
+        try:
+            values.update(lap_fields(parse_laps(row['lap_chart'])))
+        except ValueError as e:
+            raise ImportRejected(f'Linha {row.get("row")}: {e}')
+    return values
+
+
+def commit(race_id, rows, create_missing=True):
+    """Write reviewed preview rows into a race in one bulk statement per kind.
+
+    Rows carry a `racer_id`, or only a `name` for racers to create (skipped
+    unless `create_missing`). Existing results of the same racer are updated.
+    The caller commits; stats are left to recalculate once for the import.
+    """
+    new_names = {}
+    for row in rows:
+        if not row.get('racer_id'):
+            name = ' '.join(str(row.get('name') or '').split())
+            if not name:
+                raise ImportRejected(f'Linha {row.get("row")}: piloto sem nome')
+            new_names.setdefault(normalize(name), name)
+
+    created_ids = {}
+    if new_names and create_missing:
+        now = datetime.datetime.utcnow()
+        created = db.session.execute(
+            insert(Racer).returning(Racer.id, Racer.name, sort_by_parameter_order=True),
+            [{'name': name, 'created_at': now, 'updated_at': now} for name in new_names.values()]
+        )
+        created_ids = {normalize(name): racer_id for racer_id, name in created}
+
+    requested = {row['racer_id'] for row in rows if row.get('racer_id')}
+    if any(not isinstance(racer_id, int) for racer_id in requested):
+        raise ImportRejected('racer_id invalido')
+    known = set(db.session.scalars(db.select(Racer.id).where(Racer.id.in_(requested)))) if requested else set()
+    if requested - known:
+        raise ImportRejected(f'Pilotos nao encontrados: {", ".join(map(str, sorted(requested - known)))}')
+
+    existing = dict(db.session.execute(
+        db.select(RaceResult.racer_id, RaceResult.id).where(RaceResult.race_id == race_id)
+    ).all())
+
+    now = datetime.datetime.utcnow()
+    inserts, updates, skipped = [], [], []
+    seen = set()
+    for row in rows:
+        racer_id = row.get('racer_id') or created_ids.get(normalize(' '.join(str(row.get('name')).split())))
+        if racer_id is None:
+            skipped.append(row.get('name'))
+            continue
+        if racer_id in seen:
+            raise ImportRejected(f'Linha {row.get("row")}: piloto repetido')
+        seen.add(racer_id)
+
+        values = result_values(row)
+        values['updated_at'] = now
+        if racer_id in existing:
+            updates.append(dict(values, id=existing[racer_id]))
+        else:
+            inserts.append(dict(values, race_id=race_id, racer_id=racer_id, created_at=now))
+
+    if inserts:
+        db.session.execute(insert(RaceResult), inserts)
+    if updates:
+        db.session.execute(update(RaceResult), updates)
+    return {
+        'created': len(inserts),
+        'updated': len(updates),
+        'racers_created': len(created_ids),
+        'skipped': skipped
+    }
@@ -0,0 +1,287 @@
+import cProfile
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from flask import g, request, abort, current_app, Response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from database import env_flag
+
+# Opt-in (METRICS_ENABLED=1) per-endpoint request metrics served at /metrics.
+# Counters live in each process: with several gunicorn workers a scrape
+# reports the worker that answered it
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+
+# cProfile dumps (PROFILING_ENABLED=1, independent of METRICS_ENABLED): admins
+# add ?_profile=1 to any URL, and PROFILE_SAMPLE_RATE profiles that fraction of
+# all requests. Only the newest PROFILE_MAX_FILES dumps are kept
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/nerds-profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_LOG_STATEMENTS = 3
+
+
+class Metrics:
+    """Per-endpoint aggregates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, sample):
+        with self._lock:
+            data = self.endpoints.setdefault(endpoint, {
+                'requests': {},
+                'buckets': [0] * len(DURATION_BUCKETS),
+                'duration': 0.0,
+                'db_queries': 0,
+                'db_seconds': 0.0,
+                'db_rows': 0,
+                'serialization_seconds': 0.0,
+                'response_bytes': 0
+            })
+            data['requests'][status] = data['requests'].get(status, 0) + 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if sample['duration'] <= bound:
+                    data['buckets'][i] += 1
+            data['duration'] += sample['duration']
+            data['db_queries'] += sample['db_queries']
+            data['db_seconds'] += sample['db_seconds']
+            data['db_rows'] += sample['db_rows']
+            data['serialization_seconds'] += sample['serialization_seconds']
+            data['response_bytes'] += sample['response_bytes']
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.endpoints))
+
+
+metrics = Metrics()
+
+
+def _sample():
+    return g.get('_metrics') if g else None
+
+
+# ============== SQLALCHEMY HOOKS ==============
+
+# The start time lives on the execution context, so a statement that fails
+# (and never reaches after_cursor_execute) leaves nothing behind on the
+# pooled connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start', None)
+    sample = _sample()
+    if sample is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    sample['db_queries'] += 1
+    sample['db_seconds'] += elapsed
+    # psycopg2 reports the rows a SELECT returned; SQLite always reports -1
+    if cursor.description is not None and cursor.rowcount > 0:
+        sample['db_rows'] += cursor.rowcount
+    sample['statements'].append((elapsed, statement))
+
+
+# ============== FLASK HOOKS ==============
+
+def _wants_profile():
+    if request.endpoint in (None, 'static'):
+        return False
+    if request.args.get('_profile') == '1':
+        return current_user.is_authenticated and current_user.is_admin
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _before_request():
+    g._metrics = {
+        'started': time.perf_counter(),
+        'db_queries': 0,
+        'db_seconds': 0.0,
+        'db_rows': 0,
+        'serialization_seconds': 0.0,
+        'statements': []
+    }
+
+
+def _start_profile():
+    if _wants_profile():
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+
+def _dump_profile(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{request.endpoint.replace('.', '_')}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        prune_profiles()
+    return response
+
+
+def _after_request(response):
+    sample = _sample()
+    if sample is None or request.endpoint in (None, 'static', 'metrics_endpoint'):
+        return response
+
+    sample['duration'] = time.perf_counter() - sample['started']
+    sample['response_bytes'] = 0 if response.is_streamed else (response.content_length or 0)
+    metrics.record(request.endpoint, response.status_code, sample)
+
+    if sample['duration'] * 1000 >= SLOW_REQUEST_MS:
+        slowest = sorted(sample['statements'], key=lambda s: s[0], reverse=True)[:SLOW_LOG_STATEMENTS]
+        current_app.logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(sample['duration'] * 1000, 1),
+            'db_queries': sample['db_queries'],
+            'db_ms': round(sample['db_seconds'] * 1000, 1),
+            'db_rows': sample['db_rows'],
+            'serialization_ms': round(sample['serialization_seconds'] * 1000, 1),
+            'response_bytes': sample['response_bytes'],
+            'slowest_sql': [
+                {'ms': round(elapsed * 1000, 1), 'sql': ' '.join(statement.split())[:500]}
+                for elapsed, statement in slowest
+            ]
+        }))
+    return response
+
+
+def _timed_dumps(dumps):
+    def wrapper(obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return dumps(obj, **kwargs)
+        finally:
+            sample = _sample()
+            if sample is not None:
+                sample['serialization_seconds'] += time.perf_counter() - started
+    return wrapper
+
+
+# ============== PROMETHEUS ==============
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_metrics(db):
+    """Request, pool and password hashing counters in Prometheus text format"""
+    from database import pool_stats
+    from passwords import hash_stats
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_str = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+
+    endpoints = metrics.snapshot()
+
+    metric('nerds_requests_total', 'counter', 'Requests by endpoint and status',
+           [({'endpoint': e, 'status': s}, n) for e, d in endpoints.items() for s, n in d['requests'].items()])
+
+    lines.append('# HELP nerds_request_duration_seconds Request wall time')
+    lines.append('# TYPE nerds_request_duration_seconds histogram')
+    for endpoint, data in endpoints.items():
+        label = _label(endpoint)
+        for bound, count in zip(DURATION_BUCKETS, data['buckets']):
+            lines.append(f'nerds_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {count}')
+        total = sum(data['requests'].values())
+        lines.append(f'nerds_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {total}')
+        lines.append(f'nerds_request_duration_seconds_sum{{endpoint="{label}"}} {data["duration"]:.6f}')
+        lines.append(f'nerds_request_duration_seconds_count{{endpoint="{label}"}} {total}')
+
+    for key, name, help_text in (
+        ('db_queries', 'nerds_request_db_queries_total', 'SQL statements executed'),
+        ('db_seconds', 'nerds_request_db_seconds_total', 'Time spent in SQL statements'),
+        ('db_rows', 'nerds_request_db_rows_total', 'Rows fetched (where the driver reports them)'),
+        ('serialization_seconds', 'nerds_request_serialization_seconds_total', 'Time spent serializing JSON'),
+        ('response_bytes', 'nerds_response_bytes_total', 'Response body bytes'),
+    ):
+        metric(name, 'counter', help_text, [({'endpoint': e}, d[key]) for e, d in endpoints.items()])
+
+    pool = pool_stats(db)
+    metric('nerds_db_pool_checkouts_total', 'counter', 'Connection checkouts', [({}, pool['checkouts'])])
+    metric('nerds_db_pool_connects_total', 'counter', 'New database connections', [({}, pool['connects'])])
+    metric('nerds_db_pool_invalidated_total', 'counter', 'Connections invalidated (stale or broken)', [({}, pool['invalidated'])])
+    metric('nerds_db_pool_timeouts_total', 'counter', 'Checkouts that timed out', [({}, pool['timeouts'])])
+    metric('nerds_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection', [({}, pool['wait_seconds'])])
+    for key, help_text in (('checked_out', 'Connections in use'), ('checked_in', 'Idle connections'),
+                           ('overflow', 'Overflow connections')):
+        metric(f'nerds_db_pool_{key}', 'gauge', help_text,
+               [({'bind': bind}, info[key]) for bind, info in pool['engines'].items() if key in info])
+
+    hashes = hash_stats()
+    metric('nerds_password_hashes_total', 'counter', 'Password hashes and checks', [({}, hashes['count'])])
+    metric('nerds_password_hash_seconds_total', 'counter', 'CPU time in password hashing', [({}, hashes['seconds'])])
+    metric('nerds_password_hash_rejected_total', 'counter', 'Hash requests refused, pool busy', [({}, hashes['rejected'])])
+
+    return '\n'.join(lines) + '\n'
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof')), reverse=True)
+
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_MAX_FILES dumps"""
+    for name in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            # Another worker pruned it first
+            pass
+
+
+def profile_path(name):
+    if not re.fullmatch(r'[\w.-]+\.prof', name) or name not in list_profiles():
+        return None
+    return os.path.abspath(os.path.join(PROFILE_DIR, name))
+
+
+def init_app(app, db):
+    """Hook profiling and metrics (engine events, request hooks, JSON serialization), each when enabled"""
+    if env_flag('PROFILING_ENABLED'):
+        app.before_request(_start_profile)
+        app.after_request(_dump_profile)
+    if not env_flag('METRICS_ENABLED'):
+        return
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.json.dumps = _timed_dumps(app.json.dumps)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # Without METRICS_TOKEN only logged-in admins may read the metrics
+        token = os.environ.get('METRICS_TOKEN')
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                abort(401)
+        elif not (current_user.is_authenticated and current_user.is_admin):
+            abort(401)
+        return Response(render_metrics(db), mimetype='text/plain; version=0.0.4')
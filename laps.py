@@ -0,0 +1,153 @@
+import re
+import struct
+
+# Lap charts are packed into RaceResult.lap_data (bytea on PostgreSQL, BLOB on
+# SQLite) instead of one row per lap:
+#   header  version (uint8), lap count (uint16), sectors per lap (uint8)
+#   laps    lap number (uint16), lap time in ms (uint32), sector times in ms (uint32 each)
+# Sectors a lap is missing are stored as NO_TIME.
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BHB')
+NO_TIME = 0xFFFFFFFF
+MAX_LAPS = 0xFFFF
+MAX_SECTORS = 16
+
+_TIME = re.compile(r'^(?:(?:(\d+):)?(\d+):)?(\d+(?:[.,]\d+)?)$')
+
+
+def parse_time(value):
+    """Milliseconds from 62.345, '62.345', '1:02.345' or '1:02:03.456'; None when blank or invalid"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value * 1000)) if value >= 0 else None
+    match = _TIME.match(str(value).strip())
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(round((int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds.replace(',', '.'))) * 1000))
+
+
+def format_time(ms):
+    """'0:58.123', '1:02.345' or '1:02:03.456', the m:ss.fff of the stored lap times"""
+    if ms is None:
+        return None
+    minutes, millis = divmod(int(round(ms)), 60000)
+    hours, minutes = divmod(minutes, 60)
+    seconds = f'{millis / 1000:06.3f}'
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds}'
+    return f'{minutes}:{seconds}'
+
+
+def parse_laps(items):
+    """Laps from request data, numbered from 1 unless given.
+
+    Each item is a lap time (seconds or 'M:SS.mmm') or an object with
+    `time` and optional `lap` and `sectors`. Raises ValueError when invalid.
+    """
+    if not isinstance(items, list):
+        raise ValueError('laps deve ser uma lista')
+    if len(items) > MAX_LAPS:
+        raise ValueError(f'no maximo {MAX_LAPS} voltas')
+
+    laps = []
+    for index, item in enumerate(items, start=1):
+        if isinstance(item, dict):
+            number, time, sectors = item.get('lap', index), item.get('time'), item.get('sectors') or []
+        else:
+            number, time, sectors = index, item, []
+        lap_ms = parse_time(time)
+        if lap_ms is None or lap_ms >= NO_TIME:
+            raise ValueError(f'tempo invalido na volta {index}')
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise ValueError(f'numero invalido na volta {index}')
+        if not 0 < number <= MAX_LAPS:
+            raise ValueError(f'numero invalido na volta {index}')
+        if not isinstance(sectors, list) or len(sectors) > MAX_SECTORS:
+            raise ValueError(f'setores invalidos na volta {index}')
+        sectors_ms = [parse_time(s) for s in sectors]
+        if any(t is not None and t >= NO_TIME for t in sectors_ms):
+            raise ValueError(f'setores invalidos na volta {index}')
+        laps.append({'lap': number, 'time_ms': lap_ms, 'sectors_ms': sectors_ms})
+    return laps
+
+
+def pack_laps(laps):
+    """Bytes for RaceResult.lap_data from parse_laps() output"""
+    sectors = max((len(lap['sectors_ms']) for lap in laps), default=0)
+    lap_format = struct.Struct(f'<HI{sectors}I')
+    data = bytearray(HEADER.pack(FORMAT_VERSION, len(laps), sectors))
+    for lap in laps:
+        times = [NO_TIME if t is None else t for t in lap['sectors_ms']]
+        times += [NO_TIME] * (sectors - len(times))
+        data += lap_format.pack(lap['lap'], lap['time_ms'], *times)
+    return bytes(data)
+
+
+def unpack_laps(data):
+    """Laps stored by pack_laps(), in the same shape as parse_laps() output"""
+    if not data:
+        return []
+    version, count, sectors = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unknown lap data version {version}')
+    lap_format = struct.Struct(f'<HI{sectors}I')
+    return [
+        {
+            'lap': values[0],
+            'time_ms': values[1],
+            'sectors_ms': [None if t == NO_TIME else t for t in values[2:]]
+        }
+        for values in lap_format.iter_unpack(data[HEADER.size:HEADER.size + count * lap_format.size])
+    ]
+
+
+def summarize(laps):
+    """Best and average lap, total time (ms) and lap count"""
+    times = [lap['time_ms'] for lap in laps]
+    if not times:
+        return {'best_ms': None, 'average_ms': None, 'total_ms': None, 'laps': 0}
+    total = sum(times)
+    return {'best_ms': min(times), 'average_ms': total / len(times), 'total_ms': total, 'laps': len(times)}
+
+
+def lap_fields(laps):
+    """RaceResult column values for a parsed lap chart: the packed chart and what follows from it"""
+    if not laps:
+        return {'lap_data': None}
+    summary = summarize(laps)
+    return {
+        'lap_data': pack_laps(laps),
+        'lap_time_best': format_time(summary['best_ms']),
+        'lap_time_average': format_time(summary['average_ms']),
+        'total_time': format_time(summary['total_ms']),
+        'laps': summary['laps']
+    }
+
+
+def lap_chart(result_id, data):
+    """JSON for a stored lap chart"""
+    laps = unpack_laps(data)
+    summary = summarize(laps)
+    best = summary['best_ms']
+    return {
+        'result_id': result_id,
+        'laps': [
+            {
+                'lap': lap['lap'],
+                'time': format_time(lap['time_ms']),
+                'time_ms': lap['time_ms'],
+                'sectors': [format_time(t) for t in lap['sectors_ms']],
+                'sectors_ms': lap['sectors_ms'],
+                'best': lap['time_ms'] == best
+            }
+            for lap in laps
+        ],
+        'lap_count': summary['laps'],
+        'best_lap': format_time(best),
+        'average_lap': format_time(summary['average_ms']),
+        'total_time': format_time(summary['total_ms'])
+    }
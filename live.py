@@ -0,0 +1,364 @@
+import json
+import os
+import queue
+import select
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import undefer
+from laps import unpack_laps, parse_laps, parse_time, format_time
+
+# Live timing: writes to a race's results publish the race id, and every worker
+# with browsers subscribed to that race reloads its standings once and pushes
+# only what changed over Server-Sent Events.
+#
+# LIVE_PUBSUB=postgres relays publishes between workers with LISTEN/NOTIFY
+# (the default on PostgreSQL); LIVE_PUBSUB=local only reaches subscribers of
+# the worker that handled the write.
+LIVE_PUBSUB = os.environ.get('LIVE_PUBSUB')
+LIVE_DATABASE_URL = os.environ.get('LIVE_DATABASE_URL')
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_MAX_SUBSCRIBERS', 200))
+KEEPALIVE_SECONDS = 15
+QUEUE_SIZE = 100
+CHANNEL = 'race_live'
+
+# Fields sent for each result; deltas carry the ones that changed
+FIELDS = ('racer_id', 'name', 'position', 'laps', 'last_lap', 'lap_time_best', 'total_time', 'gap', 'dnf')
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def load_standings(db, race_id):
+    """Current results of a race in running order, keyed by result id"""
+    from models import Racer, RaceResult
+    rows = db.session.execute(
+        db.select(RaceResult.id, RaceResult.racer_id, Racer.name, RaceResult.position, RaceResult.laps,
+                  RaceResult.lap_time_best, RaceResult.total_time, RaceResult.dnf, RaceResult.lap_data)
+        .join(Racer, RaceResult.racer_id == Racer.id)
+        .where(RaceResult.race_id == race_id)
+    ).all()
+
+    standings = []
+    for row in rows:
+        chart = unpack_laps(row.lap_data)
+        standings.append({
+            'id': row.id,
+            'racer_id': row.racer_id,
+            'name': row.name,
+            'position': row.position,
+            'laps': row.laps,
+            'last_lap': format_time(chart[-1]['time_ms']) if chart else None,
+            'lap_time_best': row.lap_time_best,
+            'total_time': row.total_time,
+            'dnf': bool(row.dnf),
+            '_total_ms': parse_time(row.total_time),
+            '_best_ms': parse_time(row.lap_time_best)
+        })
+
+    # Explicit positions first, then whoever has done more laps in less time
+    standings.sort(key=lambda r: (r['position'] is None, r['position'] or 0, r['dnf'],
+                                  -(r['laps'] or 0), r['_total_ms'] is None, r['_total_ms'] or 0, r['id']))
+    leader = standings[0] if standings else None
+    for result in standings:
+        result['gap'] = gap(leader, result)
+    return {result['id']: result for result in standings}
+
+
+def gap(leader, result):
+    """'+1.234' behind the leader on the same lap, '+2 voltas' when laps down"""
+    if result is leader or result['dnf']:
+        return None
+    laps_down = (leader['laps'] or 0) - (result['laps'] or 0)
+    if laps_down > 0:
+        return f'+{laps_down} volta' + ('s' if laps_down > 1 else '')
+    if leader['_total_ms'] is None or result['_total_ms'] is None:
+        return None
+    return '+' + format_time(max(result['_total_ms'] - leader['_total_ms'], 0))
+
+
+def public(result):
+    return {'id': result['id'], **{field: result[field] for field in FIELDS}}
+
+
+def best_lap(standings):
+    timed = [r for r in standings.values() if r['_best_ms'] is not None]
+    if not timed:
+        return None
+    best = min(timed, key=lambda r: r['_best_ms'])
+    return {'id': best['id'], 'racer_id': best['racer_id'], 'name': best['name'], 'time': best['lap_time_best']}
+
+
+def diff(previous, current):
+    """Delta between two load_standings() results, or None when nothing changed"""
+    changed = []
+    for result_id, result in current.items():
+        before = previous.get(result_id)
+        if before is None:
+            changed.append(public(result))
+            continue
+        fields = {field: result[field] for field in FIELDS if result[field] != before[field]}
+        if fields:
+            changed.append({'id': result_id, **fields})
+    removed = [result_id for result_id in previous if result_id not in current]
+
+    delta = {}
+    if changed:
+        delta['results'] = changed
+    if removed:
+        delta['removed'] = removed
+    if list(previous) != list(current):
+        delta['order'] = list(current)
+    best = best_lap(current)
+    if best != best_lap(previous):
+        delta['best_lap'] = best
+    return delta or None
+
+
+def record_laps(db, race_id, items):
+    """Apply a timing feed batch to a race's results; the caller commits.
+
+    Each item is {"racer_id", "time", "lap", "sectors", "position", "dnf"}:
+    `time` adds (or with `lap`, replaces) a lap of that racer's chart, the
+    others are optional. Results missing from the race are created.
+    Returns the number of results touched. Raises ValueError when invalid.
+    """
+    from models import Racer, RaceResult
+    if not isinstance(items, list) or not items:
+        raise ValueError('laps deve ser uma lista nao vazia')
+    for index, item in enumerate(items, start=1):
+        if not isinstance(item, dict) or not isinstance(item.get('racer_id'), int):
+            raise ValueError(f'racer_id invalido no item {index}')
+    racer_ids = {item['racer_id'] for item in items}
+
+    results = {
+        result.racer_id: result
+        for result in RaceResult.query.options(undefer(RaceResult.lap_data))
+        .filter(RaceResult.race_id == race_id, RaceResult.racer_id.in_(racer_ids))
+    }
+    missing = racer_ids - set(results)
+    if missing:
+        unknown = missing - set(db.session.scalars(db.select(Racer.id).where(Racer.id.in_(missing))))
+        if unknown:
+            raise ValueError(f'pilotos nao encontrados: {", ".join(map(str, sorted(unknown)))}')
+        for racer_id in missing:
+            results[racer_id] = RaceResult(race_id=race_id, racer_id=racer_id, points_earned=0, dnf=False)
+            db.session.add(results[racer_id])
+
+    charts = {}
+    for index, item in enumerate(items, start=1):
+        result = results[item['racer_id']]
+        if item.get('time') is not None:
+            if result.racer_id not in charts:
+                charts[result.racer_id] = {lap['lap']: lap for lap in unpack_laps(result.lap_data)}
+            chart = charts[result.racer_id]
+            try:
+                lap = parse_laps([dict(item, lap=item.get('lap', max(chart, default=0) + 1))])[0]
+            except ValueError as e:
+                raise ValueError(f'item {index}: {e}')
+            chart[lap['lap']] = lap
+        if 'position' in item:
+            position = item['position']
+            if position is not None and (not isinstance(position, int) or position < 1):
+                raise ValueError(f'posicao invalida no item {index}')
+            result.position = position
+        if 'dnf' in item:
+            result.dnf = bool(item['dnf'])
+
+    for racer_id, chart in charts.items():
+        results[racer_id].set_laps([chart[number] for number in sorted(chart)])
+    return len(results)
+
+
+class Subscription:
+    def __init__(self, race_id):
+        self.race_id = race_id
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, event):
+        """Queue an event; a client too slow to keep up is dropped and reconnects for a new snapshot"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        """End the stream after the events already queued are dropped"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait(None)
+
+
+class Broker:
+    """Per-process registry of live subscriptions and the last standings sent to each race"""
+
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.mode = 'local'
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._standings = {}
+        self._race_locks = {}
+        self._listener = None
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        url = app.config['SQLALCHEMY_DATABASE_URI']
+        self.mode = LIVE_PUBSUB or ('postgres' if url.startswith('postgresql') else 'local')
+
+    def _count(self):
+        """Open subscriptions of this process; call with the lock held"""
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def _race_lock(self, race_id):
+        with self._lock:
+            return self._race_locks.setdefault(race_id, threading.Lock())
+
+    def subscribe(self, race_id):
+        """(subscription, snapshot event) for a new client of a race, None when LIVE_MAX_SUBSCRIBERS are open"""
+        if self.mode == 'postgres':
+            self._start_listener()
+        with self._race_lock(race_id):
+            standings = self._standings.get(race_id)
+            if standings is None:
+                standings = load_standings(self.db, race_id)
+            subscription = Subscription(race_id)
+            with self._lock:
+                # Counted and added under one lock, so concurrent clients cannot overshoot the cap
+                if self._count() >= LIVE_MAX_SUBSCRIBERS:
+                    return None
+                self._subscriptions.setdefault(race_id, set()).add(subscription)
+                self._standings[race_id] = standings
+        snapshot = {
+            'race_id': race_id,
+            'results': [public(result) for result in standings.values()],
+            'best_lap': best_lap(standings)
+        }
+        return subscription, format_event('snapshot', snapshot)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.race_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.race_id]
+                    self._standings.pop(subscription.race_id, None)
+
+    def publish(self, race_id):
+        """Announce that a race's results changed; call after the write is committed.
+
+        Best effort: a failure is logged and never fails the write that triggered it.
+        """
+        try:
+            if self.mode == 'postgres':
+                with self.db.engine.connect() as connection:
+                    connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                                       {'channel': CHANNEL, 'payload': str(race_id)})
+                    connection.commit()
+            else:
+                self.dispatch(race_id)
+        except Exception as e:
+            print(f"Live publish error (race {race_id}): {e}")
+
+    def dispatch(self, race_id):
+        """Push the changes of a race to this process's subscribers"""
+        with self._lock:
+            if race_id not in self._subscriptions:
+                return
+        with self._race_lock(race_id):
+            with self.app.app_context():
+                current = load_standings(self.db, race_id)
+            with self._lock:
+                previous = self._standings.get(race_id)
+                subscriptions = list(self._subscriptions.get(race_id, ()))
+                if previous is None:
+                    return
+                self._standings[race_id] = current
+            delta = diff(previous, current)
+            if delta is None:
+                return
+            event = format_event('delta', {'race_id': race_id, **delta})
+            for subscription in subscriptions:
+                if not subscription.put(event):
+                    self.unsubscribe(subscription)
+                    subscription.close()
+
+    def events(self, subscription, snapshot):
+        """SSE body: the snapshot, then deltas and keepalive comments until the client leaves"""
+        try:
+            yield snapshot
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='live-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        """LISTEN on a dedicated connection outside the pool, reconnecting after errors"""
+        engine = self.db.engine
+        url = make_url(LIVE_DATABASE_URL.replace('postgres://', 'postgresql://', 1)) if LIVE_DATABASE_URL else engine.url
+        cargs, cparams = engine.dialect.create_connect_args(url)
+        while True:
+            connection = None
+            try:
+                connection = engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN {CHANNEL}')
+                while True:
+                    if not select.select([connection], [], [], KEEPALIVE_SECONDS)[0]:
+                        continue
+                    connection.poll()
+                    race_ids = set()
+                    while connection.notifies:
+                        payload = connection.notifies.pop(0).payload
+                        if payload.isdigit():
+                            race_ids.add(int(payload))
+                    for race_id in race_ids:
+                        try:
+                            self.dispatch(race_id)
+                        except Exception as e:
+                            print(f"Live dispatch error (race {race_id}): {e}")
+            except Exception as e:
+                print(f"Live listener error: {e}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+broker = Broker()
+
+
+def init_app(app, db):
+    broker.init_app(app, db)
+
+
+def publish(*race_ids):
+    for race_id in dict.fromkeys(race_ids):
+        if race_id is not None:
+            broker.publish(int(race_id))
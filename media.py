@@ -0,0 +1,395 @@
+import hashlib
+import os
+import uuid
+import boto3
+import click
+from boto3.s3.transfer import TransferConfig
+from flask.cli import AppGroup
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+from werkzeug.utils import secure_filename
+from models import db, Album, Location, MediaItem, MediaBlob
+
+
+def get_r2_client():
+    """Get configured R2 client"""
+    return boto3.client(
+        's3',
+        endpoint_url=os.environ.get('R2_ENDPOINT_URL'),
+        aws_access_key_id=os.environ.get('R2_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY'),
+        region_name='auto'
+    )
+
+
+# Object keys are unique per upload and never rewritten, so every copy (browser,
+# edge) can keep them forever
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Upload limits. MAX_CONTENT_LENGTH adds room for the small form fields
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_MB', 10)) * 1024 * 1024
+MAX_FORM_OVERHEAD = 1024 * 1024
+
+# Objects above this size go to R2 as multipart uploads of this part size
+# (R2/S3 minimum), bounding what is held in memory per upload
+UPLOAD_PART_SIZE = 5 * 1024 * 1024
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+# Image variants served by Cloudflare Image Resizing when MEDIA_IMAGE_RESIZING is on
+MEDIA_VARIANTS = {
+    'thumb': 'width=480,fit=scale-down,format=auto',
+}
+
+
+def origin_base_url():
+    """Bucket public URL, the prefix stored in legacy absolute URLs"""
+    return (os.environ.get('R2_PUBLIC_URL') or '').rstrip('/')
+
+
+def media_base_url():
+    """Base URL media is served from (CDN host), defaults to the bucket URL"""
+    return (os.environ.get('MEDIA_BASE_URL') or origin_base_url()).rstrip('/')
+
+
+def known_base_urls():
+    """Every prefix an absolute media URL in the database may start with"""
+    bases = [origin_base_url(), media_base_url()]
+    bases += [b.strip().rstrip('/') for b in os.environ.get('MEDIA_LEGACY_BASE_URLS', '').split(',')]
+    return [b for b in bases if b]
+
+
+def public_url(storage_key, variant=None):
+    """Build the public URL of a stored object, optionally an edge-resized variant"""
+    if variant and os.environ.get('MEDIA_IMAGE_RESIZING') == '1':
+        return f"{media_base_url()}/cdn-cgi/image/{MEDIA_VARIANTS[variant]}/{storage_key}"
+    return f"{media_base_url()}/{storage_key}"
+
+
+def storage_key_from_url(url):
+    """Extract the storage key of an absolute URL pointing at our bucket/CDN"""
+    for base in known_base_urls():
+        if url and url.startswith(base + '/'):
+            return url[len(base) + 1:]
+    return None
+
+
+def media_url(url):
+    """Rewrite an absolute media URL to the configured base (external URLs untouched)"""
+    storage_key = storage_key_from_url(url)
+    return public_url(storage_key) if storage_key else url
+
+
+def canonical_url(url):
+    """Store media URLs against the bucket origin so a CDN change needs no rewrite"""
+    storage_key = storage_key_from_url(url)
+    return f"{origin_base_url()}/{storage_key}" if storage_key and origin_base_url() else url
+
+
+class HashingReader:
+    """File-like wrapper that hashes the bytes as the uploader reads them.
+
+    Only exposes read(), so boto3 streams it as a non-seekable body and the
+    file is never read twice.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    @property
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+# ============== STREAMING UPLOADS ==============
+
+class UploadRejected(Exception):
+    """Upload refused before (or while) streaming it to storage"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def sniff_image_type(head):
+    """Detect the image MIME type from the first bytes of a file"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class StreamingUpload:
+    """Single file read straight from a multipart/form-data request body.
+
+    The body is parsed incrementally from request.stream, so the file is never
+    buffered in memory or spooled to disk by Werkzeug: the size limit is
+    enforced chunk by chunk and the content is sniffed on the first chunk.
+    Call open() before handing the object to store_upload(), and finish()
+    afterwards to collect form fields sent after the file.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, request, field='file', max_size=MAX_UPLOAD_SIZE, allowed_extensions=IMAGE_EXTENSIONS):
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            raise UploadRejected('Envie o arquivo como multipart/form-data')
+        if request.content_length and request.content_length > max_size + MAX_FORM_OVERHEAD:
+            raise UploadRejected(f'Arquivo muito grande. Maximo: {max_size // (1024 * 1024)}MB', 413)
+
+        self.field = field
+        self.max_size = max_size
+        self.allowed_extensions = allowed_extensions
+        self.filename = None
+        self.content_type = None
+        self.size = 0
+        self.form = {}
+        self.error = None
+
+        self._input = request.stream
+        self._decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FORM_OVERHEAD)
+        self._part = None
+        self._field_data = bytearray()
+        self._buffer = bytearray()
+        self._file_done = False
+        self._finished = False
+
+    @property
+    def stream(self):
+        return self
+
+    def _next_event(self):
+        event = self._decoder.next_event()
+        while isinstance(event, NeedData):
+            chunk = self._input.read(self.chunk_size)
+            self._decoder.receive_data(chunk or None)
+            event = self._decoder.next_event()
+            if not chunk and isinstance(event, NeedData):
+                raise UploadRejected('Envio incompleto')
+        return event
+
+    def _step(self):
+        """Consume one parser event"""
+        event = self._next_event()
+        if isinstance(event, File) and event.name == self.field and self.filename is None:
+            self._part = 'file'
+            self.filename = event.filename
+        elif isinstance(event, Field):
+            self._part = event.name
+            self._field_data.clear()
+        elif isinstance(event, File):
+            self._part = None  # extra files are ignored
+        elif isinstance(event, Data):
+            if self._part == 'file':
+                self.size += len(event.data)
+                if self.size > self.max_size:
+                    raise UploadRejected(f'Arquivo muito grande. Maximo: {self.max_size // (1024 * 1024)}MB', 413)
+                self._buffer += event.data
+                self._file_done = not event.more_data
+            elif self._part is not None:
+                self._field_data += event.data
+                if not event.more_data:
+                    self.form[self._part] = self._field_data.decode('utf-8', 'replace')
+        elif isinstance(event, Epilogue):
+            self._finished = True
+            self._file_done = True
+
+    def open(self):
+        """Read up to the first file chunk and validate name and content"""
+        while not self._finished and (self.filename is None or (len(self._buffer) < 12 and not self._file_done)):
+            self._step()
+
+        if not self.filename:
+            raise UploadRejected('Nenhum arquivo enviado')
+        ext = self.filename.rsplit('.', 1)[1].lower() if '.' in self.filename else ''
+        if ext not in self.allowed_extensions:
+            raise UploadRejected('Apenas fotos sao permitidas. Use: JPG, PNG, GIF, WebP')
+        self.content_type = sniff_image_type(bytes(self._buffer[:12]))
+        if not self.content_type:
+            raise UploadRejected('O arquivo enviado nao e uma imagem valida')
+        return self
+
+    def read(self, size=-1):
+        try:
+            while not self._file_done and (size is None or size < 0 or len(self._buffer) < size):
+                self._step()
+        except UploadRejected as e:
+            # Keep the reason, the uploader may wrap the exception
+            self.error = e
+            raise
+        if size is None or size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+    def finish(self):
+        """Drain the rest of the body, collecting trailing form fields"""
+        while not self._finished:
+            self._step()
+        return self.form
+
+
+def store_upload(file, folder='media'):
+    """Upload file to R2 and return the MediaBlob holding its bytes.
+
+    The content is hashed while it streams to storage. If the same bytes were
+    uploaded before, the new object is dropped and the existing blob is reused,
+    so every distinct content is stored (and served) only once.
+    """
+    filename = secure_filename(file.filename)
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    storage_key = f"{folder}/{uuid.uuid4().hex}.{ext}"
+
+    r2_client = get_r2_client()
+    bucket_name = os.environ.get('R2_BUCKET_NAME')
+
+    reader = HashingReader(file.stream)
+    r2_client.upload_fileobj(
+        reader,
+        bucket_name,
+        storage_key,
+        ExtraArgs={
+            'ContentType': file.content_type,
+            'CacheControl': MEDIA_CACHE_CONTROL
+        },
+        Config=TransferConfig(multipart_threshold=UPLOAD_PART_SIZE, multipart_chunksize=UPLOAD_PART_SIZE)
+    )
+
+    existing = MediaBlob.query.filter_by(content_hash=reader.hexdigest).first()
+    if not existing:
+        blob = MediaBlob(
+            content_hash=reader.hexdigest,
+            storage_key=storage_key,
+            content_type=file.content_type,
+            size_bytes=reader.size
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+            return blob
+        except IntegrityError:
+            # Same content stored concurrently by another request
+            existing = MediaBlob.query.filter_by(content_hash=reader.hexdigest).first()
+
+    r2_client.delete_object(Bucket=bucket_name, Key=storage_key)
+    # Counted in SQL so concurrent uploads of the same content all register
+    db.session.execute(
+        update(MediaBlob).where(MediaBlob.id == existing.id).values(upload_count=MediaBlob.upload_count + 1)
+    )
+    return existing
+
+
+def dedup_stats():
+    """Storage and egress saved by serving duplicated uploads from one object"""
+    blobs = db.session.query(
+        func.count(MediaBlob.id),
+        func.coalesce(func.sum(MediaBlob.size_bytes), 0),
+        func.coalesce(func.sum((MediaBlob.upload_count - 1) * MediaBlob.size_bytes), 0),
+        func.coalesce(func.sum(MediaBlob.upload_count - 1), 0)
+    ).one()
+
+    # Bytes a visitor browsing every album no longer downloads twice, since
+    # items sharing a blob share the same cached URL
+    item_bytes = db.session.query(
+        func.coalesce(func.sum(MediaBlob.size_bytes), 0)
+    ).join(MediaItem, MediaItem.content_hash == MediaBlob.content_hash).scalar()
+    distinct_bytes = db.session.query(
+        func.coalesce(func.sum(MediaBlob.size_bytes), 0)
+    ).filter(MediaBlob.content_hash.in_(db.session.query(MediaItem.content_hash))).scalar()
+
+    return {
+        'blobs': blobs[0],
+        'stored_bytes': int(blobs[1]),
+        'duplicate_uploads': int(blobs[3]),
+        'storage_saved_bytes': int(blobs[2]),
+        'egress_saved_bytes': int(item_bytes) - int(distinct_bytes)
+    }
+
+
+def format_bytes(size):
+    """Human readable size, e.g. 1.5 MB"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+# ============== BACKFILL ==============
+
+media_cli = AppGroup('media', help='Media storage maintenance.')
+
+
+@media_cli.command('backfill')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--objects/--no-objects', default=True, show_default=True,
+              help='Also rewrite Cache-Control on the stored objects.')
+def backfill(batch_size, objects):
+    """Set storage keys on existing rows and immutable caching on existing objects"""
+    updated = 0
+    last_id = 0
+    while True:
+        items = MediaItem.query.filter(
+            MediaItem.id > last_id,
+            MediaItem.storage_key.is_(None)
+        ).order_by(MediaItem.id).limit(batch_size).all()
+        if not items:
+            break
+        for item in items:
+            storage_key = storage_key_from_url(item.url)
+            if storage_key:
+                item.storage_key = storage_key
+                item.url = canonical_url(item.url)
+                updated += 1
+        last_id = items[-1].id
+        db.session.commit()
+    click.echo(f'{updated} media item(s) now reference a storage key')
+
+    for model, column in ((Album, 'cover_url'), (Location, 'thumbnail_url')):
+        for row in model.query.filter(getattr(model, column).isnot(None)).all():
+            setattr(row, column, canonical_url(getattr(row, column)))
+        db.session.commit()
+
+    if not objects:
+        return
+
+    storage_keys = {key for (key,) in db.session.query(MediaItem.storage_key).filter(MediaItem.storage_key.isnot(None))}
+    storage_keys |= {key for (key,) in db.session.query(MediaBlob.storage_key)}
+
+    r2_client = get_r2_client()
+    bucket_name = os.environ.get('R2_BUCKET_NAME')
+    rewritten = 0
+    for storage_key in sorted(storage_keys):
+        try:
+            head = r2_client.head_object(Bucket=bucket_name, Key=storage_key)
+            if head.get('CacheControl') == MEDIA_CACHE_CONTROL:
+                continue
+            # Copying an object onto itself with REPLACE only rewrites metadata
+            r2_client.copy_object(
+                Bucket=bucket_name,
+                Key=storage_key,
+                CopySource={'Bucket': bucket_name, 'Key': storage_key},
+                MetadataDirective='REPLACE',
+                ContentType=head.get('ContentType', 'application/octet-stream'),
+                CacheControl=MEDIA_CACHE_CONTROL
+            )
+            rewritten += 1
+        except Exception as e:
+            click.echo(f'Skipping {storage_key}: {e}')
+    click.echo(f'{rewritten} object(s) updated to {MEDIA_CACHE_CONTROL}')
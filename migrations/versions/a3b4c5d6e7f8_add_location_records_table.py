@@ -0,0 +1,90 @@
+"""Add location_records table
+
+Revision ID: a3b4c5d6e7f8
+Revises: f2a3b4c5d6e7
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from datetime import date, datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3b4c5d6e7f8'
+down_revision = 'f2a3b4c5d6e7'
+branch_labels = None
+depends_on = None
+
+
+def parse_lap_time(value):
+    """Same parsing as stats.parse_lap_time at the time of writing"""
+    try:
+        if ':' in value:
+            minutes, seconds = value.split(':')[:2]
+            return int(minutes) * 60 + float(seconds)
+        return float(value)
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def upgrade():
+    location_records = op.create_table('location_records',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=False),
+        sa.Column('condition', sa.String(length=20), nullable=False),
+        sa.Column('racer_id', sa.Integer(), nullable=False),
+        sa.Column('race_id', sa.Integer(), nullable=False),
+        sa.Column('set_on', sa.Date(), nullable=False),
+        sa.Column('best_lap', sa.String(length=20), nullable=False),
+        sa.Column('best_lap_seconds', sa.Float(), nullable=False),
+        sa.Column('previous_seconds', sa.Float(), nullable=True),
+        sa.Column('improvement_seconds', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['racer_id'], ['racers.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['race_id'], ['races.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # The record board of a location is one range of this index, already in timeline order
+    op.create_index('ix_location_records_location_id_condition_set_on', 'location_records',
+                    ['location_id', 'condition', 'set_on', 'id'], unique=False)
+
+    # Replay the fastest lap of every race, in race order, to build the history so far
+    rows = op.get_bind().execute(sa.text(
+        "SELECT races.id, races.location_id, races.condition, races.date, race_results.racer_id, "
+        "race_results.lap_time_best FROM race_results JOIN races ON races.id = race_results.race_id "
+        "WHERE races.location_id IS NOT NULL AND race_results.lap_time_best IS NOT NULL "
+        "AND race_results.lap_time_best NOT IN ('', '-') "
+        "ORDER BY races.date, races.id, race_results.id"
+    ))
+    fastest = {}
+    for race_id, location_id, condition, set_on, racer_id, lap_time in rows:
+        seconds = parse_lap_time(lap_time)
+        if seconds is not None and (race_id not in fastest or seconds < fastest[race_id]['best_lap_seconds']):
+            if isinstance(set_on, str):
+                set_on = date.fromisoformat(set_on[:10])
+            fastest[race_id] = {
+                'location_id': location_id, 'condition': condition, 'racer_id': racer_id, 'race_id': race_id,
+                'set_on': set_on, 'best_lap': lap_time, 'best_lap_seconds': seconds
+            }
+
+    now = datetime.utcnow()
+    records = {}
+    history = []
+    for lap in fastest.values():
+        key = (lap['location_id'], lap['condition'])
+        previous = records.get(key)
+        if previous is None or lap['best_lap_seconds'] < previous:
+            history.append(dict(
+                lap, created_at=now, previous_seconds=previous,
+                improvement_seconds=previous - lap['best_lap_seconds'] if previous is not None else None
+            ))
+            records[key] = lap['best_lap_seconds']
+    if history:
+        op.bulk_insert(location_records, history)
+
+
+def downgrade():
+    op.drop_index('ix_location_records_location_id_condition_set_on', table_name='location_records')
+    op.drop_table('location_records')
@@ -0,0 +1,27 @@
+"""Add storage_key to media_items
+
+Revision ID: a7b8c9d0e1f2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7b8c9d0e1f2'
+down_revision = 'f6a7b8c9d0e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled by `flask media backfill`
+    with op.batch_alter_table('media_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage_key', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('media_items', schema=None) as batch_op:
+        batch_op.drop_column('storage_key')
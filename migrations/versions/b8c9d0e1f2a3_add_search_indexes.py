@@ -0,0 +1,38 @@
+"""Add full-text search indexes
+
+Revision ID: b8c9d0e1f2a3
+Revises: a7b8c9d0e1f2
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8c9d0e1f2a3'
+down_revision = 'a7b8c9d0e1f2'
+branch_labels = None
+depends_on = None
+
+# Expressions must match search._document() exactly for the planner to use them
+INDEXES = {
+    'ix_racers_search': ('racers', "to_tsvector('simple', coalesce(name, ''))"),
+    'ix_races_search': ('races', "to_tsvector('simple', coalesce(race_name, '') || ' ' || coalesce(track_name, ''))"),
+    'ix_locations_search': ('locations', "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || coalesce(neighborhood, ''))"),
+    'ix_albums_search': ('albums', "to_tsvector('simple', coalesce(name, ''))"),
+}
+
+
+def upgrade():
+    # Other databases search an in-memory index, see search.MemoryIndex
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, (table, expression) in INDEXES.items():
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (({expression}))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,34 @@
+"""Add indexes for the admin grid filters and sorting
+
+Revision ID: c9d0e1f2a3b4
+Revises: b8c9d0e1f2a3
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d0e1f2a3b4'
+down_revision = 'b8c9d0e1f2a3'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_race_results_race_id_position': ('race_results', ['race_id', 'position']),
+    'ix_race_results_racer_id': ('race_results', ['racer_id']),
+    'ix_races_date': ('races', ['date']),
+    'ix_races_location_id': ('races', ['location_id']),
+    'ix_races_championship_id': ('races', ['championship_id']),
+    'ix_users_created_at': ('users', ['created_at']),
+}
+
+
+def upgrade():
+    for name, (table, columns) in INDEXES.items():
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, (table, columns) in INDEXES.items():
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,26 @@
+"""Add lap_data to race_results
+
+Revision ID: d0e1f2a3b4c5
+Revises: c9d0e1f2a3b4
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0e1f2a3b4c5'
+down_revision = 'c9d0e1f2a3b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('race_results', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lap_data', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('race_results', schema=None) as batch_op:
+        batch_op.drop_column('lap_data')
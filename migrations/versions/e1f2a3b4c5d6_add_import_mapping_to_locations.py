@@ -0,0 +1,26 @@
+"""Add import_mapping to locations
+
+Revision ID: e1f2a3b4c5d6
+Revises: d0e1f2a3b4c5
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f2a3b4c5d6'
+down_revision = 'd0e1f2a3b4c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('import_mapping', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.drop_column('import_mapping')
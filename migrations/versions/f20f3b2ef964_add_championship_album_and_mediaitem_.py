@@ -54,7 +54,7 @@ def upgrade():
     )
     with op.batch_alter_table('races', schema=None) as batch_op:
         batch_op.add_column(sa.Column('championship_id', sa.Integer(), nullable=True))
-        batch_op.create_foreign_key(None, 'championships', ['championship_id'], ['id'])
+        batch_op.create_foreign_key('races_championship_id_fkey', 'championships', ['championship_id'], ['id'])
 
     # ### end Alembic commands ###
 
@@ -62,7 +62,7 @@ def upgrade():
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
     with op.batch_alter_table('races', schema=None) as batch_op:
-        batch_op.drop_constraint(None, type_='foreignkey')
+        batch_op.drop_constraint('races_championship_id_fkey', type_='foreignkey')
         batch_op.drop_column('championship_id')
 
     op.drop_table('media_items')
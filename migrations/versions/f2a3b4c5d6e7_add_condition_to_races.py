@@ -0,0 +1,41 @@
+"""Add condition to races
+
+Revision ID: f2a3b4c5d6e7
+Revises: e1f2a3b4c5d6
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a3b4c5d6e7'
+down_revision = 'e1f2a3b4c5d6'
+branch_labels = None
+depends_on = None
+
+# Same classification as stats.get_weather_condition at the time of writing
+WET = ['chuvoso', 'molhado', 'wet', 'rain', 'chuva']
+INDOOR = ['indoor', 'coberto', 'fechado']
+
+
+def matches(words):
+    return ' OR '.join(f"LOWER(COALESCE(weather, '')) LIKE '%{word}%'" for word in words)
+
+
+def upgrade():
+    with op.batch_alter_table('races', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('condition', sa.String(length=20), nullable=False, server_default='dry'))
+
+    op.execute(
+        f"UPDATE races SET condition = CASE WHEN {matches(INDOOR)} THEN 'indoor' "
+        f"WHEN {matches(WET)} THEN 'wet' ELSE 'dry' END"
+    )
+    op.create_index('ix_races_location_id_condition', 'races', ['location_id', 'condition'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_races_location_id_condition', table_name='races')
+    with op.batch_alter_table('races', schema=None) as batch_op:
+        batch_op.drop_column('condition')
@@ -0,0 +1,43 @@
+"""Add media_blobs table and content_hash to media_items
+
+Revision ID: f6a7b8c9d0e1
+Revises: e5f6a7b8c9d0
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6a7b8c9d0e1'
+down_revision = 'e5f6a7b8c9d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('storage_key', sa.String(length=500), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=True),
+        sa.Column('size_bytes', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('upload_count', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_media_blobs_content_hash', 'media_blobs', ['content_hash'], unique=True)
+
+    with op.batch_alter_table('media_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_media_items_content_hash', ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('media_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_media_items_content_hash')
+        batch_op.drop_column('content_hash')
+
+    op.drop_index('ix_media_blobs_content_hash', table_name='media_blobs')
+    op.drop_table('media_blobs')
@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(UserMixin, db.Model):
@@ -14,7 +15,7 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String(100), nullable=False)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     is_admin = db.Column(db.Boolean, nullable=False, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = db.Column(db.DateTime, nullable=True)
     racer_id = db.Column(db.Integer, db.ForeignKey('racers.id', ondelete='SET NULL'), nullable=True)
@@ -38,8 +39,8 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         """Hash and set the user's password"""
-        from app import bcrypt
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        from passwords import hash_password
+        self.password_hash = hash_password(password)
 
     def to_dict(self):
         return {
@@ -136,6 +137,27 @@ class LocationFastestLap(db.Model):
             'best_lap': self.best_lap
         }
 
+class LocationRecord(db.Model):
+    """A location record at the moment it fell. Append-only history, maintained by records.py"""
+    __tablename__ = 'location_records'
+    __table_args__ = (
+        # The record board of a location is one range of this index, already in timeline order
+        db.Index('ix_location_records_location_id_condition_set_on', 'location_id', 'condition', 'set_on', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id', ondelete='CASCADE'), nullable=False)
+    condition = db.Column(db.String(20), nullable=False)  # 'dry', 'wet', 'indoor'
+    racer_id = db.Column(db.Integer, db.ForeignKey('racers.id', ondelete='CASCADE'), nullable=False)
+    race_id = db.Column(db.Integer, db.ForeignKey('races.id', ondelete='CASCADE'), nullable=False)
+    set_on = db.Column(db.Date, nullable=False)  # date of the race the lap was set in
+    best_lap = db.Column(db.String(20), nullable=False)
+    best_lap_seconds = db.Column(db.Float, nullable=False)
+    previous_seconds = db.Column(db.Float)  # record it beat, None for the first one
+    improvement_seconds = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Location(db.Model):
     __tablename__ = 'locations'
     
@@ -157,6 +179,8 @@ class Location(db.Model):
     website = db.Column(db.String(200))
     description = db.Column(db.Text)
     thumbnail_url = db.Column(db.String(200))
+    # Column mapping for this venue's timing exports, see importer.py
+    import_mapping = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -164,6 +188,7 @@ class Location(db.Model):
     races = db.relationship('Race', backref='location', lazy=True)
     
     def to_dict(self):
+        from media import media_url
         return {
             'location_id': self.id,
             'name': self.name,
@@ -182,7 +207,7 @@ class Location(db.Model):
             'instagram': self.instagram,
             'website': self.website,
             'description': self.description,
-            'thumbnail_url': self.thumbnail_url,
+            'thumbnail_url': media_url(self.thumbnail_url) if self.thumbnail_url else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -217,14 +242,19 @@ class Championship(db.Model):
 
 class Race(db.Model):
     __tablename__ = 'races'
+    __table_args__ = (
+        db.Index('ix_races_location_id_condition', 'location_id', 'condition'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     race_name = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.Date, nullable=False)
-    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'))
-    championship_id = db.Column(db.Integer, db.ForeignKey('championships.id'), nullable=True)
+    date = db.Column(db.Date, nullable=False, index=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), index=True)
+    championship_id = db.Column(db.Integer, db.ForeignKey('championships.id'), nullable=True, index=True)
     track_name = db.Column(db.String(100))
     weather = db.Column(db.String(50))
+    # 'dry', 'wet' or 'indoor', classified from weather when it is saved (stats.get_weather_condition)
+    condition = db.Column(db.String(20), nullable=False, default='dry', server_default='dry')
     total_laps = db.Column(db.Integer)
     winner_id = db.Column(db.Integer, db.ForeignKey('racers.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -244,6 +274,7 @@ class Race(db.Model):
             'championship_id': self.championship_id,
             'track_name': self.track_name,
             'weather': self.weather,
+            'condition': self.condition,
             'total_laps': self.total_laps,
             'winner_id': self.winner_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -252,10 +283,13 @@ class Race(db.Model):
 
 class RaceResult(db.Model):
     __tablename__ = 'race_results'
+    __table_args__ = (
+        db.Index('ix_race_results_race_id_position', 'race_id', 'position'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     race_id = db.Column(db.Integer, db.ForeignKey('races.id'), nullable=False)
-    racer_id = db.Column(db.Integer, db.ForeignKey('racers.id'), nullable=False)
+    racer_id = db.Column(db.Integer, db.ForeignKey('racers.id'), nullable=False, index=True)
     position = db.Column(db.Integer)
     lap_time_best = db.Column(db.String(20))
     lap_time_average = db.Column(db.String(20))
@@ -264,9 +298,21 @@ class RaceResult(db.Model):
     dnf = db.Column(db.Boolean, default=False)
     laps = db.Column(db.Integer)
     excluded = db.Column(db.Boolean, default=False)
+    # Packed lap chart (see laps.py); deferred so result lists don't load it
+    lap_data = db.deferred(db.Column(db.LargeBinary))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def lap_chart(self):
+        from laps import lap_chart
+        return lap_chart(self.id, self.lap_data)
+
+    def set_laps(self, laps):
+        """Store a parsed lap chart; best lap, average lap, total time and lap count follow from it"""
+        from laps import lap_fields
+        for key, value in lap_fields(laps).items():
+            setattr(self, key, value)
+
     def to_dict(self):
         return {
             'result_id': self.id,
@@ -301,12 +347,13 @@ class Album(db.Model):
     media_items = db.relationship('MediaItem', backref='album', cascade='all, delete-orphan', lazy=True)
 
     def to_dict(self):
+        from media import media_url
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'race_id': self.race_id,
-            'cover_url': self.cover_url,
+            'cover_url': media_url(self.cover_url) if self.cover_url else None,
             'google_photos_link': self.google_photos_link,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -322,15 +369,48 @@ class MediaItem(db.Model):
     url = db.Column(db.String(500), nullable=False)
     title = db.Column(db.String(100))
     description = db.Column(db.Text)
+    content_hash = db.Column(db.String(64), index=True)  # sha256 of the uploaded bytes, see MediaBlob
+    storage_key = db.Column(db.String(500))  # R2 object key; url is built from it at serialization
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def public_url(self):
+        from media import public_url, media_url
+        return public_url(self.storage_key) if self.storage_key else media_url(self.url)
+
     def to_dict(self):
+        from media import public_url
         return {
             'id': self.id,
             'album_id': self.album_id,
             'media_type': self.media_type,
-            'url': self.url,
+            'url': self.public_url,
+            'thumb_url': public_url(self.storage_key, 'thumb') if self.storage_key else self.public_url,
             'title': self.title,
             'description': self.description,
             'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+
+
+class MediaBlob(db.Model):
+    """One stored object per distinct uploaded content (sha256)"""
+    __tablename__ = 'media_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    storage_key = db.Column(db.String(500), nullable=False)
+    content_type = db.Column(db.String(100))
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    upload_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content_hash': self.content_hash,
+            'storage_key': self.storage_key,
+            'content_type': self.content_type,
+            'size_bytes': self.size_bytes,
+            'upload_count': self.upload_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import request
+
+# Hashing policy. Changing BCRYPT_LOG_ROUNDS rehashes each password on its
+# owner's next successful login
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+# bcrypt runs outside the GIL, so a small pool hashes in parallel while bounding
+# how much CPU a burst of logins can take. Requests that cannot get a slot in
+# time fail fast instead of piling up behind the pool
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+
+def _make_executor():
+    """Pool of real OS threads for bcrypt.
+
+    Under a gevent worker (monkey-patched threading) a plain
+    ThreadPoolExecutor would run hashes in greenlets, each blocking the whole
+    worker; gevent's own pool runs them on OS threads the hub waits on.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+        return GeventThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+_executor = _make_executor()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+_stats_lock = threading.Lock()
+_stats = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rejected': 0}
+
+
+class PasswordHashBusy(Exception):
+    """All hashing slots are taken, the caller should retry later"""
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats_lock:
+            _stats['count'] += 1
+            _stats['seconds'] += elapsed
+            _stats['max_seconds'] = max(_stats['max_seconds'], elapsed)
+
+
+def _run(func, *args):
+    if not _slots.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        with _stats_lock:
+            _stats['rejected'] += 1
+        raise PasswordHashBusy()
+    try:
+        future = _executor.submit(_timed, func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is held until the hash finishes, even when the caller stops waiting
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        raise PasswordHashBusy()
+
+
+def hash_password(password):
+    """Hash a password with the configured policy"""
+    from app import bcrypt
+    return _run(bcrypt.generate_password_hash, password).decode('utf-8')
+
+
+def check_password(password_hash, password):
+    """Check a password against its stored hash"""
+    from app import bcrypt
+    return _run(bcrypt.check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True when the stored hash was made with a different cost than configured"""
+    # bcrypt hashes look like $2b$12$<salt+hash>
+    parts = (password_hash or '').split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return True
+    return int(parts[2]) != BCRYPT_LOG_ROUNDS
+
+
+def hash_stats():
+    """Hashing counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['avg_ms'] = round(stats['seconds'] / stats['count'] * 1000, 1) if stats['count'] else 0
+    stats['max_ms'] = round(stats.pop('max_seconds') * 1000, 1)
+    stats['seconds'] = round(stats['seconds'], 3)
+    stats['rounds'] = BCRYPT_LOG_ROUNDS
+    return stats
+
+
+# ============== RATE LIMITING ==============
+
+class TokenBucket:
+    """Allows `rate` actions per minute with bursts up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter:
+    """Per-key token buckets kept in memory (per process), oldest keys evicted first"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+            return bucket.take()
+
+
+ip_limiter = RateLimiter(
+    rate=int(os.environ.get('LOGIN_RATE_PER_IP', 20)),
+    burst=int(os.environ.get('LOGIN_BURST_PER_IP', 10))
+)
+email_limiter = RateLimiter(
+    rate=int(os.environ.get('LOGIN_RATE_PER_EMAIL', 5)),
+    burst=int(os.environ.get('LOGIN_BURST_PER_EMAIL', 5))
+)
+
+
+def client_ip():
+    """Client address; the platform router appends it last to X-Forwarded-For"""
+    if request.access_route and request.headers.get('X-Forwarded-For'):
+        return request.access_route[-1]
+    return request.remote_addr
+
+
+def login_allowed(email=None):
+    """Check the per-IP and per-email buckets, before any hashing work"""
+    if not ip_limiter.allow(client_ip()):
+        return False
+    return email is None or email_limiter.allow(email)
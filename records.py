@@ -0,0 +1,169 @@
+from collections import defaultdict
+from datetime import date
+import click
+from flask.cli import AppGroup
+from models import db, Race, RaceResult, Racer, Location, LocationRecord
+from stats import parse_lap_time
+
+# Location record history: every time the fastest lap of a location and
+# condition falls, a LocationRecord row keeps who set it, in which race and by
+# how much. Result writes append to it (check_races); only a change to a race
+# older than the current record, or to the race holding it, replays that
+# timeline from the race's date on.
+CONDITIONS = ('dry', 'wet', 'indoor')
+
+
+def race_laps(*filters):
+    """Fastest timed lap of each race matching `filters`, in race order"""
+    rows = db.session.execute(
+        db.select(Race.id, Race.location_id, Race.condition, Race.date, RaceResult.racer_id,
+                  RaceResult.lap_time_best)
+        .join(RaceResult, RaceResult.race_id == Race.id)
+        .where(
+            Race.location_id.isnot(None),
+            RaceResult.lap_time_best.isnot(None),
+            RaceResult.lap_time_best != '',
+            RaceResult.lap_time_best != '-',
+            *filters
+        )
+        .order_by(Race.date, Race.id, RaceResult.id)
+    )
+    fastest = {}
+    for race_id, location_id, condition, set_on, racer_id, lap_time in rows:
+        seconds = parse_lap_time(lap_time)
+        if seconds is not None and (race_id not in fastest or seconds < fastest[race_id].best_lap_seconds):
+            fastest[race_id] = LocationRecord(
+                location_id=location_id, condition=condition, race_id=race_id, set_on=set_on,
+                racer_id=racer_id, best_lap=lap_time, best_lap_seconds=seconds
+            )
+    return list(fastest.values())
+
+
+def append(laps, record):
+    """Add the laps that beat `record` (the standing LocationRecord or None), in order"""
+    added = 0
+    for lap in laps:
+        if record is None or lap.best_lap_seconds < record.best_lap_seconds:
+            if record is not None:
+                lap.previous_seconds = record.best_lap_seconds
+                lap.improvement_seconds = record.best_lap_seconds - lap.best_lap_seconds
+            db.session.add(lap)
+            record = lap
+            added += 1
+    return added
+
+
+def standing(location_id, condition, before=None):
+    """The latest record of a timeline, or the last one set before the date `before`"""
+    query = db.select(LocationRecord).where(
+        LocationRecord.location_id == location_id, LocationRecord.condition == condition
+    )
+    if before is not None:
+        query = query.where(LocationRecord.set_on < before)
+    return db.session.scalars(
+        query.order_by(LocationRecord.set_on.desc(), LocationRecord.id.desc()).limit(1)
+    ).first()
+
+
+def replay(location_id, condition, since=None):
+    """Rewrite a timeline from the date `since` on (all of it by default)"""
+    delete = db.delete(LocationRecord).where(
+        LocationRecord.location_id == location_id, LocationRecord.condition == condition
+    )
+    filters = [Race.location_id == location_id, Race.condition == condition]
+    if since is not None:
+        delete = delete.where(LocationRecord.set_on >= since)
+        filters.append(Race.date >= since)
+    db.session.execute(delete)
+    return append(race_laps(*filters), standing(location_id, condition, since) if since else None)
+
+
+def check_races(race_ids):
+    """Record the laps of these races that broke a record; runs in the caller's transaction"""
+    race_ids = set(race_ids)
+    db.session.flush()
+    races = db.session.execute(
+        db.select(Race.id, Race.location_id, Race.condition, Race.date)
+        .where(Race.id.in_(race_ids), Race.location_id.isnot(None))
+        .order_by(Race.date, Race.id)
+    ).all()
+    by_key = defaultdict(list)
+    for race in races:
+        by_key[(race.location_id, race.condition)].append(race)
+
+    laps = defaultdict(list)
+    for lap in race_laps(Race.id.in_(race_ids)):
+        laps[(lap.location_id, lap.condition)].append(lap)
+
+    added = 0
+    for key, key_races in by_key.items():
+        record = standing(*key)
+        earliest = key_races[0].date
+        # History is ordered by (date, race id): a race on the record's own date may sort before it
+        if record is not None and (earliest <= record.set_on or record.race_id in race_ids):
+            added += replay(*key, since=min(earliest, record.set_on))
+        else:
+            added += append(laps[key], record)
+    return added
+
+
+def race_moved(race, location_id, condition, race_date):
+    """A race changed location, condition or date: fix the timeline it left and the one it joined"""
+    if (race.location_id, race.condition, race.date) == (location_id, condition, race_date):
+        return
+    if location_id is not None:
+        replay(location_id, condition, since=race_date)
+    check_races([race.id])
+
+
+def rebuild_history():
+    """Replay every timeline from scratch"""
+    db.session.execute(db.delete(LocationRecord))
+    laps = defaultdict(list)
+    for lap in race_laps():
+        laps[(lap.location_id, lap.condition)].append(lap)
+    return sum(append(key_laps, None) for key_laps in laps.values())
+
+
+def record_board(location_id):
+    """Timeline of each condition at a location, from a single range of the history index"""
+    rows = db.session.execute(
+        db.select(LocationRecord, Racer.name)
+        .join(Racer, LocationRecord.racer_id == Racer.id)
+        .where(LocationRecord.location_id == location_id)
+        .order_by(LocationRecord.condition, LocationRecord.set_on, LocationRecord.id)
+    ).all()
+
+    board = {}
+    for record, racer_name in rows:
+        board.setdefault(record.condition, []).append({
+            'racer_id': record.racer_id,
+            'racer_name': racer_name,
+            'race_id': record.race_id,
+            'date': record.set_on.isoformat(),
+            'best_lap': record.best_lap,
+            'best_lap_seconds': record.best_lap_seconds,
+            'previous_seconds': record.previous_seconds,
+            'improvement_seconds': round(record.improvement_seconds, 3) if record.improvement_seconds is not None else None
+        })
+
+    today = date.today()
+    for progression in board.values():
+        for entry, following in zip(progression, progression[1:] + [None]):
+            held_until = date.fromisoformat(following['date']) if following else today
+            entry['held_days'] = (held_until - date.fromisoformat(entry['date'])).days
+    return {
+        condition: {'current': board[condition][-1], 'progression': board[condition]}
+        for condition in CONDITIONS if condition in board
+    }
+
+
+records_cli = AppGroup('records', help='Location record history.')
+
+
+@records_cli.command('rebuild')
+def rebuild():
+    """Rebuild the record history of every location from the race results"""
+    count = rebuild_history()
+    db.session.commit()
+    click.echo(f'{count} record(s) in the history of {Location.query.count()} location(s)')
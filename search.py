@@ -0,0 +1,145 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from sqlalchemy import or_
+from cache import data_version
+from models import db, Racer, Race, Location, Album
+
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 60))
+MAX_RESULTS = 50
+
+# (type, model, title column, subtitle columns). The PostgreSQL expressions
+# below must stay identical to the GIN indexes created by migration b8c9d0e1f2a3
+SOURCES = (
+    ('racer', Racer, 'name', ()),
+    ('race', Race, 'race_name', ('track_name',)),
+    ('location', Location, 'name', ('city', 'neighborhood')),
+    ('album', Album, 'name', ()),
+)
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:8]
+
+
+def search(query, limit=10):
+    """Racers, races, locations and albums matching every term (as a prefix), best first"""
+    words = terms(query)
+    if not words:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return _search_postgres(words, limit)
+    return memory_index.search(words, limit)
+
+
+# ============== POSTGRESQL ==============
+
+def _document(title, subtitles):
+    columns = ' || \' \' || '.join(f"coalesce({column}, '')" for column in (title,) + subtitles)
+    return f"to_tsvector('simple', {columns})"
+
+
+def _search_postgres(words, limit):
+    branches = []
+    for kind, model, title, subtitles in SOURCES:
+        document = _document(title, subtitles)
+        subtitle = f"NULLIF(concat_ws(', ', {', '.join(subtitles)}), '')" if subtitles else 'NULL'
+        branches.append(
+            f"SELECT '{kind}' AS type, id, {title} AS title, {subtitle} AS subtitle, "
+            f"ts_rank({document}, q) AS rank "
+            f"FROM {model.__tablename__}, to_tsquery('simple', :query) q WHERE {document} @@ q"
+        )
+    sql = ' UNION ALL '.join(branches) + ' ORDER BY rank DESC, title LIMIT :limit'
+    rows = db.session.execute(db.text(sql), {'query': ' & '.join(f'{word}:*' for word in words), 'limit': limit})
+    return [
+        {'type': row.type, 'id': row.id, 'title': row.title, 'subtitle': row.subtitle}
+        for row in rows
+    ]
+
+
+# ============== OTHER DATABASES ==============
+
+class MemoryIndex:
+    """SQLite FTS5 index held in memory by each process.
+
+    Rebuilt from the database when the data version changes or after
+    SEARCH_INDEX_TTL seconds, so writes on other workers show up too.
+    Falls back to LIKE queries when SQLite was built without FTS5.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection = None
+        self._version = None
+        self._built_at = 0
+        self.fts5 = True
+
+    def _documents(self):
+        for kind, model, title, subtitles in SOURCES:
+            columns = [model.id, getattr(model, title)] + [getattr(model, column) for column in subtitles]
+            for row in db.session.execute(db.select(*columns)):
+                subtitle = ', '.join(value for value in row[2:] if value) or None
+                yield kind, row[0], row[1] or '', subtitle
+
+    def _build(self):
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        connection.execute(
+            "CREATE VIRTUAL TABLE documents USING fts5("
+            "type UNINDEXED, id UNINDEXED, title, subtitle, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        connection.executemany('INSERT INTO documents VALUES (?, ?, ?, ?)', self._documents())
+        return connection
+
+    def _current(self):
+        version = data_version()
+        with self._lock:
+            if self._version != version or time.monotonic() - self._built_at > SEARCH_INDEX_TTL:
+                try:
+                    self._connection = self._build()
+                except sqlite3.OperationalError:
+                    self.fts5 = False
+                    return None
+                self._version = version
+                self._built_at = time.monotonic()
+            return self._connection
+
+    def search(self, words, limit):
+        connection = self._current() if self.fts5 else None
+        if connection is None:
+            return _search_like(words, limit)
+
+        match = ' '.join(f'"{word}"*' for word in words)
+        with self._lock:
+            rows = connection.execute(
+                'SELECT type, id, title, subtitle FROM documents WHERE documents MATCH ? '
+                'ORDER BY bm25(documents, 0, 0, 2.0, 1.0), title LIMIT ?',
+                (match, limit)
+            ).fetchall()
+        return [{'type': row[0], 'id': row[1], 'title': row[2], 'subtitle': row[3]} for row in rows]
+
+
+memory_index = MemoryIndex()
+
+
+def _search_like(words, limit):
+    results = []
+    for kind, model, title, subtitles in SOURCES:
+        columns = [getattr(model, title)] + [getattr(model, column) for column in subtitles]
+        query = db.select(model.id, *columns)
+        for word in words:
+            pattern = '%' + word.replace('_', '\\_') + '%'
+            query = query.where(or_(*(column.ilike(pattern, escape='\\') for column in columns)))
+        for row in db.session.execute(query.limit(limit)):
+            results.append({
+                'type': kind,
+                'id': row[0],
+                'title': row[1],
+                'subtitle': ', '.join(value for value in row[2:] if value) or None
+            })
+    # Titles starting with the first term rank first
+    results.sort(key=lambda item: (not (item['title'] or '').lower().startswith(words[0]), item['title'] or ''))
+    return results[:limit]
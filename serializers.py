@@ -0,0 +1,149 @@
+import os
+from flask.json.provider import DefaultJSONProvider
+from models import db, Racer, Race, RaceResult, RacerBestLap, Location
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT = (',', ':')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    Output matches the default provider: keys are sorted, and datetimes,
+    Decimals and other types orjson does not handle go through Flask's
+    `default`, so dates stay in HTTP format.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # response() passes compact separators, or indent when pretty-printing;
+        # both have an orjson equivalent, anything else goes to the stdlib
+        separators = kwargs.pop('separators', COMPACT)
+        indent = kwargs.pop('indent', None)
+        if kwargs or tuple(separators) != COMPACT:
+            if indent is not None:
+                kwargs['indent'] = indent
+            return super().dumps(obj, separators=separators, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def init_app(app):
+    """Use orjson for jsonify when it is installed (JSON_PROVIDER=default opts out)"""
+    if orjson is not None and os.environ.get('JSON_PROVIDER', 'orjson') == 'orjson':
+        app.json = OrjsonProvider(app)
+
+
+# ============== COLUMN SERIALIZERS ==============
+# Read-only lists built from plain row tuples, without hydrating ORM objects.
+# Keys and formats match the models' to_dict()
+
+def _execute(query):
+    # Core execution on the session's connection skips the ORM result layer
+    return db.session.connection().execute(query)
+
+
+def _rows(columns, rows, dates=()):
+    keys = [key for key, _ in columns]
+    data = []
+    for row in rows:
+        item = dict(zip(keys, row))
+        for key in dates:
+            value = item[key]
+            item[key] = value.isoformat() if value else None
+        data.append(item)
+    return data
+
+
+RESULT_COLUMNS = (
+    ('result_id', RaceResult.id),
+    ('race_id', RaceResult.race_id),
+    ('racer_id', RaceResult.racer_id),
+    ('position', RaceResult.position),
+    ('lap_time_best', RaceResult.lap_time_best),
+    ('lap_time_average', RaceResult.lap_time_average),
+    ('total_time', RaceResult.total_time),
+    ('points_earned', RaceResult.points_earned),
+    ('dnf', RaceResult.dnf),
+    ('laps', RaceResult.laps),
+    ('excluded', RaceResult.excluded),
+    ('created_at', RaceResult.created_at),
+    ('updated_at', RaceResult.updated_at),
+    ('name', Racer.name),
+    ('race_name', Race.race_name),
+    ('date', Race.date),
+)
+
+RACER_COLUMNS = (
+    ('racer_id', Racer.id),
+    ('name', Racer.name),
+    ('age', Racer.age),
+    ('experience_years', Racer.experience_years),
+    ('total_races', Racer.total_races),
+    ('wins', Racer.wins),
+    ('podium_finishes', Racer.podium_finishes),
+    ('created_at', Racer.created_at),
+    ('updated_at', Racer.updated_at),
+)
+
+
+def result_rows():
+    """Every race result with its racer name, race name and date"""
+    query = db.select(*(column for _, column in RESULT_COLUMNS)).join(
+        Racer, RaceResult.racer_id == Racer.id
+    ).join(
+        Race, RaceResult.race_id == Race.id
+    )
+    return _rows(RESULT_COLUMNS, _execute(query), dates=('created_at', 'updated_at', 'date'))
+
+
+def racer_rows(include_best_laps=True):
+    """Every racer, optionally with their best laps grouped by location and condition.
+
+    Best laps come from the same query: one row per racer and best lap (a
+    single row for racers without any), pivoted as the rows stream in.
+    """
+    columns = [column for _, column in RACER_COLUMNS]
+    if not include_best_laps:
+        return _rows(RACER_COLUMNS, _execute(db.select(*columns)), dates=('created_at', 'updated_at'))
+
+    rows = _execute(
+        db.select(*columns, RacerBestLap.location_id, Location.name, RacerBestLap.condition, RacerBestLap.best_lap)
+        .outerjoin(RacerBestLap, RacerBestLap.racer_id == Racer.id)
+        .outerjoin(Location, RacerBestLap.location_id == Location.id)
+        .order_by(Racer.id, RacerBestLap.id)
+    )
+    keys = [key for key, _ in RACER_COLUMNS]
+    width = len(keys)
+    racers = []
+    racer = locations = None
+    for row in rows:
+        if racer is None or racer['racer_id'] != row[0]:
+            racer = dict(zip(keys, row[:width]))
+            racer['created_at'] = racer['created_at'].isoformat() if racer['created_at'] else None
+            racer['updated_at'] = racer['updated_at'].isoformat() if racer['updated_at'] else None
+            locations = {}
+            racer['best_laps_by_location'] = locations
+            racers.append(racer)
+        location_id, location_name, condition, best_lap = row[width:]
+        if condition is None:
+            continue
+        if location_id not in locations:
+            locations[location_id] = {'location_name': location_name, 'dry': None, 'wet': None, 'indoor': None}
+        locations[location_id][condition] = best_lap
+
+    for racer in racers:
+        racer['best_laps_by_location'] = list(racer['best_laps_by_location'].values())
+    return racers
@@ -0,0 +1,227 @@
+import base64
+import datetime
+import decimal
+import gzip
+import io
+import json
+import os
+import tarfile
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text, types
+from models import db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Point-in-time copy of every table, portable between PostgreSQL and SQLite.
+# A snapshot is a plain tar holding, per table in foreign key order, chunks of
+# CHUNK_ROWS rows as gzipped JSON lines (one array of column values per row),
+# and a manifest.json with the schema revision, columns and chunk names.
+# Restore inserts each chunk with one executemany and then moves PostgreSQL
+# sequences past the restored ids.
+FORMAT_VERSION = 1
+CHUNK_ROWS = int(os.environ.get('SNAPSHOT_CHUNK_ROWS', 10000))
+MANIFEST = 'manifest.json'
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def codec(column_type):
+    """(encode, decode) between a column's Python values and JSON, None when they are the same"""
+    if isinstance(column_type, types.LargeBinary):
+        return (lambda v: base64.b64encode(v).decode('ascii'), base64.b64decode)
+    if isinstance(column_type, types.DateTime):
+        return (lambda v: v.isoformat(), datetime.datetime.fromisoformat)
+    if isinstance(column_type, types.Date):
+        return (lambda v: v.isoformat(), datetime.date.fromisoformat)
+    if isinstance(column_type, types.Numeric) and not isinstance(column_type, types.Float):
+        return (str, decimal.Decimal)
+    return None
+
+
+def converters(columns, index):
+    """Per column function for side `index` (0 encode, 1 decode) of its codec; None values pass through"""
+    functions = []
+    for column in columns:
+        pair = codec(column.type)
+        functions.append(None if pair is None else pair[index])
+    return functions
+
+
+def convert_row(row, functions, nulls):
+    return [
+        null if value is None else value if function is None else function(value)
+        for value, function, null in zip(row, functions, nulls)
+    ]
+
+
+def schema_revision(connection):
+    """Alembic revision of the database, None when it is not managed by migrations"""
+    if not inspect(connection).has_table('alembic_version'):
+        return None
+    return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+
+
+def create_snapshot(path, exclude=(), chunk_rows=CHUNK_ROWS):
+    """Write every table (but `exclude`) to the tar at `path`; returns the manifest"""
+    tables = [table for table in db.metadata.sorted_tables if table.name not in exclude]
+    with db.engine.connect() as connection, tarfile.open(path, 'w') as archive:
+        # One transaction, so on PostgreSQL every table is read from the same point in time
+        with connection.begin():
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'))
+            manifest = {
+                'format': FORMAT_VERSION,
+                'created_at': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'dialect': connection.dialect.name,
+                'revision': schema_revision(connection),
+                'tables': []
+            }
+            for table in tables:
+                columns = list(table.columns)
+                encoders = converters(columns, 0)
+                nulls = [None] * len(columns)
+                entry = {'name': table.name, 'columns': [column.name for column in columns], 'rows': 0, 'chunks': []}
+                result = connection.execution_options(yield_per=chunk_rows).execute(
+                    db.select(table).order_by(*table.primary_key.columns)
+                )
+                for rows in result.partitions():
+                    lines = b'\n'.join(dumps(convert_row(row, encoders, nulls)) for row in rows)
+                    name = f'{table.name}/{len(entry["chunks"]) + 1:06d}.jsonl.gz'
+                    add_member(archive, name, gzip.compress(lines, compresslevel=6))
+                    entry['chunks'].append(name)
+                    entry['rows'] += len(rows)
+                manifest['tables'].append(entry)
+        add_member(archive, MANIFEST, json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+def read_manifest(archive):
+    try:
+        manifest = json.load(archive.extractfile(MANIFEST))
+    except KeyError:
+        raise click.ClickException(f'{MANIFEST} not found: not a snapshot')
+    if manifest.get('format') != FORMAT_VERSION:
+        raise click.ClickException(f'Unsupported snapshot format {manifest.get("format")}')
+    return manifest
+
+
+def reset_sequences(connection, tables):
+    """Move each serial sequence past the highest restored id (PostgreSQL only)"""
+    if connection.dialect.name != 'postgresql':
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    for table in tables:
+        column = table.autoincrement_column
+        if column is None:
+            continue
+        connection.execute(
+            text(f'SELECT setval(pg_get_serial_sequence(:table, :column), COALESCE(MAX({quote(column.name)}), 1), '
+                 f'MAX({quote(column.name)}) IS NOT NULL) FROM {quote(table.name)}'),
+            {'table': table.name, 'column': column.name}
+        )
+
+
+def restore_snapshot(path, force=False, echo=None):
+    """Replace the tables of the snapshot at `path` with its rows, in one transaction; returns the manifest"""
+    try:
+        archive = tarfile.open(path, 'r')
+    except tarfile.ReadError:
+        raise click.ClickException(f'{path} is not a snapshot archive')
+    with archive, db.engine.begin() as connection:
+        manifest = read_manifest(archive)
+        revision = schema_revision(connection)
+        if manifest['revision'] != revision and not force:
+            raise click.ClickException(
+                f'Snapshot is at schema revision {manifest["revision"]} and the database at {revision}: '
+                f'run "flask db upgrade" to the same revision, or use --force'
+            )
+
+        plan = []
+        for entry in manifest['tables']:
+            table = db.metadata.tables.get(entry['name'])
+            if table is None:
+                if not force:
+                    raise click.ClickException(f'Unknown table {entry["name"]}; use --force to skip it')
+                continue
+            unknown = [name for name in entry['columns'] if name not in table.columns]
+            if unknown and not force:
+                raise click.ClickException(f'Unknown columns in {table.name}: {", ".join(unknown)}; '
+                                           f'use --force to skip them')
+            keep = [index for index, name in enumerate(entry['columns']) if name in table.columns]
+            plan.append((table, entry, keep, [table.columns[entry['columns'][index]] for index in keep]))
+
+        for table, _, _, _ in reversed(plan):
+            connection.execute(table.delete())
+        for table, entry, keep, columns in plan:
+            decoders = converters(columns, 1)
+            # None in a JSON column would be stored as the JSON value null
+            nulls = [db.null() if isinstance(column.type, types.JSON) else None for column in columns]
+            names = [column.name for column in columns]
+            for chunk in entry['chunks']:
+                with gzip.open(archive.extractfile(chunk)) as lines:
+                    rows = [
+                        dict(zip(names, convert_row([values[index] for index in keep], decoders, nulls)))
+                        for values in map(loads, lines)
+                    ]
+                if rows:
+                    connection.execute(table.insert(), rows)
+            if echo:
+                echo(f'{table.name}: {entry["rows"]} row(s)')
+        reset_sequences(connection, [table for table, _, _, _ in plan])
+    return manifest
+
+
+snapshot_cli = AppGroup('snapshot', help='Database snapshots.')
+
+
+@snapshot_cli.command('create')
+@click.argument('path', required=False)
+@click.option('--exclude', multiple=True, help='Table to leave out, e.g. --exclude users. Repeatable.')
+@click.option('--chunk-rows', default=CHUNK_ROWS, show_default=True, help='Rows per compressed chunk.')
+def create(path, exclude, chunk_rows):
+    """Dump every table to a snapshot file (snapshot-<timestamp>.tar by default)"""
+    path = path or f'snapshot-{datetime.datetime.utcnow():%Y%m%d-%H%M%S}.tar'
+    unknown = set(exclude) - set(db.metadata.tables)
+    if unknown:
+        raise click.BadParameter(f'unknown table(s): {", ".join(sorted(unknown))}', param_hint='--exclude')
+    started = time.perf_counter()
+    manifest = create_snapshot(path, exclude=set(exclude), chunk_rows=chunk_rows)
+    rows = sum(entry['rows'] for entry in manifest['tables'])
+    click.echo(f'{rows} row(s) of {len(manifest["tables"])} table(s) written to {path} '
+               f'({os.path.getsize(path) / 1024:.0f} KB, {time.perf_counter() - started:.1f}s)')
+
+
+@snapshot_cli.command('restore')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--force', is_flag=True, help='Restore despite a different schema revision, skipping unknown tables and columns.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore(path, force, yes):
+    """Replace the data of the snapshot's tables with its contents"""
+    if not yes:
+        click.confirm(f'This replaces the data of every table in the snapshot at '
+                      f'{db.engine.url.render_as_string()}. Continue?', abort=True)
+    started = time.perf_counter()
+    manifest = restore_snapshot(path, force=force, echo=click.echo)
+    rows = sum(entry['rows'] for entry in manifest['tables'])
+    click.echo(f'{rows} row(s) restored from the {manifest["dialect"]} snapshot of {manifest["created_at"]} '
+               f'in {time.perf_counter() - started:.1f}s')
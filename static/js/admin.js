@@ -157,6 +157,275 @@ function sortTable(tableId, columnIndex, type = 'string') {
     rows.forEach(row => tbody.appendChild(row));
 }
 
+// Escape text for insertion into HTML
+function escapeHtml(value) {
+    if (value === null || value === undefined) return '';
+    return String(value).replace(/[&<>"']/g, c => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[c]);
+}
+
+// Format an ISO date (YYYY-MM-DD...) as DD/MM/YYYY without timezone shifts
+function formatISODate(value) {
+    if (!value) return '-';
+    return value.split('T')[0].split('-').reverse().join('/');
+}
+
+function raceLabel(race) {
+    return `${race.race_name} (${race.date ? formatISODate(race.date) : 'Sem data'})`;
+}
+
+// Server-paginated table. Rows, sorting and filtering come from a JSON endpoint
+// (see grids.py); the current page, sort and filters are kept in the page URL.
+class DataGrid {
+    constructor(options) {
+        this.url = options.url;
+        this.table = document.getElementById(options.table);
+        this.tbody = this.table.querySelector('tbody');
+        this.pagination = document.getElementById(options.pagination);
+        this.renderRow = options.renderRow;
+        this.emptyMessage = options.emptyMessage || 'Nenhum registro encontrado';
+        this.onLoad = options.onLoad || null;
+        this.state = { page: 1, per_page: 25, sort: '', order: '' };
+        this.filters = {};
+        this.rows = new Map();
+        this.controller = null;
+
+        this.table.querySelectorAll('th[data-sort]').forEach(th => {
+            th.classList.add('sortable');
+            th.addEventListener('click', () => this.sortBy(th.dataset.sort));
+        });
+
+        new URLSearchParams(window.location.search).forEach((value, key) => {
+            if (!value) return;
+            if (key === 'page' || key === 'per_page') {
+                this.state[key] = parseInt(value) || this.state[key];
+            } else if (key in this.state) {
+                this.state[key] = value;
+            } else {
+                this.filters[key] = value;
+            }
+        });
+    }
+
+    params() {
+        const params = new URLSearchParams();
+        Object.entries(Object.assign({}, this.state, this.filters)).forEach(([key, value]) => {
+            if (value !== '' && value !== null && value !== undefined) params.set(key, value);
+        });
+        return params;
+    }
+
+    load() {
+        const params = this.params();
+        history.replaceState(null, '', `${window.location.pathname}?${params}`);
+
+        if (this.controller) this.controller.abort();
+        const controller = new AbortController();
+        this.controller = controller;
+        this.table.classList.add('loading');
+
+        return fetch(`${this.url}?${params}`, { signal: controller.signal })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .then(data => {
+                this.controller = null;
+                this.table.classList.remove('loading');
+                Object.assign(this.state, { page: data.page, per_page: data.per_page, sort: data.sort, order: data.order });
+                this.render(data);
+            })
+            .catch(error => {
+                if (error.name === 'AbortError') return;
+                this.table.classList.remove('loading');
+                showNotification('Erro ao carregar dados', 'error');
+                console.error(error);
+            });
+    }
+
+    reload() {
+        return this.load();
+    }
+
+    render(data) {
+        this.rows.clear();
+        data.items.forEach(item => this.rows.set(String(item.id), item));
+
+        const columns = this.table.querySelectorAll('thead th').length;
+        this.tbody.innerHTML = data.items.length
+            ? data.items.map(item => this.renderRow(item)).join('')
+            : `<tr><td colspan="${columns}" class="empty-message">${this.emptyMessage}</td></tr>`;
+
+        this.table.querySelectorAll('th[data-sort]').forEach(th => {
+            th.classList.toggle('sort-asc', th.dataset.sort === data.sort && data.order === 'asc');
+            th.classList.toggle('sort-desc', th.dataset.sort === data.sort && data.order === 'desc');
+        });
+        this.renderPagination(data);
+        if (this.onLoad) this.onLoad(data);
+    }
+
+    renderPagination(data) {
+        if (!this.pagination) return;
+        const first = data.total ? (data.page - 1) * data.per_page + 1 : 0;
+        const last = Math.min(data.page * data.per_page, data.total);
+        const button = (page, icon, disabled) =>
+            `<button class="btn btn-sm btn-secondary" data-page="${page}" ${disabled ? 'disabled' : ''}><i class="fas fa-${icon}"></i></button>`;
+
+        this.pagination.innerHTML = `
+            <div class="grid-info">${first}-${last} de ${data.total}</div>
+            <div class="grid-pages">
+                ${button(1, 'angle-double-left', data.page <= 1)}
+                ${button(data.page - 1, 'angle-left', data.page <= 1)}
+                <span>Pagina ${data.page} de ${data.pages}</span>
+                ${button(data.page + 1, 'angle-right', data.page >= data.pages)}
+                ${button(data.pages, 'angle-double-right', data.page >= data.pages)}
+            </div>
+            <select class="grid-per-page">
+                ${[25, 50, 100].map(n => `<option value="${n}" ${n === data.per_page ? 'selected' : ''}>${n} por pagina</option>`).join('')}
+            </select>
+        `;
+        this.pagination.querySelectorAll('button[data-page]').forEach(b => {
+            b.addEventListener('click', () => this.goTo(parseInt(b.dataset.page)));
+        });
+        this.pagination.querySelector('.grid-per-page').addEventListener('change', e => {
+            this.state.per_page = parseInt(e.target.value);
+            this.goTo(1);
+        });
+    }
+
+    goTo(page) {
+        this.state.page = page;
+        return this.load();
+    }
+
+    sortBy(key) {
+        if (this.state.sort === key) {
+            this.state.order = this.state.order === 'asc' ? 'desc' : 'asc';
+        } else {
+            this.state.sort = key;
+            this.state.order = 'asc';
+        }
+        return this.goTo(1);
+    }
+
+    setFilter(name, value) {
+        if (value) {
+            this.filters[name] = value;
+        } else {
+            delete this.filters[name];
+        }
+        return this.goTo(1);
+    }
+
+    // Wire a text input or a LazySelect to a filter, showing its current value
+    bindFilter(name, control) {
+        const current = this.filters[name] || '';
+        if (control instanceof LazySelect) {
+            if (current) control.resolve(current);
+            control.select.addEventListener('change', () => this.setFilter(name, control.select.value));
+        } else {
+            control.value = current;
+            control.addEventListener('input', debounce(() => this.setFilter(name, control.value.trim()), 300));
+        }
+    }
+
+    row(id) {
+        return this.rows.get(String(id));
+    }
+}
+
+// Option lists fetched from /admin/api/*, shared by every LazySelect on the page
+const optionCache = new Map();
+
+function fetchOptions(url) {
+    if (!optionCache.has(url)) {
+        optionCache.set(url, fetch(url).then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        }).catch(error => {
+            optionCache.delete(url);
+            throw error;
+        }));
+    }
+    return optionCache.get(url);
+}
+
+// <select> filled from an /admin/api/* endpoint the first time it is used,
+// with a search box that queries the endpoint as the user types
+class LazySelect {
+    constructor(select, options) {
+        this.select = typeof select === 'string' ? document.getElementById(select) : select;
+        this.url = options.url;
+        this.label = options.label || (item => item.name);
+        this.limit = options.limit || 50;
+        this.placeholder = this.select.options.length ? this.select.options[0].textContent : 'Selecione...';
+        this.query = null;
+
+        this.search = document.createElement('input');
+        this.search.type = 'search';
+        this.search.className = 'lazy-select-search';
+        this.search.placeholder = options.searchPlaceholder || 'Buscar...';
+        this.select.parentNode.insertBefore(this.search, this.select);
+        this.select.classList.add('lazy-select');
+
+        const load = () => this.load(this.search.value.trim());
+        this.search.addEventListener('input', debounce(load, 250));
+        this.search.addEventListener('focus', load);
+        this.select.addEventListener('focus', load);
+        this.select.addEventListener('pointerenter', load);
+    }
+
+    load(q) {
+        if (this.query === q) return Promise.resolve();
+        this.query = q;
+        const params = new URLSearchParams({ limit: this.limit });
+        if (q) params.set('q', q);
+        return fetchOptions(`${this.url}?${params}`)
+            .then(items => {
+                if (this.query === q) this.render(items);
+            })
+            .catch(error => {
+                this.query = null;
+                console.error(error);
+            });
+    }
+
+    render(items) {
+        const value = this.select.value;
+        const selected = this.select.selectedOptions[0];
+        const options = [new Option(this.placeholder, '')];
+        items.forEach(item => options.push(new Option(this.label(item), item.id)));
+        if (value && !items.some(item => String(item.id) === value)) {
+            options.push(new Option(selected.textContent, value));
+        }
+        this.select.replaceChildren(...options);
+        this.select.value = value;
+    }
+
+    // Select `value`, adding it as an option labelled `label` when not loaded yet
+    setValue(value, label) {
+        value = value === null || value === undefined ? '' : String(value);
+        if (value && !Array.from(this.select.options).some(option => option.value === value)) {
+            this.select.add(new Option(label || `#${value}`, value));
+        }
+        this.select.value = value;
+    }
+
+    // Select `value`, fetching its label from the endpoint
+    resolve(value) {
+        this.setValue(value);
+        return fetchOptions(`${this.url}?id=${encodeURIComponent(value)}`)
+            .then(items => {
+                if (items.length) {
+                    const option = Array.from(this.select.options).find(o => o.value === String(value));
+                    if (option) option.textContent = this.label(items[0]);
+                }
+            })
+            .catch(error => console.error(error));
+    }
+}
+
 // Export functions for global access
 window.openModal = openModal;
 window.closeModal = closeModal;
@@ -170,3 +439,8 @@ window.confirmAction = confirmAction;
 window.validateForm = validateForm;
 window.debounce = debounce;
 window.sortTable = sortTable;
+window.escapeHtml = escapeHtml;
+window.formatISODate = formatISODate;
+window.raceLabel = raceLabel;
+window.DataGrid = DataGrid;
+window.LazySelect = LazySelect;
@@ -1,12 +1,16 @@
 class KartRaceTracker {
     constructor() {
         this.apiBase = '/api';
+        // API responses rendered into the page by the server, each used once
+        const initialData = document.getElementById('initial-data');
+        this.initialData = initialData ? JSON.parse(initialData.textContent) : {};
+        // Open live timing streams by race dropdown index
+        this.liveRaces = {};
         this.init();
     }
 
     async init() {
-        await this.loadDashboard();
-        await this.loadLocations();
+        // Each page loads its own section data on DOMContentLoaded
         this.setupEventListeners();
     }
 
@@ -64,10 +68,19 @@ class KartRaceTracker {
         }
     }
 
+    async getJSON(endpoint) {
+        if (endpoint in this.initialData) {
+            const data = this.initialData[endpoint];
+            delete this.initialData[endpoint];
+            return data;
+        }
+        const response = await fetch(`${this.apiBase}${endpoint}`);
+        return response.json();
+    }
+
     async fetchAPI(endpoint) {
         try {
-            const response = await fetch(`${this.apiBase}${endpoint}`);
-            const data = await response.json();
+            const data = await this.getJSON(endpoint);
             if (data.status === 'success') {
                 return data.data;
             }
@@ -79,9 +92,10 @@ class KartRaceTracker {
     }
 
     async loadDashboard() {
-        const stats = await this.fetchAPI('/stats');
-        const recentRaces = await this.fetchAPI('/recent-races');
-        const fastestByLocation = await this.fetchAPI('/fastest-by-location');
+        const dashboard = await this.fetchAPI('/dashboard');
+        if (!dashboard) return;
+
+        const { stats, recent_races: recentRaces, fastest_by_location: fastestByLocation, top_standings: topStandings } = dashboard;
 
         if (stats) {
             document.getElementById('total-racers').textContent = stats.total_racers;
@@ -95,6 +109,14 @@ class KartRaceTracker {
         if (recentRaces) {
             this.renderRecentRaces(recentRaces);
         }
+
+        if (topStandings && document.getElementById('top-standings-table')) {
+            this.renderTable('top-standings-table', topStandings, [
+                { key: 'name', label: 'Piloto' },
+                { key: 'total_points', label: 'Pontos' },
+                { key: 'wins', label: 'Vitórias' }
+            ], true);
+        }
     }
 
     renderFastestByLocation(data) {
@@ -177,7 +199,7 @@ class KartRaceTracker {
     }
 
     async loadRacers() {
-        const racers = await this.fetchAPI('/racers');
+        const racers = await this.fetchAPI('/racers?include=best_laps');
         if (racers) {
             this.racersData = racers;
             this.renderRacers(racers);
@@ -261,9 +283,9 @@ class KartRaceTracker {
         const container = document.getElementById('races-list');
         container.innerHTML = races.map((race, index) => `
             <div class="race-dropdown">
-                <div class="race-dropdown-header" onclick="app.toggleRaceResults(${index}, ${race.race_id})">
+                <div class="race-dropdown-header" onclick="app.toggleRaceResults(${index}, ${race.race_id}, ${this.isToday(race.date)})">
                     <div class="race-dropdown-info">
-                        <h4>${race.race_name}</h4>
+                        <h4>${race.race_name}${this.isToday(race.date) ? ' <span class="live-badge">AO VIVO</span>' : ''}</h4>
                         <p class="race-meta">
                             <span><i class="fas fa-calendar"></i> ${this.formatDate(race.date)}</span>
                             <span><i class="fas fa-map-marker-alt"></i> ${race.track_name || 'N/A'}</span>
@@ -284,7 +306,7 @@ class KartRaceTracker {
         `).join('');
     }
 
-    async toggleRaceResults(index, raceId) {
+    async toggleRaceResults(index, raceId, live = false) {
         const container = document.getElementById(`race-results-${index}`);
         const icon = document.getElementById(`race-toggle-icon-${index}`);
 
@@ -293,8 +315,10 @@ class KartRaceTracker {
             icon.classList.remove('fa-chevron-down');
             icon.classList.add('fa-chevron-up');
 
-            // Load results if not already loaded
-            if (container.dataset.loaded !== 'true') {
+            if (live && window.EventSource) {
+                this.watchRace(index, raceId, container);
+            } else if (container.dataset.loaded !== 'true') {
+                // Load results if not already loaded
                 const race = await this.fetchAPI(`/races/${raceId}`);
                 if (race && race.results && race.results.length > 0) {
                     container.innerHTML = `
@@ -330,9 +354,90 @@ class KartRaceTracker {
             container.classList.add('collapsed');
             icon.classList.remove('fa-chevron-up');
             icon.classList.add('fa-chevron-down');
+            this.unwatchRace(index);
+        }
+    }
+
+    isToday(dateString) {
+        const today = new Date();
+        const local = `${today.getFullYear()}-${String(today.getMonth() + 1).padStart(2, '0')}-${String(today.getDate()).padStart(2, '0')}`;
+        return dateString === local;
+    }
+
+    // Live timing: the server sends the standings once, then only the fields that change
+    watchRace(index, raceId, container) {
+        if (this.liveRaces[index]) return;
+
+        const race = { source: new EventSource(`${this.apiBase}/races/${raceId}/live`), results: new Map(), bestLap: null };
+        this.liveRaces[index] = race;
+
+        race.source.addEventListener('snapshot', (event) => {
+            const data = JSON.parse(event.data);
+            race.results = new Map(data.results.map(result => [result.id, result]));
+            race.bestLap = data.best_lap;
+            this.renderLiveResults(container, race, new Set());
+        });
+
+        race.source.addEventListener('delta', (event) => {
+            const data = JSON.parse(event.data);
+            const changed = new Set();
+            (data.results || []).forEach(update => {
+                race.results.set(update.id, { ...race.results.get(update.id), ...update });
+                changed.add(update.id);
+            });
+            (data.removed || []).forEach(id => race.results.delete(id));
+            if (data.order) {
+                race.results = new Map(data.order.map(id => [id, race.results.get(id)]));
+            }
+            if ('best_lap' in data) {
+                race.bestLap = data.best_lap;
+            }
+            this.renderLiveResults(container, race, changed);
+        });
+    }
+
+    unwatchRace(index) {
+        const race = this.liveRaces[index];
+        if (race) {
+            race.source.close();
+            delete this.liveRaces[index];
         }
     }
 
+    renderLiveResults(container, race, changed) {
+        if (race.results.size === 0) {
+            container.innerHTML = '<p class="no-results">Aguardando os primeiros resultados...</p>';
+            return;
+        }
+        const bestId = race.bestLap ? race.bestLap.id : null;
+        container.innerHTML = `
+            <table class="race-results-table">
+                <thead>
+                    <tr>
+                        <th>Pos</th>
+                        <th>Piloto</th>
+                        <th>Voltas</th>
+                        <th>Ultima Volta</th>
+                        <th>Melhor Volta</th>
+                        <th>Diferenca</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    ${[...race.results.values()].map((result, position) => `
+                        <tr class="${result.dnf ? 'dnf-row' : ''} ${changed.has(result.id) ? 'live-changed' : ''}">
+                            <td>${result.position || position + 1}</td>
+                            <td>${result.name}${result.dnf ? ' <span class="dnf-badge">DNF</span>' : ''}</td>
+                            <td>${result.laps || '-'}</td>
+                            <td>${result.last_lap || '-'}</td>
+                            <td class="${result.id === bestId ? 'live-best-lap' : ''}">${result.lap_time_best || '-'}</td>
+                            <td>${result.gap || '-'}</td>
+                        </tr>
+                    `).join('')}
+                </tbody>
+            </table>
+        `;
+    }
+
     async loadLeaderboard() {
         const leaderboard = await this.fetchAPI('/leaderboard');
         if (leaderboard) {
@@ -411,8 +516,7 @@ class KartRaceTracker {
 
     async loadAlbums() {
         try {
-            const response = await fetch('/api/albums');
-            const result = await response.json();
+            const result = await this.getJSON('/albums');
 
             if (result.status === 'success' && result.data.length > 0) {
                 this.displayAlbums(result.data);
@@ -441,8 +545,7 @@ class KartRaceTracker {
     async loadVideos() {
         const videosGrid = document.getElementById('videos-grid');
         try {
-            const response = await fetch('/api/videos');
-            const result = await response.json();
+            const result = await this.getJSON('/videos');
 
             if (result.status === 'success' && result.data.length > 0) {
                 videosGrid.innerHTML = result.data.map(video => this.createVideoCard(video)).join('');
@@ -457,8 +560,7 @@ class KartRaceTracker {
 
     async loadPhotosByRace() {
         try {
-            const response = await fetch('/api/photos/by-race');
-            const result = await response.json();
+            const result = await this.getJSON('/photos/by-race');
 
             if (result.status === 'success' && result.data.length > 0) {
                 this.displayPhotosByRace(result.data);
@@ -494,7 +596,7 @@ class KartRaceTracker {
                 <div class="race-photos-grid collapsed" id="race-photos-grid-${index}">
                     ${raceAlbum.photos.map(photo => `
                         <div class="photo-item" onclick="app.openImage('${photo.url}')">
-                            <img src="${photo.url}" alt="${photo.title || 'Foto'}" loading="lazy">
+                            <img src="${photo.thumb_url || photo.url}" alt="${photo.title || 'Foto'}" loading="lazy">
                         </div>
                     `).join('')}
                 </div>
@@ -649,7 +751,7 @@ class KartRaceTracker {
                             ${photos.length > 0 ?
                                 photos.map(item => `
                                     <div class="media-item-modal" onclick="app.openImage('${item.url}')">
-                                        <img src="${item.url}" alt="${item.title || 'Foto'}" loading="lazy">
+                                        <img src="${item.thumb_url || item.url}" alt="${item.title || 'Foto'}" loading="lazy">
                                         ${item.title ? `<div class="media-item-title">${item.title}</div>` : ''}
                                     </div>
                                 `).join('')
@@ -965,8 +1067,7 @@ class KartRaceTracker {
     async loadPhotos() { return; }
     async loadLocations() {
         try {
-            const response = await fetch(`${this.apiBase}/locations`);
-            const locations = await response.json();
+            const locations = await this.getJSON('/locations');
             this.displayLocations(locations);
         } catch (error) {
             console.error('Error loading locations:', error);
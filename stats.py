@@ -0,0 +1,129 @@
+from models import db, Racer, Race, RaceResult, Location, RacerBestLap, LocationFastestLap
+
+
+def parse_lap_time(lap_time_str):
+    try:
+        if ':' in lap_time_str:
+            parts = lap_time_str.split(':')
+            minutes = int(parts[0])
+            seconds = float(parts[1])
+            return minutes * 60 + seconds
+        else:
+            return float(lap_time_str)
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def get_weather_condition(weather):
+    weather = (weather or '').lower()
+    wet_conditions = ['chuvoso', 'molhado', 'wet', 'rain', 'chuva']
+    indoor_conditions = ['indoor', 'coberto', 'fechado']
+
+    if any(cond in weather for cond in indoor_conditions):
+        return 'indoor'
+    elif any(cond in weather for cond in wet_conditions):
+        return 'wet'
+    else:
+        return 'dry'
+
+
+def recalculate_stats():
+    """Rebuild racer totals, best laps and location records from race results.
+
+    Runs in the caller's transaction, which is left to commit. Returns the
+    number of racers, best laps and location records written.
+    """
+    racers = Racer.query.all()
+    locations = Location.query.all()
+    updated_count = 0
+    best_laps_count = 0
+    location_fastest_count = 0
+
+    RacerBestLap.query.delete()
+    LocationFastestLap.query.delete()
+
+    for racer in racers:
+        results = RaceResult.query.filter_by(racer_id=racer.id).all()
+
+        total_races = len(results)
+        wins = sum(1 for r in results if r.position == 1)
+        podiums = sum(1 for r in results if r.position is not None and r.position <= 3)
+
+        racer.total_races = total_races
+        racer.wins = wins
+        racer.podium_finishes = podiums
+        updated_count += 1
+
+        for location in locations:
+            location_results = db.session.query(RaceResult, Race).join(
+                Race, RaceResult.race_id == Race.id
+            ).filter(
+                RaceResult.racer_id == racer.id,
+                Race.location_id == location.id,
+                RaceResult.lap_time_best.isnot(None),
+                RaceResult.lap_time_best != '',
+                RaceResult.lap_time_best != '-'
+            ).all()
+
+            if location_results:
+                condition_bests = {'dry': (None, None), 'wet': (None, None), 'indoor': (None, None)}
+
+                for result, race in location_results:
+                    condition = race.condition
+                    time_seconds = parse_lap_time(result.lap_time_best)
+
+                    if time_seconds is not None:
+                        current_best_time, current_best_lap = condition_bests[condition]
+                        if current_best_time is None or time_seconds < current_best_time:
+                            condition_bests[condition] = (time_seconds, result.lap_time_best)
+
+                for condition, (best_time, best_lap_str) in condition_bests.items():
+                    if best_lap_str:
+                        best_lap = RacerBestLap(
+                            racer_id=racer.id,
+                            location_id=location.id,
+                            condition=condition,
+                            best_lap=best_lap_str,
+                            best_lap_seconds=best_time
+                        )
+                        db.session.add(best_lap)
+                        best_laps_count += 1
+
+    # Calculate fastest lap per location per condition (dry/wet/indoor)
+    for location in locations:
+        for condition in ('dry', 'wet', 'indoor'):
+            results = db.session.query(RaceResult, Racer).join(
+                Racer, RaceResult.racer_id == Racer.id
+            ).join(
+                Race, RaceResult.race_id == Race.id
+            ).filter(
+                Race.location_id == location.id,
+                Race.condition == condition,
+                RaceResult.lap_time_best.isnot(None),
+                RaceResult.lap_time_best != '',
+                RaceResult.lap_time_best != '-'
+            ).all()
+
+            best_time = None
+            best_lap_str = None
+            best_racer_id = None
+
+            for result, racer in results:
+                time_seconds = parse_lap_time(result.lap_time_best)
+                if time_seconds is not None and (best_time is None or time_seconds < best_time):
+                    best_time = time_seconds
+                    best_lap_str = result.lap_time_best
+                    best_racer_id = racer.id
+
+            if best_lap_str and best_racer_id:
+                fastest = LocationFastestLap(
+                    location_id=location.id,
+                    condition=condition,
+                    racer_id=best_racer_id,
+                    best_lap=best_lap_str,
+                    best_lap_seconds=best_time
+                )
+                db.session.add(fastest)
+                location_fastest_count += 1
+
+    return updated_count, best_laps_count, location_fastest_count